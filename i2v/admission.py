@@ -0,0 +1,336 @@
+import time
+import heapq
+import logging
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+# 优先级类别，数值越小越先提交
+PRIORITIES = {'high': 0, 'normal': 1, 'low': 2}
+
+# submit_func的返回值
+SUBMIT_OK = 'ok'  # 已提交，占用并发名额直到release()
+SUBMIT_THROTTLED = 'throttled'  # DashScope返回限流，重新排队并暂停提交
+SUBMIT_FAILED = 'failed'  # 提交失败，任务已标记为失败
+SUBMIT_SKIPPED = 'skipped'  # 任务已由其他进程提交，只释放名额
+
+
+def parse_model_limits(value, default=5):
+    """解析 "5,wan2.2-i2v-plus=2" 形式的配置，返回 (默认上限, {模型: 上限})"""
+    limits = {}
+    for item in (value or '').split(','):
+        item = item.strip()
+        if not item:
+            continue
+        if '=' in item:
+            model, limit = item.split('=', 1)
+            limits[model.strip()] = int(limit)
+        else:
+            default = int(item)
+    return default, limits
+
+
+class TokenBucket:
+    """令牌桶限速，rate为每秒补充的令牌数，burst为桶容量；rate为0表示不限速"""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = max(1.0, burst)
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+
+    def _refill(self, now):
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def try_take(self):
+        if not self.rate:
+            return True
+        self._refill(time.monotonic())
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return True
+        return False
+
+    def wait_time(self):
+        """距离下一个令牌可用的秒数"""
+        if not self.rate:
+            return 0.0
+        self._refill(time.monotonic())
+        return max(0.0, (1 - self._tokens) / self.rate)
+
+
+class AdmissionController:
+    """DashScope任务提交的准入控制
+
+    所有提交共享一个令牌桶限制QPS，每个模型限制同时在DashScope上处理中的任务数。
+    有余量时请求直接提交（try_admit），否则进入按 (优先级, 入队顺序) 排序的本地队列，
+    由调度线程在令牌和并发名额可用时交给提交线程池执行。
+    队列和名额只保存在内存中，重启后由调用方根据任务记录恢复（mark_inflight/enqueue）。
+    多进程部署时传入shared（cluster.SharedAdmissionLimits），令牌桶和并发名额改为在所有进程间共享，
+    本进程内存中的名额只用于选择下一个提交的任务。
+    """
+
+    def __init__(self, submit_func, qps=5.0, burst=5, default_limit=5, model_limits=None,
+                 max_queue=1000, workers=2, throttle_pause=5.0, shared=None):
+        self.submit_func = submit_func
+        self.default_limit = default_limit
+        self.model_limits = model_limits or {}
+        self.max_queue = max_queue
+        self.throttle_pause = throttle_pause
+        self._bucket = TokenBucket(qps, burst)
+        self.shared = shared
+        self._blocked = {}  # 模型 -> 其他进程占满并发名额时，下次检查的时间
+        self._cond = threading.Condition()
+        self._queues = defaultdict(list)  # 模型 -> [(优先级, 序号, task_id)] 最小堆
+        self._queued = {}  # task_id -> (模型, 优先级, 序号)
+        self._inflight = defaultdict(set)  # 模型 -> 已提交且未完成的task_id
+        self._inflight_models = {}  # task_id -> 模型
+        self._seq = 0
+        self._paused_until = 0.0
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='submit')
+        self._thread = None
+        self.admitted = 0
+        self.queued_total = 0
+        self.throttled = 0
+
+    def start(self):
+        with self._cond:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._dispatch_loop, name='admission', daemon=True)
+                self._thread.start()
+
+    def limit_for(self, model):
+        return self.model_limits.get(model, self.default_limit)
+
+    def _has_capacity_locked(self, model):
+        if model in self._blocked:
+            if time.monotonic() < self._blocked[model]:
+                return False
+            del self._blocked[model]
+        limit = self.limit_for(model)
+        return not limit or len(self._inflight[model]) < limit
+
+    def _acquire_shared(self, task_id, model):
+        """在共享存储中消耗一个令牌并占用并发名额，返回 (是否成功, 等待秒数)
+
+        共享存储的写事务涉及磁盘IO，调用方不能持有_cond，否则position()和release()都要等待。
+        共享名额被其他进程占满时暂时跳过该模型，等待秒数为None。
+        """
+        ok, wait = self.shared.try_acquire(task_id, model, self.limit_for(model))
+        if not ok and wait is None:
+            with self._cond:
+                self._blocked[model] = time.monotonic() + self.shared.retry_interval
+        return ok, wait
+
+    def _blocked_wait_locked(self):
+        """所有排队的模型都没有名额时，距离最早重新检查共享名额的秒数；没有需要重新检查的模型时返回None"""
+        if not self._blocked:
+            return None
+        return max(0.0, min(self._blocked.values()) - time.monotonic())
+
+    def is_full(self):
+        with self._cond:
+            return len(self._queued) >= self.max_queue
+
+    def remaining(self):
+        """队列剩余可排队的任务数"""
+        with self._cond:
+            return max(0, self.max_queue - len(self._queued))
+
+    def try_admit(self, task_id, model):
+        """有余量且该模型没有排队中的任务时占用名额并返回True，调用方随后直接提交"""
+        with self._cond:
+            if (self._queues[model] or time.monotonic() < self._paused_until
+                    or not self._has_capacity_locked(model)):
+                return False
+            if self.shared is None:
+                if not self._bucket.try_take():
+                    return False
+                self._add_inflight_locked(task_id, model)
+                self.admitted += 1
+                return True
+            # 获取共享名额期间先占用本进程的名额，并发的请求不会超过本进程的上限
+            self._add_inflight_locked(task_id, model)
+        ok = self._acquire_shared(task_id, model)[0]
+        with self._cond:
+            if ok:
+                self.admitted += 1
+            else:
+                self._remove_inflight_locked(task_id)
+                self._cond.notify()
+        return ok
+
+    def enqueue(self, task_id, model, priority='normal'):
+        """加入排队，返回在该模型队列中的位置（从1开始）"""
+        with self._cond:
+            self._seq += 1
+            self._push_locked(task_id, model, PRIORITIES.get(priority, PRIORITIES['normal']), self._seq)
+            self.queued_total += 1
+            self._cond.notify()
+            return self._position_locked(task_id)
+
+    def _push_locked(self, task_id, model, priority, seq):
+        heapq.heappush(self._queues[model], (priority, seq, task_id))
+        self._queued[task_id] = (model, priority, seq)
+
+    def requeue_throttled(self, task_id, model, priority='normal', seq=None):
+        """DashScope返回限流时释放名额，任务重新排队，所有提交暂停一段时间
+
+        seq为任务原来的入队序号，重新排队后保持原来的位置；直接提交的任务没有序号，排在队首。
+        """
+        with self._cond:
+            if self._remove_inflight_locked(task_id) and self.shared is not None:
+                self.shared.release(task_id)
+            if seq is None:
+                seq = min((entry[2] for entry in self._queued.values()), default=0) - 1
+            if isinstance(priority, str):
+                priority = PRIORITIES.get(priority, PRIORITIES['normal'])
+            self._push_locked(task_id, model, priority, seq)
+            self._paused_until = time.monotonic() + self.throttle_pause
+            self.throttled += 1
+            self._cond.notify()
+            return self._position_locked(task_id)
+
+    def mark_inflight(self, task_id, model):
+        """记录已在DashScope上处理中的任务（重启后恢复）"""
+        with self._cond:
+            added = task_id not in self._inflight_models
+            self._add_inflight_locked(task_id, model)
+        if added and self.shared is not None:
+            self.shared.reserve(task_id, model)
+
+    def release(self, task_id):
+        """任务完成或提交失败，释放并发名额；不占用名额的任务调用时无影响"""
+        with self._cond:
+            released = self._remove_inflight_locked(task_id)
+            if released:
+                self._cond.notify()
+        if released and self.shared is not None:
+            self.shared.release(task_id)
+
+    def cancel(self, task_id):
+        """从队列中移除尚未提交的任务"""
+        with self._cond:
+            entry = self._queued.pop(task_id, None)
+            if entry is None:
+                return False
+            model = entry[0]
+            self._queues[model] = [item for item in self._queues[model] if item[2] != task_id]
+            heapq.heapify(self._queues[model])
+            return True
+
+    def _add_inflight_locked(self, task_id, model):
+        self._inflight[model].add(task_id)
+        self._inflight_models[task_id] = model
+
+    def _remove_inflight_locked(self, task_id):
+        model = self._inflight_models.pop(task_id, None)
+        if model is None:
+            return False
+        self._inflight[model].discard(task_id)
+        return True
+
+    def position(self, task_id):
+        """任务在其模型队列中的位置（从1开始），不在队列中时返回None"""
+        with self._cond:
+            return self._position_locked(task_id)
+
+    def _position_locked(self, task_id):
+        entry = self._queued.get(task_id)
+        if entry is None:
+            return None
+        model, priority, seq = entry
+        return 1 + sum(1 for p, s, _ in self._queues[model] if (p, s) < (priority, seq))
+
+    def _next_ready_locked(self):
+        """选出可以提交的任务：在有并发名额的模型中取 (优先级, 序号) 最小的队首"""
+        best = None
+        for model, queue in self._queues.items():
+            if queue and self._has_capacity_locked(model):
+                if best is None or queue[0][:2] < self._queues[best][0][:2]:
+                    best = model
+        return best
+
+    def _wait_ready_locked(self):
+        """等待到有可以提交的任务，返回 (模型, 队首的task_id)
+
+        单进程时同时消耗本地令牌；多进程时令牌和共享名额由调用方在释放_cond后获取。
+        """
+        while True:
+            now = time.monotonic()
+            model = self._next_ready_locked()
+            if model is None:
+                self._cond.wait(self._blocked_wait_locked())
+                continue
+            if now < self._paused_until:
+                self._cond.wait(self._paused_until - now)
+                continue
+            if self.shared is None and not self._bucket.try_take():
+                self._cond.wait(self._bucket.wait_time())
+                continue
+            return model, self._queues[model][0][2]
+
+    def _dequeue_locked(self, task_id, model):
+        """把任务移出队列并占用本进程的并发名额，返回 (优先级, 序号)；任务已不在队列中时返回None"""
+        entry = self._queued.pop(task_id, None)
+        if entry is None:
+            return None
+        _, priority, seq = entry
+        queue = self._queues[model]
+        if queue[0][2] == task_id:
+            heapq.heappop(queue)
+        else:
+            # 获取共享名额期间有优先级更高的任务入队
+            queue.remove((priority, seq, task_id))
+            heapq.heapify(queue)
+        self._add_inflight_locked(task_id, model)
+        self.admitted += 1
+        return priority, seq
+
+    def _dispatch_loop(self):
+        while True:
+            with self._cond:
+                model, task_id = self._wait_ready_locked()
+                if self.shared is None:
+                    entry = self._dequeue_locked(task_id, model)
+            if self.shared is not None:
+                ok, wait = self._acquire_shared(task_id, model)
+                if not ok:
+                    if wait is not None:
+                        with self._cond:
+                            self._cond.wait(wait)
+                    continue
+                with self._cond:
+                    entry = self._dequeue_locked(task_id, model)
+                if entry is None:
+                    # 获取名额期间任务已被取消
+                    self.shared.release(task_id)
+                    continue
+            priority, seq = entry
+            self._executor.submit(self._run_submit, task_id, model, priority, seq)
+
+    def _run_submit(self, task_id, model, priority, seq):
+        try:
+            result = self.submit_func(task_id)
+        except Exception:
+            logger.exception("提交排队任务 %s 时出错", task_id, extra={'task_id': task_id})
+            result = SUBMIT_FAILED
+        if result == SUBMIT_THROTTLED:
+            self.requeue_throttled(task_id, model, priority, seq)
+        elif result != SUBMIT_OK:
+            self.release(task_id)
+
+    def stats(self):
+        with self._cond:
+            return {
+                'queued': len(self._queued),
+                'queued_by_model': {m: len(q) for m, q in self._queues.items() if q},
+                'inflight_by_model': {m: len(s) for m, s in self._inflight.items() if s},
+                'admitted': self.admitted,
+                'queued_total': self.queued_total,
+                'throttled': self.throttled,
+                'paused': time.monotonic() < self._paused_until,
+            }
@@ -2,24 +2,65 @@ import os
 import uuid
 import json
 import time
+import random
 import base64
 import threading
+import bisect
+import functools
+import logging
 import requests
-from datetime import datetime
-from flask import Flask, request, jsonify, render_template, send_file, Response, redirect
-from werkzeug.utils import secure_filename
+from collections import OrderedDict
+from concurrent.futures import TimeoutError as FuturesTimeoutError
+from datetime import datetime, timedelta
+from urllib.parse import quote
+from flask import Flask, request, jsonify, render_template, send_file, Response, redirect, g
 from dotenv import load_dotenv
+from logs import setup_logging, log_context, bind_log_context, reset_log_context, log_stats
+from metrics import MetricsRegistry, TimedLock
+from scheduler import PollScheduler
+from storage import create_task_store
+from sse import SSEHub, format_sse
+from http_client import HttpClient, Base64JsonBody
+from uploads import UploadStore, FileTooLargeError
+from result_cache import ResultCache, DiskLRU, generation_cache_key
+from downloader import VideoDownloader
+from admission import (AdmissionController, PRIORITIES, SUBMIT_OK, SUBMIT_THROTTLED, SUBMIT_FAILED,
+                       SUBMIT_SKIPPED, parse_model_limits)
+from cluster import LeaseManager, ClusterSync, SharedAdmissionLimits, make_worker_id, wait_for_path
+from eta import LatencyModel, generation_started_at
+from waiters import VersionWaiters
+from records import TaskRecord
+from startup import StartupProgress
+from archive import TaskArchive
+from retention import CompactionService, list_files, select_evictions
+from thumbnails import ThumbnailCache
+from compression import ResponseCompressor
+from json_provider import FastJSONProvider
 
 # 加载环境变量
 load_dotenv()
 
+# 日志配置：日志写入有界队列，由后台线程格式化为JSON行输出，不阻塞请求和轮询线程
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO')
+LOG_FORMAT = os.environ.get('LOG_FORMAT', 'json')  # json 或 text
+LOG_SAMPLE_RATE = float(os.environ.get('LOG_SAMPLE_RATE', 0.1))  # 每次轮询等高频调试日志的采样比例
+LOG_QUEUE_SIZE = int(os.environ.get('LOG_QUEUE_SIZE', 10000))  # 日志队列长度，队列满时丢弃日志
+setup_logging(LOG_LEVEL, LOG_FORMAT, LOG_SAMPLE_RATE, LOG_QUEUE_SIZE)
+logger = logging.getLogger('i2v')
+
 # 初始化Flask应用
 app = Flask(__name__)
+# JSON响应不排序键、中文不转义，安装了orjson时用orjson序列化
+app.json = FastJSONProvider(app)
+# 启动预热进度（任务加载和恢复在后台进行，期间即可响应 /healthz、/readyz 和单个任务的查询）
+startup = StartupProgress()
 
 # 配置
 UPLOAD_FOLDER = os.environ.get('UPLOAD_FOLDER', 'uploads')
 OUTPUT_FOLDER = os.environ.get('OUTPUT_FOLDER', 'downloads')
 TASKS_FILE = os.environ.get('TASKS_FILE', 'tasks.json')
+TASK_STORE = os.environ.get('TASK_STORE', 'sqlite')  # 任务存储后端: sqlite 或 json（json每次写入都重写整个文件，只用于开发）
+TASK_DB = os.environ.get('TASK_DB', 'tasks.db')
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg'}
 MAX_FILE_SIZE = int(os.environ.get('MAX_FILE_SIZE', 10 * 1024 * 1024))  # 10MB
 
@@ -31,27 +72,227 @@ app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 app.config['OUTPUT_FOLDER'] = OUTPUT_FOLDER
 app.config['MAX_FILE_SIZE'] = MAX_FILE_SIZE
 
+# 文件发送方式：默认由WSGI服务器发送（Gunicorn使用sendfile），
+# x-sendfile 交给Apache/lighttpd，x-accel 交给Nginx（需配置internal location）
+SENDFILE_MODE = os.environ.get('SENDFILE_MODE', '').lower()
+X_ACCEL_PREFIX = os.environ.get('X_ACCEL_PREFIX', '/protected')  # Nginx internal location前缀
+X_ACCEL_ROOT = os.environ.get('X_ACCEL_ROOT', '.')  # 与X_ACCEL_PREFIX对应的本地目录
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600  # 不可变文件（生成的视频、按哈希保存的图片）的缓存时间
+app.config['USE_X_SENDFILE'] = SENDFILE_MODE == 'x-sendfile'
+
+# 运行指标（Prometheus文本格式，通过 /metrics 导出）
+metrics = MetricsRegistry(prefix='i2v_')
+SUBMIT_LATENCY = metrics.histogram('submit_latency_seconds', '提交视频生成任务到DashScope的耗时',
+                                   ['model', 'http_status'])
+POLL_RTT = metrics.histogram('poll_rtt_seconds', '查询DashScope任务状态的请求耗时')
+POLL_STATUS = metrics.counter('poll_status_total', '任务状态查询结果（任务状态或HTTP错误）', ['status'])
+TASK_DURATION = metrics.histogram('task_duration_seconds', '任务从创建到完成（视频下载到本地）的总耗时',
+                                  ['model', 'resolution', 'status'])
+DOWNLOAD_DURATION = metrics.histogram('download_duration_seconds', '视频下载耗时')
+DOWNLOAD_BYTES = metrics.counter('download_bytes_total', '下载的视频字节数')
+DOWNLOAD_FAILURES = metrics.counter('download_failures_total', '视频下载失败次数')
+TASK_SAVE_DURATION = metrics.histogram('task_save_duration_seconds', '保存单个任务（更新索引、发布事件、写入存储）的耗时')
+TASKS_LOCK_WAIT = metrics.histogram('tasks_lock_wait_seconds', '等待tasks_lock的时间',
+                                    buckets=(0.0, 0.0001, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0))
+
 # 任务存储 (在生产环境中应使用数据库)
 tasks = {}
-tasks_lock = threading.Lock()  # 添加线程锁以确保线程安全
+tasks_lock = TimedLock(threading.Lock(), TASKS_LOCK_WAIT)  # 添加线程锁以确保线程安全，并记录等待时间
+# 任务内存索引（均由tasks_lock保护）
+tasks_version = 0  # 全局任务版本号，每次任务变化递增
+tasks_order = []  # 按 (created_at, id) 升序排列，用于分页
+task_changes = OrderedDict()  # task_id -> 版本号，按版本号升序排列，用于增量查询（已移除的任务保留为删除标记）
+task_removals = OrderedDict()  # 已归档移出内存的task_id -> 移除时的版本号，按版本号升序排列
+removals_floor = 0  # 早于该版本号的删除标记已丢弃，since更早的增量查询需要重新加载列表
+TASK_REMOVALS_MAX = 10000  # 最多保留的删除标记数
+batch_tasks = {}  # batch_id -> 该批次的task_id列表（按创建顺序）
+# 任务持久化后端，sqlite模式下首次启动会自动导入旧的TASKS_FILE
+task_store = create_task_store(TASK_STORE, TASK_DB, TASKS_FILE)
 
 # DashScope API配置
 DASHSCOPE_API_KEY = os.environ.get('DASHSCOPE_API_KEY', 'YOUR_API_KEY_HERE')
-DASHSCOPE_BASE_URL = 'https://dashscope.aliyuncs.com/api/v1'
+DASHSCOPE_BASE_URL = os.environ.get('DASHSCOPE_BASE_URL', 'https://dashscope.aliyuncs.com/api/v1')  # 压测时可指向本地模拟API
+
+# 各模型支持的分辨率
+MODEL_RESOLUTIONS = {
+    'wan2.2-i2v-plus': ['480P', '1080P'],
+    'wan2.2-i2v-flash': ['480P', '720P'],
+    'wanx2.1-i2v-plus': ['720P'],
+    'wanx2.1-i2v-turbo': ['480P', '720P']
+}
+
+# 上传文件按内容哈希存储，并缓存热点图片的base64编码
+UPLOAD_CACHE_BYTES = int(os.environ.get('UPLOAD_CACHE_BYTES', 64 * 1024 * 1024))
+upload_store = UploadStore(UPLOAD_FOLDER, max_size=MAX_FILE_SIZE, cache_bytes=UPLOAD_CACHE_BYTES)
+
+# 生成结果缓存：相同图片和参数的请求复用已有任务
+RESULT_CACHE_ENABLED = os.environ.get('RESULT_CACHE_ENABLED', 'True').lower() == 'true'
+RESULT_CACHE_WAIT = float(os.environ.get('RESULT_CACHE_WAIT', 60))  # 等待相同请求提交完成的最长时间(秒)
+OUTPUT_MAX_BYTES = int(os.environ.get('OUTPUT_MAX_BYTES', 0))  # 输出视频占用磁盘上限，0表示不限制
+result_cache = ResultCache()
+output_lru = DiskLRU(OUTPUT_MAX_BYTES)
+
+# 数据保留：已结束的旧任务移入压缩归档（仍可按ID查询和下载），输入图片和输出视频按时间或磁盘上限清理
+ARCHIVE_DB = os.environ.get('ARCHIVE_DB', 'archive.db')
+TASK_ARCHIVE_AFTER_DAYS = float(os.environ.get('TASK_ARCHIVE_AFTER_DAYS', 7))  # 结束超过该天数的任务移入归档，0表示不按时间归档
+HOT_TASKS_MAX = int(os.environ.get('HOT_TASKS_MAX', 5000))  # 内存中最多保留的已结束任务数，超出时归档最旧的任务，0表示不限制
+ARCHIVE_SEGMENT_SIZE = int(os.environ.get('ARCHIVE_SEGMENT_SIZE', 500))  # 每个压缩归档段的任务数
+OUTPUT_MAX_AGE_DAYS = float(os.environ.get('OUTPUT_MAX_AGE_DAYS', 0))  # 输出视频保留天数，0表示不按时间清理
+UPLOAD_MAX_BYTES = int(os.environ.get('UPLOAD_MAX_BYTES', 0))  # 输入图片占用磁盘上限，0表示不限制
+UPLOAD_MAX_AGE_DAYS = float(os.environ.get('UPLOAD_MAX_AGE_DAYS', 0))  # 输入图片保留天数，0表示不按时间清理
+UPLOAD_GRACE_PERIOD = 3600  # 最近一小时内上传的图片可能正在创建或提交任务，不清理
+VIDEO_URL_TTL = float(os.environ.get('VIDEO_URL_TTL', 24 * 3600))  # DashScope视频链接有效期(秒)，过期后已清理的视频无法重新下载
+COMPACTION_INTERVAL = float(os.environ.get('COMPACTION_INTERVAL', 600))  # 归档和磁盘清理的执行间隔(秒)，0表示不执行
+task_archive = TaskArchive(ARCHIVE_DB)
+
+# 缩略图配置（图片缩略图需要Pillow，视频封面需要ffmpeg，缺少时回退到原文件）
+THUMBNAIL_FOLDER = os.environ.get('THUMBNAIL_FOLDER', 'thumbnails')
+THUMBNAIL_SIZE = int(os.environ.get('THUMBNAIL_SIZE', 400))  # 缩略图最长边像素
+THUMBNAIL_MAX_BYTES = int(os.environ.get('THUMBNAIL_MAX_BYTES', 256 * 1024 * 1024))
+thumbnail_cache = ThumbnailCache(THUMBNAIL_FOLDER, size=THUMBNAIL_SIZE, max_bytes=THUMBNAIL_MAX_BYTES)
+
+# HTTP客户端配置（DashScope API和视频下载共用连接池）
+HTTP_POOL_CONNECTIONS = int(os.environ.get('HTTP_POOL_CONNECTIONS', 4))  # 缓存连接池的主机数量
+HTTP_POOL_SIZE = int(os.environ.get('HTTP_POOL_SIZE', 20))  # 每个主机保持的最大连接数
+HTTP_CONNECT_TIMEOUT = float(os.environ.get('HTTP_CONNECT_TIMEOUT', 5))
+HTTP_READ_TIMEOUT = float(os.environ.get('HTTP_READ_TIMEOUT', 30))
+HTTP_MAX_RETRIES = int(os.environ.get('HTTP_MAX_RETRIES', 3))  # 幂等请求的最大重试次数
+HTTP_RETRY_BACKOFF = float(os.environ.get('HTTP_RETRY_BACKOFF', 0.5))  # 重试退避基数(秒)
+
+http_client = HttpClient(
+    pool_connections=HTTP_POOL_CONNECTIONS,
+    pool_maxsize=HTTP_POOL_SIZE,
+    connect_timeout=HTTP_CONNECT_TIMEOUT,
+    read_timeout=HTTP_READ_TIMEOUT,
+    max_retries=HTTP_MAX_RETRIES,
+    backoff=HTTP_RETRY_BACKOFF,
+)
 
-# 存储SSE连接的客户端
-import queue
-sse_clients = set()
+# 视频下载配置
+DOWNLOAD_WORKERS = int(os.environ.get('DOWNLOAD_WORKERS', 2))  # 同时进行的视频下载数
+DOWNLOAD_SEGMENT_SIZE = int(os.environ.get('DOWNLOAD_SEGMENT_SIZE', 8 * 1024 * 1024))  # Range分段大小
+DOWNLOAD_SEGMENT_WORKERS = int(os.environ.get('DOWNLOAD_SEGMENT_WORKERS', 4))  # 每个下载的并行分段数
+DOWNLOAD_WAIT_TIMEOUT = float(os.environ.get('DOWNLOAD_WAIT_TIMEOUT', 120))  # /download等待后台下载的最长时间(秒)
+video_downloader = VideoDownloader(http_client, workers=DOWNLOAD_WORKERS,
+                                   segment_size=DOWNLOAD_SEGMENT_SIZE,
+                                   segment_workers=DOWNLOAD_SEGMENT_WORKERS)
+
+# 提交准入控制：限制提交QPS和每个模型同时处理中的任务数，超出时在本地排队
+SUBMIT_QPS = float(os.environ.get('SUBMIT_QPS', 2))  # 每秒最多提交的任务数，0表示不限制
+SUBMIT_BURST = int(os.environ.get('SUBMIT_BURST', 5))  # 令牌桶容量，允许的瞬时提交数
+# 每个模型同时处理中的任务上限，例如 "5,wan2.2-i2v-plus=2"，0表示不限制
+MODEL_MAX_INFLIGHT, MODEL_INFLIGHT_LIMITS = parse_model_limits(os.environ.get('MODEL_MAX_INFLIGHT', '5'))
+SUBMIT_QUEUE_MAX = int(os.environ.get('SUBMIT_QUEUE_MAX', 1000))  # 排队任务上限，超出时返回429
+SUBMIT_WORKERS = int(os.environ.get('SUBMIT_WORKERS', 2))  # 提交排队任务的线程数
+SUBMIT_THROTTLE_PAUSE = float(os.environ.get('SUBMIT_THROTTLE_PAUSE', 5))  # DashScope限流后暂停提交的秒数
+BATCH_MAX_TASKS = int(os.environ.get('BATCH_MAX_TASKS', 200))  # 单个批量请求最多创建的任务数
+
+# 任务列表分页配置
+TASKS_PAGE_SIZE = int(os.environ.get('TASKS_PAGE_SIZE', 50))
+TASKS_PAGE_MAX = int(os.environ.get('TASKS_PAGE_MAX', 500))
+
+# 响应压缩配置：按Accept-Encoding使用brotli（需安装Brotli）或gzip压缩JSON和页面
+RESPONSE_COMPRESSION = os.environ.get('RESPONSE_COMPRESSION', 'True').lower() == 'true'  # 由Nginx等反向代理压缩时可关闭
+COMPRESS_MIN_SIZE = int(os.environ.get('COMPRESS_MIN_SIZE', 1024))  # 小于该字节数的响应不压缩
+COMPRESS_GZIP_LEVEL = int(os.environ.get('COMPRESS_GZIP_LEVEL', 3))  # 1-3使用快速压缩，压缩率与更高级别相差约一成
+COMPRESS_BROTLI_QUALITY = int(os.environ.get('COMPRESS_BROTLI_QUALITY', 4))
+response_compressor = ResponseCompressor(min_size=COMPRESS_MIN_SIZE, gzip_level=COMPRESS_GZIP_LEVEL,
+                                         brotli_quality=COMPRESS_BROTLI_QUALITY)
+
+# 任务状态轮询配置
+POLL_INTERVAL = float(os.environ.get('POLL_INTERVAL', 5))  # 每个任务的检查间隔(秒)
+POLL_JITTER = float(os.environ.get('POLL_JITTER', 1))  # 检查时间的随机抖动(秒)
+POLL_WORKERS = int(os.environ.get('POLL_WORKERS', 4))  # 轮询工作线程数量
+POLL_MAX_ERRORS = int(os.environ.get('POLL_MAX_ERRORS', 5))  # 查询状态连续出现意外错误（如响应格式异常）的次数上限，超过后任务标记为失败
+RESUME_POLL_RATE = float(os.environ.get('RESUME_POLL_RATE', 10))  # 重启后恢复的任务每秒首次检查的数量，0表示在一个检查间隔内随机分散
+# 自适应轮询：根据已完成任务的耗时估计完成时间，预计完成前稀疏查询，接近完成时密集查询
+POLL_ADAPTIVE = os.environ.get('POLL_ADAPTIVE', 'True').lower() == 'true'
+POLL_MIN_INTERVAL = float(os.environ.get('POLL_MIN_INTERVAL', 2))  # 接近预计完成时间时的检查间隔(秒)
+POLL_MAX_INTERVAL = float(os.environ.get('POLL_MAX_INTERVAL', 60))  # 检查间隔上限(秒)
+ETA_HISTORY_SIZE = int(os.environ.get('ETA_HISTORY_SIZE', 200))  # 每个模型和分辨率保留的耗时样本数
+latency_model = LatencyModel(history=ETA_HISTORY_SIZE, min_interval=POLL_MIN_INTERVAL,
+                             max_interval=POLL_MAX_INTERVAL)
+
+# SSE配置
+SSE_REPLAY_SIZE = int(os.environ.get('SSE_REPLAY_SIZE', 1000))  # 事件重放缓冲区大小
+SSE_CLIENT_BUFFER = int(os.environ.get('SSE_CLIENT_BUFFER', 256))  # 每个客户端最多积压的消息数
+SSE_HEARTBEAT_INTERVAL = float(os.environ.get('SSE_HEARTBEAT_INTERVAL', 25))  # 空闲时心跳间隔(秒)
+# SSE广播中心，管理所有客户端连接和事件重放
+sse_hub = SSEHub(replay_size=SSE_REPLAY_SIZE, client_buffer=SSE_CLIENT_BUFFER)
+# 非终态任务上次发布的列表字段，用于计算变化的字段
+last_published_tasks = {}
+# 任务列表页展示的字段：页面请求/tasks时作为fields参数，SSE任务变化事件也只包含这些字段，
+# 不向客户端推送服务器上的文件路径、视频链接、DashScope任务ID等
+TASK_LIST_FIELDS = ('status', 'prompt', 'negative_prompt', 'model', 'resolution', 'prompt_extend', 'created_at',
+                    'has_input', 'has_output', 'thumbnail_url', 'poster_url', 'error', 'message')
+
+# /status 长轮询：?wait=秒数&version=版本号 时阻塞到任务版本变化或超时
+STATUS_WAIT_MAX = float(os.environ.get('STATUS_WAIT_MAX', 30))  # 单次长轮询的最长等待时间(秒)
+status_waiters = VersionWaiters()
+
+# 多进程部署（gunicorn -w N）：各进程通过共享的SQLite任务库同步任务变化，
+# 每个任务只由持有轮询租约的进程查询状态，视频只由持有下载租约的进程下载
+MULTI_WORKER = os.environ.get('MULTI_WORKER', 'False').lower() == 'true'
+CLUSTER_SYNC_INTERVAL = float(os.environ.get('CLUSTER_SYNC_INTERVAL', 0.2))  # 读取其他进程任务变化的间隔(秒)
+POLL_LEASE_TTL = float(os.environ.get('POLL_LEASE_TTL', 30))  # 轮询租约时长(秒)，持有进程退出后由其他进程接管
+SUBMIT_LEASE_TTL = 300  # 提交租约时长(秒)，防止同一排队任务被多个进程重复提交
+DOWNLOAD_LEASE_TTL = 600  # 下载租约时长(秒)，其他进程在此期间等待视频文件出现
+if MULTI_WORKER and TASK_STORE != 'sqlite':
+    raise ValueError('MULTI_WORKER=true 需要使用 TASK_STORE=sqlite')
+WORKER_ID = make_worker_id()
+leases = LeaseManager(task_store, WORKER_ID, ttl=POLL_LEASE_TTL)
+# 轮询租约需要覆盖两次检查之间的最长间隔，否则持有进程正常运行时租约也会过期
+POLL_LEASE_HOLD = POLL_LEASE_TTL + (POLL_MAX_INTERVAL if POLL_ADAPTIVE else POLL_INTERVAL)
 
 def initialize_app():
-    """初始化应用"""
-    print("初始化应用...")
-    # 加载已存在的任务
-    load_tasks()
-    
-    # 恢复未完成的任务
-    resume_pending_tasks()
-    print("应用初始化完成")
+    """初始化应用
+
+    只启动后台线程，不等待任务加载：导入应用后立即可以处理HTTP请求，
+    任务加载和恢复在预热线程中进行，完成前 /readyz 返回503。
+    """
+    logger.info("初始化应用...")
+    # 启动任务状态轮询调度器和提交队列
+    poll_scheduler.start()
+    admission.start()
+    threading.Thread(target=warm_up, name='warm-up', daemon=True).start()
+
+def warm_up():
+    """预热：加载任务、恢复未完成的任务和视频下载、扫描已下载的视频"""
+    try:
+        # 加载已存在的任务（多进程模式下先记下事件序号，加载后从这里开始同步其他进程的变化）
+        with startup.step('load_tasks'):
+            sync_from = task_store.last_event_seq() if MULTI_WORKER else 0
+            load_tasks()
+        if MULTI_WORKER:
+            cluster_sync.start(sync_from)
+            logger.info("多进程模式已启用，进程标识: %s", WORKER_ID)
+        
+        # 恢复未完成的任务
+        with startup.step('resume_tasks'):
+            resume_pending_tasks()
+        
+        # 加载已下载的视频，超出磁盘上限时淘汰最久未访问的视频
+        with startup.step('scan_outputs'):
+            evict_outputs(output_lru.scan(OUTPUT_FOLDER, '.mp4'))
+        # 启动归档和磁盘清理，长时间运行后内存中的任务数量也保持在上限以内
+        compaction.start()
+        startup.finish()
+        logger.info("应用初始化完成，耗时 %.2f 秒: %s", startup.ready_after, startup.phases)
+    except Exception as e:
+        startup.fail(e)
+        logger.exception("应用初始化失败")
+
+def require_ready(view):
+    """预热完成前返回503的路由装饰器，用于依赖完整任务索引的接口"""
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        if not startup.ready:
+            response = jsonify({'success': False, 'error': '服务正在启动，请稍后重试',
+                                'startup': startup.snapshot()})
+            response.headers['Retry-After'] = '1'
+            return response, 503
+        return view(*args, **kwargs)
+    return wrapper
 
 def allowed_file(filename):
     """检查文件扩展名是否允许"""
@@ -61,280 +302,832 @@ def generate_task_id():
     """生成唯一任务ID"""
     return str(uuid.uuid4())
 
-def save_tasks():
-    """将任务数据保存到本地文件"""
-    print(f"保存任务数据，当前任务数量: {len(tasks)}")
-    # 过滤掉不能序列化的字段
-    serializable_tasks = {}
+def _task_sort_key(task):
+    return (task.get('created_at') or '', task['id'])
+
+def add_task_locked(task):
+    """将任务加入内存索引（已存在时替换记录），调用方需持有tasks_lock"""
+    if not isinstance(task, TaskRecord):
+        task = TaskRecord(task)
+    if task['id'] not in tasks:
+        bisect.insort(tasks_order, _task_sort_key(task))
+        if task.get('batch_id'):
+            batch_tasks.setdefault(task['batch_id'], []).append(task['id'])
+    tasks[task['id']] = task
+
+def remove_task_locked(task_id):
+    """从内存索引中移除任务，调用方需持有tasks_lock"""
+    task = tasks.pop(task_id, None)
+    if task:
+        key = _task_sort_key(task)
+        index = bisect.bisect_left(tasks_order, key)
+        if index < len(tasks_order) and tasks_order[index] == key:
+            del tasks_order[index]
+        if task.get('batch_id') in batch_tasks:
+            batch_tasks[task['batch_id']].remove(task_id)
+            if not batch_tasks[task['batch_id']]:
+                del batch_tasks[task['batch_id']]
+    task_changes.pop(task_id, None)
+    last_published_tasks.pop(task_id, None)
+
+def rebuild_task_index_locked(min_version=0):
+    """根据tasks重建分页和增量索引，调用方需持有tasks_lock
+
+    min_version为已归档任务移除时分配的最大版本号，重启后版本号不会回退。
+    """
+    global tasks_version, removals_floor
+    tasks_order[:] = sorted(_task_sort_key(task) for task in tasks.values())
+    batch_tasks.clear()
+    for _, task_id in tasks_order:
+        if tasks[task_id].get('batch_id'):
+            batch_tasks.setdefault(tasks[task_id]['batch_id'], []).append(task_id)
+    task_changes.clear()
+    for task in sorted(tasks.values(), key=lambda t: t.get('version', 0)):
+        task_changes[task['id']] = task.get('version', 0)
+    tasks_version = max(max(task_changes.values(), default=0), min_version)
+    # 重启前的删除标记没有保存，之前的增量查询都需要重新加载列表
+    task_removals.clear()
+    removals_floor = tasks_version
+    last_published_tasks.clear()
+    sse_hub.reset(tasks_version)
+
+def update_task(task_id, **changes):
+    """更新并保存任务，返回新的任务记录；任务不在内存中时不修改存储，返回None
+
+    任务记录不可修改：在tasks_lock内生成带新版本号的记录并替换旧记录（写时复制），
+    读取方持有的旧记录保持不变，可以在锁外直接读取。没有changes时只递增版本号并重新保存。
+    """
+    with TASK_SAVE_DURATION.time():
+        if MULTI_WORKER:
+            return _update_task_shared(task_id, changes)
+        return _update_task(task_id, changes)
+
+def save_task(task_id):
+    """将单个任务写入任务存储，并递增任务版本号"""
+    return update_task(task_id)
+
+def _update_task(task_id, changes):
+    global tasks_version
     with tasks_lock:  # 使用锁保护对tasks的访问
-        for task_id, task in tasks.items():
-            serializable_task = task.copy()
-            # 移除线程对象等不能序列化的字段
-            # 线程对象不应该被存储在任务中，这里确保移除任何可能的线程引用
-            serializable_tasks[task_id] = serializable_task
+        task = tasks.get(task_id)
+        if task:
+            tasks_version += 1
+            task = task.replace(**changes, version=tasks_version)
+            tasks[task_id] = task
+            task_changes[task_id] = tasks_version
+            task_changes.move_to_end(task_id)
+            status_waiters.notify(task_id)
+            # 在锁内发布，保证事件序号与版本号顺序一致
+            publish_task_change_locked(task)
+            result_cache.observe(task)
     
+    # 任务结束后释放该模型的并发名额，排队中的任务可以继续提交
+    if task and task.get('status') in ['SUCCEEDED', 'FAILED']:
+        admission.release(task_id)
+    
+    if task is None:
+        # 内存中没有该任务（例如已归档）时不写入存储，删除只通过归档等显式的移除路径进行
+        return None
     try:
-        with open(TASKS_FILE, 'w', encoding='utf-8') as f:
-            json.dump(serializable_tasks, f, ensure_ascii=False, indent=2)
-        print(f"任务数据保存成功")
-        # 通知所有SSE客户端任务已更新
-        notify_sse_clients()
-    except Exception as e:
-        print(f"保存任务数据失败: {e}")
+        task_store.put(task)
+        logger.debug("任务 %s 数据保存成功", task_id, extra={'task_id': task_id, 'sample': True})
+    except Exception:
+        logger.exception("保存任务 %s 数据失败", task_id, extra={'task_id': task_id})
+    return task
 
-def notify_sse_clients():
-    """通知所有SSE客户端任务已更新"""
-    print(f"通知 {len(sse_clients)} 个SSE客户端任务更新")
-    disconnected_clients = set()
-    for client_queue in sse_clients:
+# 多进程模式下串行化本进程的任务写入，保证写入共享存储的顺序与内存中的更新顺序一致
+shared_save_lock = threading.Lock()
+
+def _update_task_shared(task_id, changes):
+    """多进程模式：写入共享存储并追加变化事件
+
+    版本号由共享存储分配，索引更新和SSE发布由cluster_sync线程统一处理，
+    所以每个进程的客户端收到的事件顺序和事件ID都相同。
+    """
+    with shared_save_lock:
+        with tasks_lock:  # 使用锁保护对tasks的访问
+            task = tasks.get(task_id)
+            if task and changes:
+                task = task.replace(**changes)
+                tasks[task_id] = task
+        if task is None:
+            return None
         try:
-            message = f"data: {json.dumps({'type': 'tasks_updated', 'timestamp': time.time()})}\n\n"
-            print(f"发送SSE消息: {message}")
-            client_queue.put(message)
-        except Exception as e:
-            print(f"发送SSE消息失败: {e}")
-            disconnected_clients.add(client_queue)
+            version = task_store.put_versioned(task, WORKER_ID)
+        except Exception:
+            logger.exception("保存任务 %s 数据失败", task_id, extra={'task_id': task_id})
+            return task
+        if version is None:
+            # 任务已被归档，删除事件到达后由cluster_sync线程从内存中移除
+            logger.debug("任务 %s 已归档，忽略更新", task_id, extra={'task_id': task_id})
+            return None
+        
+        saved = task.replace(version=version)
+        with tasks_lock:  # 使用锁保护对tasks的访问
+            if tasks.get(task_id) is task:
+                tasks[task_id] = saved
+            result_cache.observe(saved)
+    logger.debug("任务 %s 数据保存成功", task_id, extra={'task_id': task_id, 'version': version, 'sample': True})
+    
+    if saved.get('status') in ['SUCCEEDED', 'FAILED']:
+        admission.release(task_id)
+        leases.release(f'poll:{task_id}')
+        leases.release(f'submit:{task_id}')
+    return saved
+
+def apply_cluster_events(events):
+    """合并共享存储中的任务变化并发布给本进程的SSE客户端（cluster_sync线程调用）
+
+    同一任务只在其最新一次写入对应的事件上处理，保证版本号单调递增。
+    其他进程写入的任务直接替换内存中的记录；本进程写入的任务内存中已是最新，只更新索引并发布。
+    """
+    global tasks_version
+    latest = {}
+    for seq, task_id, origin, data in events:
+        latest[task_id] = (seq, origin, data)
+    new_tasks = []
+    removed = []
+    finished = []
+    standby = []
+    with tasks_lock:  # 使用锁保护对tasks的访问
+        for task_id, (seq, origin, data) in sorted(latest.items(), key=lambda item: item[1][0]):
+            if data is None:
+                if task_id in tasks:
+                    removed.append(tasks[task_id])
+                remove_task_locked(task_id)
+                mark_task_removed_locked(task_id, seq)
+                tasks_version = max(tasks_version, seq)
+                continue
+            stored = TaskRecord(json.loads(data))
+            if stored.get('version') != seq:
+                continue  # 任务之后又被写入过，在对应的事件上再处理
+            task = tasks.get(task_id)
+            if origin != WORKER_ID:
+                if task is None:
+                    new_tasks.append(stored)
+                add_task_locked(stored)
+                result_cache.observe(stored)
+                latency_model.observe(stored)
+            elif task is not None and task.get('version', 0) < seq:
+                tasks[task_id] = task.replace(version=seq)
+            task_changes[task_id] = seq
+            task_changes.move_to_end(task_id)
+            status_waiters.notify(task_id)
+            tasks_version = max(tasks_version, seq)
+            publish_task_change_locked(stored)
+            if origin != WORKER_ID and stored.get('status') in ['SUCCEEDED', 'FAILED']:
+                finished.append(task_id)
+            elif origin != WORKER_ID and stored.get('status') in ['PENDING', 'RUNNING'] and stored.get('async_task_id'):
+                standby.append(task_id)
     
-    # 移除断开连接的客户端
-    for client in disconnected_clients:
-        sse_clients.discard(client)
-        print("移除断开连接的SSE客户端")
+    for task in new_tasks:
+        upload_store.add_ref(task.get('input_file'))
+    for task in removed:
+        forget_removed_task(task)
+    # 其他进程提交的任务也加入本进程的轮询，持有租约的进程退出后由本进程接管
+    for task_id in standby:
+        poll_scheduler.schedule(task_id, delay=POLL_LEASE_TTL)
+    for task_id in finished:
+        admission.release(task_id)
+
+def mark_task_removed_locked(task_id, seq):
+    """记录任务已移出内存（归档），并向SSE客户端发布删除事件，调用方需持有tasks_lock
+
+    增量查询通过删除标记返回已移除的任务ID；删除标记超过TASK_REMOVALS_MAX时丢弃最旧的。
+    """
+    global removals_floor
+    task_changes[task_id] = seq
+    task_changes.move_to_end(task_id)
+    task_removals[task_id] = seq
+    task_removals.move_to_end(task_id)
+    while len(task_removals) > TASK_REMOVALS_MAX:
+        old_id, old_seq = task_removals.popitem(last=False)
+        if task_changes.get(old_id) == old_seq and old_id not in tasks:
+            del task_changes[old_id]
+        removals_floor = old_seq
+    status_waiters.notify(task_id)
+    event = {'type': 'task_removed', 'seq': seq, 'task_id': task_id}
+    sse_hub.publish(seq, format_sse(event, event_id=seq))
+
+def publish_task_change_locked(task):
+    """向所有SSE客户端发布任务变化事件，调用方需持有tasks_lock
+
+    任务按与/tasks?fields=TASK_LIST_FIELDS相同的方式投影，事件只包含其中变化的字段（不再存在的字段为null），
+    事件ID为任务的版本号。
+    """
+    current = with_thumbnail_urls(task, TASK_LIST_PROJECTION)
+    previous = last_published_tasks.get(task['id'])
+    changes = {key: value for key, value in current.items()
+               if previous is None or previous.get(key) != value}
+    if previous is not None:
+        changes.update((key, None) for key in previous if key not in current)
+    if task.get('status') in ['SUCCEEDED', 'FAILED']:
+        last_published_tasks.pop(task['id'], None)
+    else:
+        last_published_tasks[task['id']] = current
+    
+    seq = task['version']
+    event = {
+        'type': 'task_changed',
+        'seq': seq,
+        'task_id': task['id'],
+        'status': task.get('status'),
+        'changes': changes,
+    }
+    sse_hub.publish(seq, format_sse(event, event_id=seq))
 
 def load_tasks():
-    """从本地文件加载任务数据"""
+    """从任务存储加载任务数据"""
     global tasks
-    print(f"从文件加载任务数据: {TASKS_FILE}")
+    logger.info("从任务存储加载任务数据: %s", TASK_STORE)
+    if TASK_STORE == 'json':
+        logger.warning("TASK_STORE=json 每次写入任务都会重写整个任务文件，只适合开发和少量任务，生产环境请使用sqlite")
     try:
-        if os.path.exists(TASKS_FILE):
-            with open(TASKS_FILE, 'r', encoding='utf-8') as f:
-                loaded_tasks = json.load(f)
-            with tasks_lock:  # 使用锁保护对tasks的访问
-                tasks = loaded_tasks
-            print(f"已加载 {len(tasks)} 个任务")
-        else:
-            print(f"任务文件不存在: {TASKS_FILE}")
-            with tasks_lock:  # 使用锁保护对tasks的访问
-                tasks = {}
-    except Exception as e:
-        print(f"加载任务数据失败: {e}")
+        loaded_tasks = {task_id: TaskRecord(task) for task_id, task in task_store.load_all().items()}
+        startup.update(loaded=len(loaded_tasks))
+        removed_version = task_archive.max_removed_version()
+        with tasks_lock:  # 使用锁保护对tasks的访问
+            tasks = loaded_tasks
+            rebuild_task_index_locked(removed_version)
+        # 已归档的任务仍然引用输入图片，图片只由保留策略（UPLOAD_MAX_AGE_DAYS/UPLOAD_MAX_BYTES）删除
+        upload_store.reset_refs([task.get('input_file') for task in loaded_tasks.values()]
+                                + task_archive.input_files())
+        result_cache.rebuild(loaded_tasks.values())
+        latency_model.rebuild(loaded_tasks.values())
+        logger.info("已加载 %d 个任务", len(tasks))
+    except Exception:
+        logger.exception("加载任务数据失败")
         with tasks_lock:  # 使用锁保护对tasks的访问
             tasks = {}
+            rebuild_task_index_locked()
+
+def record_output(output_path):
+    """记录已下载到本地的视频，并淘汰超出磁盘上限的旧视频"""
+    evict_outputs(output_lru.add(output_path))
+
+def evict_outputs(paths, reason='超出磁盘上限'):
+    """删除被淘汰的视频文件，任务记录标记为已淘汰（链接有效期内仍可通过video_url重新下载）"""
+    for path in paths:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        task_id = os.path.splitext(os.path.basename(path))[0]
+        update_task(task_id, output_path=None, output_evicted=True)
+        logger.info("视频 %s %s已被淘汰", path, reason, extra={'task_id': task_id})
+    if paths:
+        logger.info("视频缓存状态: %s", output_lru.stats())
+
+def video_url_valid(task):
+    """DashScope返回的视频链接是否仍在有效期内（以任务完成时间计算）"""
+    if not task.get('video_url'):
+        return False
+    try:
+        completed_at = datetime.fromisoformat(task.get('completed_at') or task['created_at'])
+    except (KeyError, TypeError, ValueError):
+        return True
+    return datetime.now() - completed_at < timedelta(seconds=VIDEO_URL_TTL)
+
+def find_task(task_id):
+    """按ID查找任务，先查内存中的任务，再查任务存储，最后查归档
+
+    预热完成前的任务、多进程模式下其他进程刚创建而本进程尚未同步的任务只在任务存储中。
+    从任务存储或归档读到的记录只能读取，不加入内存，update_task对其不做任何修改。
+    """
+    with tasks_lock:  # 使用锁保护对tasks的访问
+        task = tasks.get(task_id)
+    if task is None and (not startup.ready or MULTI_WORKER):
+        try:
+            task = task_store.get(task_id)
+        except Exception:
+            logger.exception("从任务存储读取任务 %s 时出错", task_id)
+    if task is None:
+        task = task_archive.get(task_id)
+    return task
+
+def is_archivable(task):
+    """已结束且没有正在下载视频的任务可以归档"""
+    return task.get('status') in ['SUCCEEDED', 'FAILED'] and task.get('download_status') != 'DOWNLOADING'
+
+def select_tasks_to_archive():
+    """选出需要归档的任务：结束超过保留天数的任务，以及超出HOT_TASKS_MAX的最旧的已结束任务
+
+    批量任务在整批都结束后才归档，保证批次进度统计完整。
+    """
+    cutoff = (datetime.now() - timedelta(days=TASK_ARCHIVE_AFTER_DAYS)).isoformat() if TASK_ARCHIVE_AFTER_DAYS else None
+    with tasks_lock:  # 使用锁保护对tasks的访问
+        active_batches = {task['batch_id'] for task in tasks.values()
+                          if task.get('batch_id') and not is_archivable(task)}
+        candidates = [tasks[task_id] for _, task_id in tasks_order
+                      if is_archivable(tasks[task_id]) and tasks[task_id].get('batch_id') not in active_batches]
+    # candidates按创建时间升序，超出上限的部分从最旧的开始归档
+    excess = len(candidates) - HOT_TASKS_MAX if HOT_TASKS_MAX else 0
+    selected = []
+    for index, task in enumerate(candidates):
+        finished_at = task.get('completed_at') or task.get('created_at') or ''
+        if index < excess or (cutoff and finished_at < cutoff):
+            selected.append(task)
+    return selected
+
+def archive_old_tasks():
+    """把选出的任务分段写入压缩归档，再从任务存储和内存中删除"""
+    selected = select_tasks_to_archive()
+    archived = raw_bytes = stored_bytes = segments = 0
+    for start in range(0, len(selected), ARCHIVE_SEGMENT_SIZE):
+        chunk = selected[start:start + ARCHIVE_SEGMENT_SIZE]
+        archived_at = datetime.now().isoformat()
+        _, raw, stored = task_archive.add_segment([task.replace(archived_at=archived_at) for task in chunk])
+        archived += len(remove_archived_tasks(chunk))
+        raw_bytes += raw
+        stored_bytes += stored
+        segments += 1
+    return {'archived': archived, 'archive_segments_written': segments,
+            'archive_raw_bytes': raw_bytes, 'archive_stored_bytes': stored_bytes}
+
+def remove_archived_tasks(archived):
+    """从任务存储和内存中删除已写入归档的任务，返回删除的任务
+
+    归档之后又发生变化的任务不删除，下一轮会以最新数据重新归档。
+    多进程模式下通过删除事件由cluster_sync线程从各进程内存中移除，删除事件的序号即移除时的版本号。
+    """
+    global tasks_version
+    versions = {}
+    with tasks_lock:  # 使用锁保护对tasks的访问
+        removed = [task for task in archived if tasks.get(task['id']) is task]
+        if not MULTI_WORKER:
+            # 移除也是任务列表的变化：递增版本号并发布删除事件，ETag随之变化，增量查询返回删除标记
+            for task in removed:
+                remove_task_locked(task['id'])
+                tasks_version += 1
+                versions[task['id']] = tasks_version
+                mark_task_removed_locked(task['id'], tasks_version)
+    task_ids = [task['id'] for task in removed]
+    if MULTI_WORKER:
+        task_store.delete_many_versioned(task_ids, WORKER_ID)
+        return removed
+    task_archive.mark_removed(versions)
+    task_store.delete_many(task_ids)
+    for task in removed:
+        forget_removed_task(task)
+    return removed
+
+def forget_removed_task(task):
+    """从结果缓存中移除已归档的任务
+
+    输入图片的引用不释放：归档任务仍然可以预览输入图片，图片只由保留策略删除。
+    """
+    if task.get('cache_key'):
+        result_cache.invalidate(task['cache_key'], task['id'])
+
+def expire_outputs():
+    """删除超过保留天数的输出视频（按下载完成时间）"""
+    if not OUTPUT_MAX_AGE_DAYS:
+        return {}
+    paths = select_evictions(list_files(OUTPUT_FOLDER, '.mp4'), max_age=OUTPUT_MAX_AGE_DAYS * 86400)
+    for path in paths:
+        output_lru.remove(path)
+    evict_outputs(paths, reason='超过保留时间')
+    return {'outputs_expired': len(paths)}
+
+def expire_inputs():
+    """按保留天数和磁盘上限删除输入图片，排队中的任务和刚上传的图片不删除"""
+    if not UPLOAD_MAX_AGE_DAYS and not UPLOAD_MAX_BYTES:
+        return {}
+    files = [entry for entry in list_files(UPLOAD_FOLDER) if upload_store.is_managed(entry[1])]
+    recent = time.time() - UPLOAD_GRACE_PERIOD
+    with tasks_lock:  # 使用锁保护对tasks的访问
+        protected = {task.get('input_file') for task in tasks.values() if task.get('status') == 'QUEUED'}
+    protected.update(path for mtime, path, _ in files if mtime > recent)
+    paths = select_evictions(files, max_age=UPLOAD_MAX_AGE_DAYS * 86400, max_bytes=UPLOAD_MAX_BYTES,
+                             protected=protected)
+    evicted = {path for path in paths if upload_store.evict(path)}
+    if evicted:
+        with tasks_lock:  # 使用锁保护对tasks的访问
+            affected = [task['id'] for task in tasks.values() if task.get('input_file') in evicted]
+        for task_id in affected:
+            update_task(task_id, input_evicted=True)
+        task_archive.mark_input_evicted(evicted)
+    return {'inputs_evicted': len(evicted),
+            'upload_bytes': sum(size for _, path, size in files if path not in evicted)}
+
+def compact_storage():
+    """执行一轮归档和磁盘清理，返回统计信息（compaction线程调用）
+
+    多进程模式下只由持有清理租约的进程执行，其他进程返回None。
+    """
+    if MULTI_WORKER and not leases.acquire('compaction', ttl=COMPACTION_INTERVAL * 2):
+        return None
+    stats = archive_old_tasks()
+    stats.update(expire_outputs())
+    stats.update(expire_inputs())
+    archive = task_archive.stats()
+    with tasks_lock:  # 使用锁保护对tasks的访问
+        stats['hot_tasks'] = len(tasks)
+    stats.update(archive_tasks=archive['tasks'], archive_bytes=archive['stored_bytes'],
+                 output_bytes=output_lru.stats()['bytes'])
+    return stats
+
+def observe_task_finished(task):
+    """记录任务从创建到完成的总耗时"""
+    try:
+        elapsed = (datetime.now() - datetime.fromisoformat(task['created_at'])).total_seconds()
+    except (KeyError, TypeError, ValueError):
+        return
+    TASK_DURATION.labels(task.get('model'), task.get('resolution'), task.get('status')).observe(elapsed)
+
+def start_video_download(task_id, video_url):
+    """提交视频下载，完成后更新任务记录
+
+    同一个任务的视频同时只有一个下载在进行，重复调用返回同一个Future。
+    多进程模式下其他进程持有下载租约时，返回等待视频文件出现的Future。
+    """
+    output_path = os.path.join(app.config['OUTPUT_FOLDER'], f"{task_id}.mp4")
+    if MULTI_WORKER and not leases.acquire(f'download:{task_id}', ttl=DOWNLOAD_LEASE_TTL):
+        logger.info("任务 %s 的视频正在由其他进程下载", task_id, extra={'task_id': task_id})
+        return wait_for_path(output_path, DOWNLOAD_LEASE_TTL)
+    future, created = video_downloader.submit(video_url, output_path)
+    if created:
+        logger.info("开始下载任务 %s 的视频", task_id, extra={'task_id': task_id, 'video_url': video_url})
+        with tasks_lock:  # 使用锁保护对tasks的访问
+            task = tasks.get(task_id)
+        # 状态检查发现任务完成时已与完成状态一起标记为下载中
+        if task and task.get('download_status') != 'DOWNLOADING':
+            update_task(task_id, download_status='DOWNLOADING')
+        future.add_done_callback(lambda f: on_video_downloaded(task_id, output_path, f))
+    return future
+
+def on_video_downloaded(task_id, output_path, future):
+    """视频下载完成回调（在下载线程中执行）"""
+    if MULTI_WORKER:
+        leases.release(f'download:{task_id}')
+    try:
+        result = future.result()
+    except Exception as e:
+        # 下载失败（已下载的部分保留在.part文件中，重试时可继续）
+        DOWNLOAD_FAILURES.inc()
+        with tasks_lock:  # 使用锁保护对tasks的访问
+            task = tasks.get(task_id)
+        if task and not task.get('output_evicted') and not video_url_valid(task):
+            # 视频从未保存到本地且链接已过期，生成结果无法再获取
+            task = update_task(task_id, download_status='FAILED', status='FAILED',
+                               error=f'视频下载失败: {str(e)}', error_code='VIDEO_DOWNLOAD_FAILED')
+            observe_task_finished(task)
+        elif task:
+            # 链接仍有效时（例如上游临时错误）任务本身仍是成功的，之后可以通过/download重试
+            update_task(task_id, download_status='FAILED', download_error=f'视频下载失败: {str(e)}')
+        logger.warning("任务 %s 视频下载失败: %s", task_id, e, extra={'task_id': task_id})
+        return
+    
+    DOWNLOAD_BYTES.inc(result['downloaded'])
+    DOWNLOAD_DURATION.observe(result['elapsed'])
+    with tasks_lock:  # 使用锁保护对tasks的访问
+        task = tasks.get(task_id)
+    if task:
+        redownload = bool(task.get('output_evicted'))
+        task = update_task(task_id, output_path=output_path, status='SUCCEEDED',  # 明确设置状态
+                           download_status='DONE', download_error=None, output_evicted=None)
+        if not redownload:
+            observe_task_finished(task)
+    # 已归档任务重新下载的视频同样计入磁盘上限
+    record_output(output_path)
+    logger.info("任务 %s 视频已保存到 %s", task_id, output_path,
+                extra={'task_id': task_id, 'bytes': result['size'], 'elapsed': round(result['elapsed'], 3),
+                       'throughput_mbps': round(result['throughput'] / 1024 / 1024, 2),
+                       'segments': result['segments']})
 
 def resume_pending_tasks():
     """恢复未完成的任务"""
-    print("检查未完成的任务...")
+    logger.info("检查未完成的任务...")
     pending_tasks = []
+    queued_tasks = []
     
-    # 筛选出未完成的任务（PENDING, RUNNING状态）
+    # 筛选出未完成的任务（PENDING, RUNNING状态）和尚未提交的排队任务
     with tasks_lock:  # 使用锁保护对tasks的访问
         for task_id, task in tasks.items():
-            if task.get('status') in ['PENDING', 'RUNNING'] and 'async_task_id' in task:
-                pending_tasks.append(task_id)
+            if task.get('status') in ['PENDING', 'RUNNING'] and task.get('async_task_id'):
+                pending_tasks.append(task)
+                # 多进程模式下由取得轮询租约的进程占用并发名额
+                if not MULTI_WORKER:
+                    admission.mark_inflight(task_id, task.get('model'))
+            elif task.get('status') == 'QUEUED':
+                queued_tasks.append(task)
     
-    print(f"发现 {len(pending_tasks)} 个未完成的任务")
+    logger.info("发现 %d 个未完成的任务，%d 个排队中的任务", len(pending_tasks), len(queued_tasks))
+    startup.update(pending=len(pending_tasks), queued=len(queued_tasks))
     
-    # 为每个未完成的任务启动状态检查线程
-    for task_id in pending_tasks:
-        with tasks_lock:  # 使用锁保护对tasks的访问
-            task = tasks[task_id]
-        print(f"恢复任务 {task_id} 的状态检查")
-        thread = threading.Thread(target=check_task_status, args=(task_id,))
-        thread.daemon = True
-        thread.start()
+    # 排队中的任务按创建顺序重新排队
+    for task in sorted(queued_tasks, key=_task_sort_key):
+        admission.enqueue(task['id'], task.get('model'), task.get('priority', 'normal'))
+    
+    # 将未完成的任务交给轮询调度器，首次检查按RESUME_POLL_RATE均匀错开，
+    # 大量积压时不会在启动后的几秒内集中查询；开始生成最早的任务最可能已完成，最先检查
+    pending_tasks.sort(key=lambda task: generation_started_at(task) or 0)
+    for index, task in enumerate(pending_tasks):
+        delay = index / RESUME_POLL_RATE if RESUME_POLL_RATE else random.uniform(0, POLL_INTERVAL)
+        logger.debug("恢复任务 %s 的状态检查", task['id'], extra={'task_id': task['id'], 'delay': delay})
+        poll_scheduler.schedule(task['id'], delay=delay)
+    if pending_tasks and RESUME_POLL_RATE:
+        logger.info("%d 个未完成任务的首次状态检查分散在 %.0f 秒内", len(pending_tasks),
+                    len(pending_tasks) / RESUME_POLL_RATE)
+    
+    # 恢复中断的视频下载（从.part文件继续）
+    with tasks_lock:  # 使用锁保护对tasks的访问
+        pending_downloads = [(task_id, task['video_url']) for task_id, task in tasks.items()
+                             if task.get('download_status') == 'DOWNLOADING' and task.get('video_url')]
+    for task_id, video_url in pending_downloads:
+        logger.info("恢复任务 %s 的视频下载", task_id, extra={'task_id': task_id})
+        start_video_download(task_id, video_url)
 
 def check_task_status(task_id):
-    """检查任务状态并下载完成的视频"""
-    print(f"开始检查任务 {task_id} 的状态")
-    while True:
-        try:
-            with tasks_lock:  # 使用锁保护对tasks的访问
-                task = tasks.get(task_id)
-            if not task:
-                print(f"任务 {task_id} 不存在，停止状态检查")
-                break
-                
-            # 如果任务已完成，停止检查
-            if task.get('status') in ['SUCCEEDED', 'FAILED']:
-                print(f"任务 {task_id} 已完成 (状态: {task['status']})，停止状态检查")
-                # 任务完成后主动通知前端刷新
-                save_tasks()
-                notify_sse_clients()  # 确保通知前端
-                break
-            
-            # 检查API密钥
-            if not DASHSCOPE_API_KEY or DASHSCOPE_API_KEY == 'YOUR_API_KEY_HERE':
-                print(f"任务 {task_id} 无法检查状态: API密钥未配置")
-                with tasks_lock:  # 使用锁保护对tasks的访问
-                    task['error'] = 'API密钥未配置'
-                    task['status'] = 'FAILED'
-                save_tasks()
-                break
-            
-            print(f"正在查询任务 {task_id} (API任务ID: {task['async_task_id']}) 的状态")
-            
-            # 直接使用HTTP请求查询任务状态
-            headers = {
-                'Authorization': f'Bearer {DASHSCOPE_API_KEY}'
-            }
+    """检查一次任务状态并下载完成的视频
+
+    由轮询调度器调用，返回下一次检查前等待的秒数，返回None表示停止检查。
+    """
+    with log_context(task_id=task_id):
+        return _check_task_status(task_id)
+
+# 每个任务连续查询出错的次数，查询正常完成后清零
+poll_errors = {}
+poll_errors_lock = threading.Lock()
+
+def _check_task_status(task_id):
+    failed = False
+    try:
+        with tasks_lock:  # 使用锁保护对tasks的访问
+            task = tasks.get(task_id)
+        if not task:
+            logger.info("任务 %s 不存在，停止状态检查", task_id)
+            return None
             
-            response = requests.get(
+        # 如果任务已完成，停止检查
+        if task.get('status') in ['SUCCEEDED', 'FAILED']:
+            logger.debug("任务 %s 已完成 (状态: %s)，停止状态检查", task_id, task['status'])
+            # 任务完成后主动通知前端刷新（多进程模式下完成时已由写入的进程发布）
+            if not MULTI_WORKER:
+                save_task(task_id)
+            return None
+        
+        # 多进程模式下只有持有轮询租约的进程查询状态，其他进程等租约过期后再尝试接管
+        if MULTI_WORKER:
+            if not leases.acquire(f'poll:{task_id}', ttl=POLL_LEASE_HOLD):
+                return POLL_LEASE_TTL
+            admission.mark_inflight(task_id, task.get('model'))
+        
+        # 检查API密钥
+        if not DASHSCOPE_API_KEY or DASHSCOPE_API_KEY == 'YOUR_API_KEY_HERE':
+            logger.error("任务 %s 无法检查状态: API密钥未配置", task_id)
+            update_task(task_id, error='API密钥未配置', status='FAILED')
+            return None
+        
+        logger.debug("正在查询任务 %s 的状态", task_id,
+                     extra={'async_task_id': task['async_task_id'], 'sample': True})
+        
+        # 直接使用HTTP请求查询任务状态
+        headers = {
+            'Authorization': f'Bearer {DASHSCOPE_API_KEY}'
+        }
+        
+        with POLL_RTT.time():
+            response = http_client.get(
                 f'{DASHSCOPE_BASE_URL}/tasks/{task["async_task_id"]}',
                 headers=headers
             )
+        
+        if response.status_code == 200:
+            result = response.json()
+            POLL_STATUS.labels(result['output']['task_status']).inc()
+            logger.debug("任务 %s 状态查询响应: %s", task_id, result, extra={'sample': True})
+            task_data = result['output']
+            previous_status = task.get('status')
+            status = task_data['task_status']
+            message = task_data.get('message', '')
             
-            print(f"任务 {task_id} 状态查询响应: {response.status_code}")
+            if previous_status != status:
+                logger.info("任务 %s 状态: %s -> %s", task_id, previous_status, status)
             
-            if response.status_code == 200:
-                result = response.json()
-                print(f"任务 {task_id} 完整响应: {result}")
-                task_data = result['output']
-                with tasks_lock:  # 使用锁保护对tasks的访问
-                    previous_status = task.get('status')
-                    task['status'] = task_data['task_status']
-                    task['message'] = task_data.get('message', '')
-                
-                print(f"任务 {task_id} 状态: {task['status']}")
+            if previous_status != status and status == 'SUCCEEDED':
+                # 获取视频URL
+                video_url = task_data.get('video_url')
+                logger.info("任务 %s 返回的视频URL: %s", task_id, video_url)
                 
-                # 保存状态更新并通知前端（状态变化时必须通知，任务完成时也需强制通知）
-                if previous_status != task['status'] and task['status'] != 'SUCCEEDED':
-                    # 保存状态更新
-                    save_tasks()
-                    # 通知前端更新（除非是状态未变化且不是完成状态）
-                    notify_sse_clients()             
+                # 保存video_url和完成时间（即使没有下载视频也要保存）
+                # 即使没有video_url，任务也可以被视为成功完成
+                # 某些模型可能直接在响应中提供视频内容而不是URL
+                task = update_task(task_id, status='SUCCEEDED', message=message, video_url=video_url,
+                                   completed_at=datetime.now().isoformat(),
+                                   download_status='DOWNLOADING' if video_url else None)
+                if not task:
+                    return None
+                latency_model.observe(task)
+                if not video_url:
+                    logger.warning("任务 %s 成功完成但未返回视频URL", task_id)
+                    observe_task_finished(task)
+                    return None
                 
-                if previous_status != task['status'] and task_data['task_status'] == 'SUCCEEDED':
-                    # 获取视频URL
-                    video_url = task_data.get('video_url')
-                    print(f"任务 {task_id} 返回的视频URL: {video_url}")
-                    
-                    # 保存video_url到任务数据中（即使没有下载视频也要保存）
-                    with tasks_lock:  # 使用锁保护对tasks的访问
-                        task['video_url'] = video_url
-                    
-                    # 即使没有video_url，任务也可以被视为成功完成
-                    # 某些模型可能直接在响应中提供视频内容而不是URL
-                    if not video_url:
-                        print(f"任务 {task_id} 成功完成但未返回视频URL")
-                        with tasks_lock:  # 使用锁保护对tasks的访问
-                            task['status'] = 'SUCCEEDED'
-                            task['completed_at'] = datetime.now().isoformat()
-                        save_tasks()
-                        notify_sse_clients()  # 通知前端更新
-                        print(f"任务 {task_id} 已标记为完成")
-                        break
+                # 交给下载工作池下载视频，状态检查到此结束
+                start_video_download(task_id, video_url)
+                return None
                     
-                    print(f"开始下载任务 {task_id} 的视频: {video_url}")
-                    try:
-                        video_response = requests.get(video_url, stream=True, timeout=30)
-                        print(f"视频下载响应状态码: {video_response.status_code}")
-                        
-                        if video_response.status_code == 200:
-                            output_path = os.path.join(app.config['OUTPUT_FOLDER'], f"{task_id}.mp4")
-                            print(f"保存视频到: {output_path}")
-                            with open(output_path, 'wb') as f:
-                                for chunk in video_response.iter_content(chunk_size=8192):
-                                    f.write(chunk)
-                            
-                            # 确保视频文件已成功保存到本地后再更新任务状态
-                            if os.path.exists(output_path):
-                                with tasks_lock:  # 使用锁保护对tasks的访问
-                                    task['output_path'] = output_path
-                                    task['completed_at'] = datetime.now().isoformat()
-                                    # 注意：这里不再重复设置video_url，因为我们已经在前面设置了
-                                    task['status'] = 'SUCCEEDED'  # 明确设置状态
-                                # 保存任务状态
-                                save_tasks()
-                                notify_sse_clients()  # 通知前端更新
-                                print(f"任务 {task_id} 已完成，视频已保存到 {output_path}")
-                            else:
-                                # 视频文件未成功保存，标记任务为失败
-                                with tasks_lock:  # 使用锁保护对tasks的访问
-                                    task['status'] = 'FAILED'
-                                    task['error'] = '视频文件保存失败'
-                                    task['error_code'] = 'VIDEO_SAVE_FAILED'
-                                save_tasks()
-                                notify_sse_clients()  # 通知前端更新
-                                print(f"任务 {task_id} 视频文件保存失败")
-                            break
-                        else:
-                            # 下载失败，标记任务为失败
-                            with tasks_lock:  # 使用锁保护对tasks的访问
-                                task['status'] = 'FAILED'
-                                task['error'] = f'视频下载失败，HTTP状态码: {video_response.status_code}'
-                                task['error_code'] = 'VIDEO_DOWNLOAD_FAILED'
-                            save_tasks()
-                            print(f"任务 {task_id} 视频下载失败: HTTP {video_response.status_code}")
-                            try:
-                                error_content = video_response.text[:200]  # 限制错误内容长度
-                                print(f"下载失败响应内容: {error_content}")
-                            except:
-                                print("无法获取下载失败的响应内容")
-                            break
-                    except requests.exceptions.RequestException as e:
-                        # 网络请求异常，标记任务为失败
-                        with tasks_lock:  # 使用锁保护对tasks的访问
-                            task['status'] = 'FAILED'
-                            task['error'] = f'视频下载网络异常: {str(e)}'
-                            task['error_code'] = 'VIDEO_DOWNLOAD_EXCEPTION'
-                        save_tasks()
-                        print(f"任务 {task_id} 视频下载网络异常: {str(e)}")
-                        break
-                        
-                elif task_data['task_status'] == 'FAILED':
-                    with tasks_lock:  # 使用锁保护对tasks的访问
-                        task['error'] = task_data.get('message', '任务失败')
-                        task['error_code'] = task_data.get('code', 'UnknownError')
-                    # 保存任务状态
-                    save_tasks()
-                    notify_sse_clients()  # 通知前端更新
-                    print(f"任务 {task_id} 失败: {task['error']} (错误代码: {task['error_code']})")
-                    break
-                    
-            elif response.status_code == 404:
-                print(f"任务 {task_id} 在API服务器上未找到 (404)")
-                with tasks_lock:  # 使用锁保护对tasks的访问
-                    task['error'] = '任务在API服务器上未找到'
-                    task['status'] = 'FAILED'
-                    task['error_code'] = 'TASK_NOT_FOUND'
-                save_tasks()
-                notify_sse_clients()  # 通知前端更新
-                break
-            else:
-                print(f"任务 {task_id} 状态查询失败，HTTP状态码: {response.status_code}")
-                try:
-                    error_result = response.json()
-                    print(f"错误详情: {error_result}")
-                except:
-                    print(f"响应内容: {response.text}")
-                    
-            time.sleep(5)  # 每5秒检查一次
+            elif status == 'FAILED':
+                task = update_task(task_id, status='FAILED', message=message,
+                                   error=task_data.get('message', '任务失败'),
+                                   error_code=task_data.get('code', 'UnknownError'))
+                if task:
+                    observe_task_finished(task)
+                    logger.warning("任务 %s 失败: %s", task_id, task['error'], extra={'error_code': task['error_code']})
+                return None
             
-        except requests.exceptions.RequestException as e:
-            print(f"网络请求错误，检查任务 {task_id} 状态时出错: {e}")
-            # 继续下一次检查
-            time.sleep(5)
-        except Exception as e:
-            with tasks_lock:  # 使用锁保护对tasks的访问
-                if task_id in tasks:
-                    tasks[task_id]['error'] = str(e)
-            save_tasks()
-            print(f"检查任务 {task_id} 状态时出错: {e}")
-            import traceback
-            traceback.print_exc()
-            break
+            elif previous_status != status or task.get('message', '') != message:
+                # 保存状态更新并通知前端
+                task = update_task(task_id, status=status, message=message) or task
+                
+        elif response.status_code == 404:
+            POLL_STATUS.labels('HTTP_404').inc()
+            logger.warning("任务 %s 在API服务器上未找到 (404)", task_id)
+            task = update_task(task_id, error='任务在API服务器上未找到', status='FAILED', error_code='TASK_NOT_FOUND')
+            if task:
+                observe_task_finished(task)
+            return None
+        else:
+            POLL_STATUS.labels(f'HTTP_{response.status_code}').inc()
+            logger.warning("任务 %s 状态查询失败，HTTP状态码: %s，响应内容: %.500s",
+                           task_id, response.status_code, response.text, extra={'http_status': response.status_code})
+                
+        return next_poll_delay(task)
+        
+    except requests.exceptions.RequestException as e:
+        POLL_STATUS.labels('NETWORK_ERROR').inc()
+        logger.warning("网络请求错误，检查任务 %s 状态时出错: %s", task_id, e)
+        # 继续下一次检查
+        return POLL_INTERVAL
+    except Exception as e:
+        # 意外错误时任务仍占用并发名额，不能直接停止检查：先重试，连续出错超过上限时标记为失败，
+        # 通过update_task的结束路径释放名额
+        logger.exception("检查任务 %s 状态时出错: %s", task_id, e)
+        failed = True
+        with poll_errors_lock:
+            errors = poll_errors[task_id] = poll_errors.get(task_id, 0) + 1
+        if errors < POLL_MAX_ERRORS:
+            update_task(task_id, error=str(e))
+            return POLL_INTERVAL
+        with poll_errors_lock:
+            poll_errors.pop(task_id, None)
+        task = update_task(task_id, status='FAILED', error=f'查询任务状态出错: {e}', error_code='POLL_ERROR')
+        if task:
+            observe_task_finished(task)
+        return None
+    finally:
+        if not failed and poll_errors:
+            with poll_errors_lock:
+                poll_errors.pop(task_id, None)
+
+def next_poll_delay(task):
+    """下一次查询任务状态前等待的秒数，自适应轮询关闭或没有历史数据时使用固定间隔"""
+    if not POLL_ADAPTIVE:
+        return POLL_INTERVAL
+    return latency_model.next_delay(task, POLL_INTERVAL)
+
+def submit_task(task_id, encoded_image=None):
+    """把排队中的任务提交到DashScope，返回 (结果, 错误信息)
+
+    结果为SUBMIT_OK、SUBMIT_THROTTLED、SUBMIT_FAILED或SUBMIT_SKIPPED（其他进程正在提交）。
+    提交成功后任务变为PENDING并加入状态轮询；
+    DashScope限流时任务保持QUEUED，由调用方重新排队；其他失败时任务标记为FAILED。
+    """
+    with tasks_lock:  # 使用锁保护对tasks的访问
+        task = tasks.get(task_id)
+    if not task or task.get('status') != 'QUEUED':
+        return SUBMIT_FAILED, {'message': '任务不存在或已提交', 'code': 'TASK_NOT_QUEUED', 'http_status': 409}
+    # 多进程模式下重启的进程会重新排队所有QUEUED任务，通过租约保证只有一个进程提交
+    if MULTI_WORKER and not leases.acquire(f'submit:{task_id}', ttl=SUBMIT_LEASE_TTL):
+        return SUBMIT_SKIPPED, {'message': '任务正在由其他进程提交', 'code': 'TASK_NOT_QUEUED', 'http_status': 409}
+    
+    # 准备API请求数据（图片的base64 data URL在发送时流式生成）
+    payload = {
+        "model": task['model'],
+        "input": {
+            "prompt": task['prompt']
+        },
+        "parameters": {
+            "resolution": task['resolution'],
+            "prompt_extend": task['prompt_extend']  # 修复：总是包含此参数，且为布尔值
+        }
+    }
+    
+    # 添加可选参数
+    if task.get('negative_prompt'):
+        payload["input"]["negative_prompt"] = task['negative_prompt']
+    
+    # 图片按块读取并编码后直接写入请求体，不在内存中保存完整的base64字符串
+    input_file = task['input_file']
+    mime_type = 'image/png' if input_file.lower().endswith('.png') else 'image/jpeg'
+    if encoded_image is None and task.get('input_sha256'):
+        encoded_image = upload_store.get_base64(task['input_sha256'])
+    
+    # 发送HTTP请求到DashScope API
+    headers = {
+        'X-DashScope-Async': 'enable',
+        'Authorization': f'Bearer {DASHSCOPE_API_KEY}',
+        'Content-Type': 'application/json'
+    }
+    
+    try:
+        body = Base64JsonBody(payload, ('input', 'img_url'), mime_type,
+                              file_path=input_file, encoded=encoded_image)
+        logger.debug("API请求数据: model=%s, resolution=%s, 请求体大小=%d 字节",
+                     task['model'], task['resolution'], len(body))
+        # 提交任务不是幂等操作，不自动重试
+        submit_start = time.perf_counter()
+        response = http_client.post(
+            f'{DASHSCOPE_BASE_URL}/services/aigc/video-generation/video-synthesis',
+            headers=headers,
+            data=body
+        )
+        SUBMIT_LATENCY.labels(task['model'], response.status_code).observe(time.perf_counter() - submit_start)
+        
+        if response.status_code == 200:
+            result = response.json()
+            logger.debug("API响应数据: %s", result)
+            current = update_task(task_id, async_task_id=result['output']['task_id'], status='PENDING',
+                                  submitted_at=datetime.now().isoformat())
+            
+            # 交给轮询调度器检查任务状态
+            if current:
+                poll_scheduler.schedule(task_id, delay=next_poll_delay(current))
+            logger.info("任务 %s 已提交并加入状态轮询队列", task_id,
+                        extra={'task_id': task_id, 'async_task_id': result['output']['task_id'],
+                               'model': task['model']})
+            return SUBMIT_OK, None
+        
+        try:
+            error_result = response.json() if response.content else {}
+        except ValueError:
+            error_result = {}
+        error = {'message': error_result.get('message', 'API调用失败'),
+                 'code': error_result.get('code', 'UnknownError'),
+                 'http_status': response.status_code}
+    except requests.exceptions.RequestException as e:
+        error = {'message': f'提交任务失败: {e}', 'code': 'NETWORK_ERROR', 'http_status': 502}
+    except OSError as e:
+        error = {'message': f'读取上传文件失败: {e}', 'code': 'INPUT_FILE_ERROR', 'http_status': 500}
+    
+    # 超出账号的QPS或并发配额，任务保持排队状态稍后重试
+    if error['http_status'] == 429 or str(error['code']).startswith('Throttling'):
+        logger.warning("提交任务 %s 被限流: %s", task_id, error['message'],
+                       extra={'task_id': task_id, 'error_code': error['code']})
+        return SUBMIT_THROTTLED, error
+    
+    logger.warning("API调用失败: %s", error['message'],
+                   extra={'task_id': task_id, 'error_code': error['code'], 'http_status': error['http_status']})
+    current = update_task(task_id, status='FAILED', error=error['message'], error_code=error['code'])
+    if current:
+        observe_task_finished(current)
+    return SUBMIT_FAILED, error
+
+def submit_queued_task(task_id):
+    """提交队列调度线程调用的提交函数"""
+    with log_context(task_id=task_id):
+        return submit_task(task_id)[0]
+
+# 提交准入控制（令牌桶限速 + 每个模型的并发上限 + 优先级队列）
+# 多进程模式下限速和并发名额通过共享SQLite在所有进程间统一计算，不会随进程数成倍放大
+admission = AdmissionController(submit_queued_task, qps=SUBMIT_QPS, burst=SUBMIT_BURST,
+                                default_limit=MODEL_MAX_INFLIGHT, model_limits=MODEL_INFLIGHT_LIMITS,
+                                max_queue=SUBMIT_QUEUE_MAX, workers=SUBMIT_WORKERS,
+                                throttle_pause=SUBMIT_THROTTLE_PAUSE,
+                                shared=SharedAdmissionLimits(task_store, SUBMIT_QPS, SUBMIT_BURST, WORKER_ID) if MULTI_WORKER else None)
+
+# 任务状态轮询调度器（固定数量的工作线程处理所有任务）
+poll_scheduler = PollScheduler(check_task_status, workers=POLL_WORKERS,
+                               interval=POLL_INTERVAL, jitter=POLL_JITTER)
+
+# 多进程模式下同步其他进程的任务变化
+cluster_sync = ClusterSync(task_store, apply_cluster_events, interval=CLUSTER_SYNC_INTERVAL)
+
+# 定期归档旧任务并清理输入图片和输出视频
+compaction = CompactionService(compact_storage, interval=COMPACTION_INTERVAL)
 
 @app.route('/')
 def index():
     """主页"""
-    print("访问主页路由 '/'")
-    return render_template('index.html')
+    return render_template('index.html', task_list_fields=','.join(TASK_LIST_FIELDS))
+
+def check_resolution(model, resolution):
+    """验证分辨率是否适用于所选模型，不支持时返回错误信息"""
+    if model in MODEL_RESOLUTIONS and resolution not in MODEL_RESOLUTIONS[model]:
+        available_resolutions = ', '.join(MODEL_RESOLUTIONS[model])
+        return f'模型 {model} 不支持分辨率 {resolution}。支持的分辨率: {available_resolutions}'
+    return None
 
 @app.route('/generate', methods=['POST'])
+@require_ready
 def generate_video():
     """生成视频"""
-    print("访问生成视频路由 '/generate'")
+    upload_ref = None  # 本次请求持有的上传文件引用，任务创建成功后转移给任务记录
+    cache_key = None
+    cache_leader = False  # 是否为相同请求中负责提交的请求
+    created_task_id = None
     try:
-        print("收到生成视频请求")
         # 获取表单数据
         prompt = request.form.get('prompt', '将静态图片转换为动态视频，添加自然的动态效果')
         negative_prompt = request.form.get('negative_prompt', '')
@@ -343,21 +1136,27 @@ def generate_video():
         # 修复prompt_extend参数处理，应该始终传递布尔值
         prompt_extend = request.form.get('prompt_extend') == 'true' or request.form.get('prompt_extend') == 'on'
         
-        print(f"表单数据: prompt={prompt}, model={model}, resolution={resolution}, prompt_extend={prompt_extend}")
+        # 优先级类别：high、normal、low
+        priority = request.form.get('priority', 'normal')
         
-        # 验证分辨率是否适用于所选模型
-        model_resolutions = {
-            'wan2.2-i2v-plus': ['480P', '1080P'],
-            'wan2.2-i2v-flash': ['480P', '720P'],
-            'wanx2.1-i2v-plus': ['720P'],
-            'wanx2.1-i2v-turbo': ['480P', '720P']
-        }
+        logger.debug("表单数据: prompt=%s, model=%s, resolution=%s, prompt_extend=%s, priority=%s",
+                     prompt, model, resolution, prompt_extend, priority)
+        
+        if priority not in PRIORITIES:
+            return jsonify({'success': False, 'error': f'不支持的优先级 {priority}'}), 400
+        
+        # 提交队列已满时直接拒绝，不再接收上传文件
+        if admission.is_full():
+            logger.warning("提交队列已满，拒绝新任务")
+            response = jsonify({'success': False, 'error': '提交队列已满，请稍后重试',
+                                'queue_length': admission.stats()['queued']})
+            response.headers['Retry-After'] = '30'
+            return response, 429
         
         # 检查所选分辨率是否适用于模型
-        if model in model_resolutions and resolution not in model_resolutions[model]:
-            available_resolutions = ', '.join(model_resolutions[model])
-            error_msg = f'模型 {model} 不支持分辨率 {resolution}。支持的分辨率: {available_resolutions}'
-            print(f"参数错误: {error_msg}")
+        error_msg = check_resolution(model, resolution)
+        if error_msg:
+            logger.info("参数错误: %s", error_msg)
             return jsonify({
                 'success': False, 
                 'error': error_msg
@@ -365,307 +1164,678 @@ def generate_video():
         
         if 'image' not in request.files:
             error_msg = '没有选择图片'
-            print(f"文件错误: {error_msg}")
+            logger.info("文件错误: %s", error_msg)
             return jsonify({'success': False, 'error': error_msg}), 400
         
         file = request.files['image']
         if file.filename == '':
             error_msg = '没有选择文件'
-            print(f"文件错误: {error_msg}")
+            logger.info("文件错误: %s", error_msg)
             return jsonify({'success': False, 'error': error_msg}), 400
         
         if not allowed_file(file.filename):
             error_msg = '不支持的文件格式'
-            print(f"文件错误: {error_msg}")
+            logger.info("文件错误: %s", error_msg)
             return jsonify({'success': False, 'error': error_msg}), 400
         
-        # 保存上传的文件
-        filename = secure_filename(file.filename)
-        file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        file.save(file_path)
-        print(f"文件已保存到: {file_path}")
+        # 按内容哈希保存上传的文件，相同图片只保存一份
+        ext = file.filename.rsplit('.', 1)[1].lower()  # 已通过allowed_file校验
+        try:
+            image_sha256, file_path, existed = upload_store.save(file.stream, ext)
+        except FileTooLargeError as e:
+            logger.info("文件错误: %s", e)
+            return jsonify({'success': False, 'error': str(e)}), 400
+        upload_ref = file_path
+        logger.debug("文件已保存到: %s (已存在: %s)", file_path, existed)
+        
+        # 相同图片和参数的请求直接复用已成功或仍在生成中的任务（force=true时强制重新生成）
+        force = request.form.get('force') in ('true', 'on', '1')
+        cache_key = generation_cache_key(image_sha256, prompt, negative_prompt, model, resolution, prompt_extend)
+        if RESULT_CACHE_ENABLED and not force:
+            cached_task, cache_leader = find_reusable_task(cache_key)
+            if cached_task:
+                logger.info("命中生成结果缓存，复用任务 %s (状态: %s)", cached_task['id'], cached_task['status'],
+                            extra={'task_id': cached_task['id']})
+                return jsonify({'success': True, 'task_id': cached_task['id'], 'cached': True,
+                                'status': cached_task['status']})
+        
+        # 重复提交的图片使用缓存的base64编码
+        encoded_image = upload_store.get_base64(image_sha256)
+        if encoded_image is None and existed:
+            encoded_image = upload_store.load_base64(image_sha256, file_path)
         
-        # 创建任务
+        # 先创建排队中的任务记录，提交到DashScope成功后变为PENDING
         task_id = generate_task_id()
-        print(f"创建任务ID: {task_id}")
-        
-        # 读取图片文件并转换为base64
-        with open(file_path, 'rb') as f:
-            image_data = base64.b64encode(f.read()).decode('utf-8')
-        print("图片已转换为base64")
-        
-        # 准备API请求数据
-        payload = {
-            "model": model,
-            "input": {
-                "prompt": prompt,
-                "img_url": f"data:image/jpeg;base64,{image_data}"
-            },
-            "parameters": {
-                "resolution": resolution,
-                "prompt_extend": prompt_extend  # 修复：总是包含此参数，且为布尔值
-            }
-        }
+        with tasks_lock:  # 使用锁保护对tasks的访问
+            add_task_locked({
+                'id': task_id,
+                'async_task_id': None,
+                'status': 'QUEUED',
+                'priority': priority,
+                'prompt': prompt,
+                'negative_prompt': negative_prompt,
+                'prompt_extend': prompt_extend,
+                'model': model,
+                'resolution': resolution,
+                'created_at': datetime.now().isoformat(),
+                'input_file': file_path,
+                'input_sha256': image_sha256,
+                'cache_key': cache_key,
+                'error': None,
+                'error_code': None,
+                'output_path': None,
+                'message': '',
+                'video_url': None
+            })
+        upload_ref = None  # 上传文件的引用已转移给任务记录
+        created_task_id = task_id
+        save_task(task_id)
         
-        # 添加可选参数
-        if negative_prompt:
-            payload["input"]["negative_prompt"] = negative_prompt
+        # 有余量时直接提交，否则在本地排队，由准入控制在名额空出时自动提交
+        if admission.try_admit(task_id, model):
+            submit_result, error = submit_task(task_id, encoded_image)
+            if submit_result == SUBMIT_OK:
+                return jsonify({'success': True, 'task_id': task_id})
+            if submit_result == SUBMIT_SKIPPED:
+                admission.release(task_id)
+            if submit_result in (SUBMIT_FAILED, SUBMIT_SKIPPED):
+                return jsonify({'success': False, 'task_id': task_id, 'error': error['message'],
+                                'code': error['code']}), error['http_status']
+            queue_position = admission.requeue_throttled(task_id, model, priority)
+        else:
+            queue_position = admission.enqueue(task_id, model, priority)
+        logger.info("任务 %s 已加入提交队列，位置 %s", task_id, queue_position,
+                    extra={'task_id': task_id, 'model': model, 'priority': priority})
+        return jsonify({'success': True, 'task_id': task_id, 'status': 'QUEUED',
+                        'queue_position': queue_position}), 202
             
-        # 修复：移除条件判断，因为prompt_extend应该始终包含在parameters中
-        # 根据API文档，prompt_extend应该始终包含在请求中
+    except Exception as e:
+        logger.exception("创建任务时出错: %s", e)
+        return jsonify({'success': False, 'error': str(e)}), 500
+    finally:
+        # 任务未创建成功时释放上传文件的引用
+        if upload_ref:
+            upload_store.release(upload_ref)
+        # 唤醒等待相同请求结果的其他请求
+        if cache_leader:
+            result_cache.release(cache_key, created_task_id)
+
+def find_reusable_task(cache_key):
+    """查找相同图片和参数的可复用任务，返回 (任务记录或None, 是否为提交者)
+
+    调用方为提交者时，创建任务后（或放弃创建时）必须调用result_cache.release()。
+    """
+    cached_task_id, leader = result_cache.acquire(cache_key, RESULT_CACHE_WAIT)
+    if cached_task_id:
+        with tasks_lock:  # 使用锁保护对tasks的访问
+            cached_task = tasks.get(cached_task_id)
+        if cached_task and ResultCache.is_reusable(cached_task):
+            return cached_task, leader
+        result_cache.invalidate(cache_key, cached_task_id)
+    return None, leader
+
+@app.route('/generate/batch', methods=['POST'])
+@require_ready
+def generate_batch():
+    """批量生成视频：多张图片 × 多个提示词 × 多个模型 × 多个分辨率的所有组合
+
+    image、prompt、model、resolution 字段都可以重复出现。模型不支持的分辨率组合会被跳过，
+    所有任务直接进入提交队列，由准入控制在限速和并发上限内并行提交，请求本身不等待DashScope。
+    与单个生成相同，已成功或仍在生成中的相同组合直接复用原任务（force=true时强制重新生成），
+    复用的任务不属于本批次，在返回的tasks中标记cached。
+    """
+    upload_refs = []  # 本次请求持有的上传文件引用，任务记录各自持有引用后释放
+    cache_leaders = {}  # 本请求负责提交的缓存键 -> 创建的task_id
+    try:
+        prompts = [p for p in request.form.getlist('prompt') if p] or ['将静态图片转换为动态视频，添加自然的动态效果']
+        models = [m for m in request.form.getlist('model') if m] or ['wanx2.1-i2v-turbo']
+        resolutions = [r for r in request.form.getlist('resolution') if r] or ['720P']
+        negative_prompt = request.form.get('negative_prompt', '')
+        prompt_extend = request.form.get('prompt_extend') == 'true' or request.form.get('prompt_extend') == 'on'
+        priority = request.form.get('priority', 'normal')
+        if priority not in PRIORITIES:
+            return jsonify({'success': False, 'error': f'不支持的优先级 {priority}'}), 400
         
-        print(f"API请求数据: {payload}")
+        # 模型和分辨率的组合只校验一次，不支持的组合跳过
+        combinations = []
+        skipped = []
+        for model in dict.fromkeys(models):
+            for resolution in dict.fromkeys(resolutions):
+                error_msg = check_resolution(model, resolution)
+                if error_msg:
+                    skipped.append({'model': model, 'resolution': resolution, 'error': error_msg})
+                else:
+                    combinations.append((model, resolution))
+        if not combinations:
+            return jsonify({'success': False, 'error': '没有可用的模型和分辨率组合', 'skipped': skipped}), 400
         
-        # 发送HTTP请求到DashScope API
-        headers = {
-            'X-DashScope-Async': 'enable',
-            'Authorization': f'Bearer {DASHSCOPE_API_KEY}',
-            'Content-Type': 'application/json'
-        }
+        files = [file for file in request.files.getlist('image') if file.filename]
+        if not files:
+            return jsonify({'success': False, 'error': '没有选择图片'}), 400
+        for file in files:
+            if not allowed_file(file.filename):
+                return jsonify({'success': False, 'error': f'不支持的文件格式: {file.filename}'}), 400
         
-        response = requests.post(
-            f'{DASHSCOPE_BASE_URL}/services/aigc/video-generation/video-synthesis',
-            headers=headers,
-            data=json.dumps(payload)
-        )
+        total = len(files) * len(prompts) * len(combinations)
+        if total > BATCH_MAX_TASKS:
+            return jsonify({'success': False, 'error': f'批量任务数 {total} 超过上限 {BATCH_MAX_TASKS}'}), 400
+        if admission.remaining() < total:
+            logger.warning("提交队列剩余容量不足，拒绝 %d 个批量任务", total)
+            response = jsonify({'success': False, 'error': '提交队列已满，请稍后重试',
+                                'queue_length': admission.stats()['queued']})
+            response.headers['Retry-After'] = '30'
+            return response, 429
         
-        print(f"API响应状态码: {response.status_code}")
+        # 每张图片只保存和编码一次，提交时所有组合共用缓存的base64编码
+        images = []
+        for file in files:
+            ext = file.filename.rsplit('.', 1)[1].lower()
+            try:
+                image_sha256, file_path, existed = upload_store.save(file.stream, ext)
+            except FileTooLargeError as e:
+                return jsonify({'success': False, 'error': f'{file.filename}: {e}'}), 400
+            upload_refs.append(file_path)
+            if upload_store.get_base64(image_sha256) is None:
+                upload_store.load_base64(image_sha256, file_path)
+            images.append((file.filename, image_sha256, file_path))
         
-        if response.status_code == 200:
-            result = response.json()
-            print(f"API响应数据: {result}")
-            with tasks_lock:  # 使用锁保护对tasks的访问
-                tasks[task_id] = {
-                    'id': task_id,
-                    'async_task_id': result['output']['task_id'],
-                    'status': 'PENDING',
-                    'prompt': prompt,
-                    'negative_prompt': negative_prompt,
-                    'prompt_extend': prompt_extend,
-                    'model': model,
-                    'resolution': resolution,
-                    'created_at': datetime.now().isoformat(),
-                    'input_file': file_path,
-                    'error': None,
-                    'error_code': None,
-                    'output_path': None,
-                    'message': '',
-                    'video_url': None
-                }
-            
-            # 启动后台线程检查任务状态
-            thread = threading.Thread(target=check_task_status, args=(task_id,))
-            thread.daemon = True
-            thread.start()
-            
-            # 保存任务状态
-            save_tasks()
-            
-            print(f"任务 {task_id} 已创建并启动状态检查线程")
-            return jsonify({'success': True, 'task_id': task_id})
-        else:
-            error_result = response.json() if response.content else {}
-            error_message = error_result.get('message', 'API调用失败')
-            error_code = error_result.get('code', 'UnknownError')
-            print(f"API调用失败: {error_message}, code: {error_code}")
-            return jsonify({'success': False, 'error': error_message, 'code': error_code}), response.status_code
-            
+        force = request.form.get('force') in ('true', 'on', '1')
+        batch_id = generate_task_id()
+        new_tasks = []
+        results = []  # 按组合顺序返回的任务，复用的任务为 (任务记录, True)
+        batch_keys = {}  # 本批次中已创建的缓存键 -> 任务记录，批次内重复的组合共用一个任务
+        for filename, image_sha256, file_path in images:
+            for prompt in prompts:
+                for model, resolution in combinations:
+                    cache_key = generation_cache_key(image_sha256, prompt, negative_prompt,
+                                                     model, resolution, prompt_extend)
+                    if RESULT_CACHE_ENABLED and not force:
+                        if cache_key in batch_keys:
+                            results.append((batch_keys[cache_key], filename, False))
+                            continue
+                        cached_task, leader = find_reusable_task(cache_key)
+                        if leader:
+                            cache_leaders[cache_key] = None
+                        if cached_task:
+                            results.append((cached_task, filename, True))
+                            continue
+                    task = {
+                        'id': generate_task_id(),
+                        'batch_id': batch_id,
+                        'async_task_id': None,
+                        'status': 'QUEUED',
+                        'priority': priority,
+                        'prompt': prompt,
+                        'negative_prompt': negative_prompt,
+                        'prompt_extend': prompt_extend,
+                        'model': model,
+                        'resolution': resolution,
+                        'created_at': datetime.now().isoformat(),
+                        'input_file': file_path,
+                        'input_filename': filename,
+                        'input_sha256': image_sha256,
+                        'cache_key': cache_key,
+                        'error': None,
+                        'error_code': None,
+                        'output_path': None,
+                        'message': '',
+                        'video_url': None
+                    }
+                    new_tasks.append(task)
+                    batch_keys[cache_key] = task
+                    results.append((task, filename, False))
+        with tasks_lock:  # 使用锁保护对tasks的访问
+            for task in new_tasks:
+                add_task_locked(task)
+        for task in new_tasks:
+            upload_store.add_ref(task['input_file'])
+            save_task(task['id'])
+            admission.enqueue(task['id'], task['model'], priority)
+            if task['cache_key'] in cache_leaders:
+                cache_leaders[task['cache_key']] = task['id']
+        
+        reused = sum(1 for _, _, cached in results if cached)
+        logger.info("批量任务 %s 已创建 %d 个任务，复用 %d 个任务", batch_id, len(new_tasks), reused,
+                    extra={'batch_id': batch_id, 'images': len(images), 'skipped': len(skipped)})
+        entries = []
+        for task, filename, cached in results:
+            entry = {'task_id': task['id'], 'image': filename, 'prompt': task['prompt'],
+                     'model': task['model'], 'resolution': task['resolution']}
+            if cached:
+                entry.update(cached=True, status=task['status'])
+            entries.append(entry)
+        return jsonify({
+            'success': True,
+            # 所有组合都复用了已有任务时没有创建批次
+            'batch_id': batch_id if new_tasks else None,
+            'total': total,
+            'reused': reused,
+            'tasks': entries,
+            'skipped': skipped,
+        }), 202 if new_tasks else 200
+    
     except Exception as e:
-        print(f"创建任务时出错: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("创建批量任务时出错: %s", e)
         return jsonify({'success': False, 'error': str(e)}), 500
+    finally:
+        for path in upload_refs:
+            upload_store.release(path)
+        # 唤醒等待相同请求结果的其他请求
+        for cache_key, task_id in cache_leaders.items():
+            result_cache.release(cache_key, task_id)
+
+def batch_summary(batch_id, include_tasks=True):
+    """汇总批次中各任务的状态，批次不存在时返回None
+
+    批次状态：全部排队中为QUEUED，有未完成的任务为RUNNING，全部结束后为
+    SUCCEEDED（全部成功）、FAILED（全部失败）或PARTIAL（部分失败）。
+    """
+    with tasks_lock:  # 使用锁保护对tasks的访问
+        batch = [tasks[task_id] for task_id in batch_tasks.get(batch_id, ()) if task_id in tasks]
+    if not batch:
+        return None
+    
+    counts = {}
+    finished = 0
+    for task in batch:
+        counts[task.get('status')] = counts.get(task.get('status'), 0) + 1
+        # 成功的任务视频下载完成后才算结束
+        if task.get('status') == 'FAILED' or (task.get('status') == 'SUCCEEDED'
+                                              and task.get('download_status') != 'DOWNLOADING'):
+            finished += 1
+    total = len(batch)
+    if finished < total:
+        status = 'QUEUED' if counts.get('QUEUED') == total else 'RUNNING'
+    elif not counts.get('FAILED'):
+        status = 'SUCCEEDED'
+    elif not counts.get('SUCCEEDED'):
+        status = 'FAILED'
+    else:
+        status = 'PARTIAL'
+    
+    summary = {
+        'id': batch_id,
+        'status': status,
+        'total': total,
+        'finished': finished,
+        'progress': round(finished / total, 4),
+        'counts': counts,
+        'created_at': min(task.get('created_at') or '' for task in batch),
+        'version': max(task.get('version', 0) for task in batch),
+    }
+    if include_tasks:
+        summary['tasks'] = [with_thumbnail_urls(task) for task in batch]
+    return summary
+
+@app.route('/batches/<batch_id>')
+@require_ready
+def get_batch(batch_id):
+    """获取批次的汇总进度和其中的任务"""
+    summary = batch_summary(batch_id, include_tasks=request.args.get('tasks', 'true') != 'false')
+    if summary is None:
+        return jsonify({'success': False, 'error': '批次不存在'}), 404
+    return jsonify({'success': True, 'batch': summary})
+
+@app.route('/batches/<batch_id>/events')
+@require_ready
+def batch_events(batch_id):
+    """批次进度的SSE事件流
+
+    批次中的任务变化时推送汇总进度（batch_progress），批次全部结束后推送batch_finished并关闭连接。
+    """
+    if batch_summary(batch_id, include_tasks=False) is None:
+        return jsonify({'success': False, 'error': '批次不存在'}), 404
+    
+    # 订阅全局任务事件，只用于唤醒，每次唤醒时重新汇总批次进度
+    subscriber, _, _ = sse_hub.subscribe()
+    
+    def event_stream():
+        try:
+            last_summary = None
+            while True:
+                summary = batch_summary(batch_id, include_tasks=False)
+                if summary is None:
+                    break
+                if summary['status'] not in ('QUEUED', 'RUNNING'):
+                    yield format_sse(dict(summary, type='batch_finished'), event_id=summary['version'])
+                    break
+                if summary != last_summary:
+                    yield format_sse(dict(summary, type='batch_progress'), event_id=summary['version'])
+                    last_summary = summary
+                if subscriber.drain(SSE_HEARTBEAT_INTERVAL) == []:
+                    yield format_sse({'type': 'heartbeat'})
+        finally:
+            sse_hub.unsubscribe(subscriber)
+    
+    response = Response(event_stream(), mimetype="text/event-stream")
+    response.call_on_close(lambda: sse_hub.unsubscribe(subscriber))
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'  # 禁止Nginx缓冲事件流
+    return response
 
 @app.route('/status/<task_id>')
 def get_status(task_id):
-    """获取任务状态"""
-    print(f"访问任务状态路由 '/status/{task_id}'")
+    """获取任务状态
+
+    长轮询：同时指定 wait（秒）和 version（客户端已有的任务版本号）时，
+    任务版本仍为version则阻塞到任务变化或超时，超时后返回未变化的任务。
+    """
+    wait = request.args.get('wait', type=float)
+    known_version = request.args.get('version', type=int)
+    fields = request_fields()
+    
+    event = None
     with tasks_lock:  # 使用锁保护对tasks的访问
         task = tasks.get(task_id)
+        if task and wait and known_version is not None and task.get('version', 0) == known_version:
+            # 在锁内注册，不会错过注册之后的变化
+            event = status_waiters.register(task_id)
     if not task:
-        # 检查是否在文件中存在
-        try:
-            if os.path.exists(TASKS_FILE):
-                with open(TASKS_FILE, 'r', encoding='utf-8') as f:
-                    file_tasks = json.load(f)
-                    if task_id in file_tasks:
-                        with tasks_lock:  # 使用锁保护对tasks的访问
-                            tasks[task_id] = file_tasks[task_id]
-                            task = tasks[task_id]
-        except Exception as e:
-            print(f"从文件加载任务时出错: {e}")
-    
+        # 内存中没有时从任务存储（预热中或其他进程刚创建的任务）或归档中只读返回，不加入内存，也不等待变化
+        task = find_task(task_id)
     if not task:
-        print(f"任务 {task_id} 不存在")
         return jsonify({'success': False, 'error': '任务不存在'}), 404
     
-    print(f"返回任务 {task_id} 状态: {task['status']}")
+    if event is not None:
+        status_waiters.wait(task_id, event, min(wait, STATUS_WAIT_MAX))
+        with tasks_lock:  # 使用锁保护对tasks的访问
+            task = tasks.get(task_id) or task
+    
+    if task.get('status') == 'QUEUED':
+        # 排队中的任务返回在提交队列中的位置
+        task = dict(task, queue_position=admission.position(task_id))
+    elif task.get('status') in ['PENDING', 'RUNNING']:
+        # 根据同一模型和分辨率的历史耗时估计剩余时间
+        task = dict(task, eta=latency_model.eta(task))
+    if fields:
+        task = project_task(task, fields)
     return jsonify({'success': True, 'task': task})
 
+def encode_task_cursor(sort_key):
+    """将 (created_at, id) 编码为分页游标"""
+    return base64.urlsafe_b64encode(json.dumps(list(sort_key)).encode('utf-8')).decode('ascii')
+
+def decode_task_cursor(cursor):
+    """解析分页游标，无效时抛出ValueError"""
+    try:
+        created_at, task_id = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        return (str(created_at), str(task_id))
+    except Exception:
+        raise ValueError('无效的分页游标')
+
+def request_fields():
+    """解析fields查询参数（逗号分隔的字段名），未指定时返回None
+
+    id和version总是返回，不存在的字段忽略。
+    """
+    value = request.args.get('fields')
+    if not value:
+        return None
+    fields = {name.strip() for name in value.split(',')}
+    fields.discard('')
+    return fields | {'id', 'version'}
+
+def project_task(task, fields):
+    """只保留任务记录中fields指定的字段"""
+    return {key: task[key] for key in fields if key in task}
+
+def file_flags(task):
+    """任务是否有输入图片、是否已下载视频，列表页据此展示而不需要服务器上的文件路径"""
+    return {'has_input': bool(task.get('input_file')), 'has_output': bool(task.get('output_path'))}
+
+# SSE任务变化事件使用的投影，与request_fields()一样总是包含id和version
+TASK_LIST_PROJECTION = frozenset(TASK_LIST_FIELDS) | {'id', 'version'}
+
+def with_thumbnail_urls(task, fields=None):
+    """复制任务记录并加上缩略图地址，列表页使用缩略图而不是原图和原视频
+
+    指定fields时只返回这些字段，缩略图地址和has_input/has_output也只在请求了对应字段时加入。
+    """
+    result = project_task(task, fields) if fields else dict(task)
+    for key, value in file_flags(task).items():
+        if not fields or key in fields:
+            result[key] = value
+    if task.get('input_file') and (not fields or 'thumbnail_url' in fields):
+        result['thumbnail_url'] = f"/thumbnail/{task['id']}/input"
+    if task.get('status') == 'SUCCEEDED' and (not fields or 'poster_url' in fields):
+        result['poster_url'] = f"/thumbnail/{task['id']}/poster"
+    return result
+
 @app.route('/tasks')
+@require_ready
 def list_tasks():
-    """获取所有任务列表"""
-    print("访问任务列表路由 '/tasks'")
-    # 确保从文件中加载最新的任务
-    load_tasks()
+    """获取任务列表
+
+    支持的查询参数：
+    - limit: 每页数量
+    - cursor: 上一页返回的next_cursor，按创建时间倒序继续翻页
+    - since: 只返回版本号大于since的任务（增量更新），按版本号升序；期间归档移除的任务ID在removed中返回，
+      删除标记已丢弃等无法增量更新时返回reset为true，客户端需要重新加载列表
+    - fields: 逗号分隔的字段名，只返回这些字段，例如列表页只需要展示用到的字段
+    """
+    limit = request.args.get('limit', TASKS_PAGE_SIZE, type=int)
+    limit = max(1, min(limit, TASKS_PAGE_MAX))
+    cursor = request.args.get('cursor')
+    since = request.args.get('since', type=int)
+    fields = request_fields()
+    
     with tasks_lock:  # 使用锁保护对tasks的访问
-        tasks_copy = list(tasks.values())
-    return jsonify({'success': True, 'tasks': tasks_copy})
+        version = tasks_version
+    
+    # 任务列表未变化时直接返回304。ETag只由任务版本决定，同一版本压缩与否内容等价，使用弱ETag
+    etag = f'tasks-{version}'
+    if request.if_none_match.contains_weak(etag):
+        response = Response(status=304)
+        response.set_etag(etag, weak=True)
+        return response
+    
+    try:
+        end_key = decode_task_cursor(cursor) if cursor else None
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    
+    result = {'success': True}
+    with tasks_lock:  # 使用锁保护对tasks的访问
+        if since is not None and (since < removals_floor or since > tasks_version):
+            page = []
+            result['version'] = tasks_version
+            result['has_more'] = False
+            result['reset'] = True
+        elif since is not None:
+            # 从最新的变化往前找，直到版本号不大于since
+            changed_ids = []
+            for task_id in reversed(task_changes):
+                if task_changes[task_id] <= since:
+                    break
+                changed_ids.append(task_id)
+            changed_ids.reverse()
+            has_more = len(changed_ids) > limit
+            changed_ids = changed_ids[:limit]
+            page = [with_thumbnail_urls(tasks[task_id], fields) for task_id in changed_ids if task_id in tasks]
+            result['removed'] = [task_id for task_id in changed_ids if task_id not in tasks]
+            result['version'] = task_changes[changed_ids[-1]] if has_more else tasks_version
+            result['has_more'] = has_more
+        else:
+            # 按创建时间倒序分页
+            end = bisect.bisect_left(tasks_order, end_key) if end_key else len(tasks_order)
+            start = max(0, end - limit)
+            page_keys = tasks_order[start:end][::-1]
+            page = [with_thumbnail_urls(tasks[task_id], fields) for _, task_id in page_keys]
+            result['version'] = tasks_version
+            result['next_cursor'] = encode_task_cursor(page_keys[-1]) if start > 0 else None
+        etag = f'tasks-{tasks_version}'
+    result['tasks'] = page
+    
+    response = jsonify(result)
+    response.set_etag(etag, weak=True)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+@app.route('/archive/tasks')
+def list_archived_tasks():
+    """按创建时间倒序分页列出已归档的任务
+
+    支持的查询参数：
+    - limit: 每页数量
+    - cursor: 上一页返回的next_cursor
+    - fields: 逗号分隔的字段名，只返回这些字段
+    """
+    limit = request.args.get('limit', TASKS_PAGE_SIZE, type=int)
+    limit = max(1, min(limit, TASKS_PAGE_MAX))
+    cursor = request.args.get('cursor')
+    fields = request_fields()
+    try:
+        before = decode_task_cursor(cursor) if cursor else None
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    
+    page = task_archive.list(limit, before)
+    next_cursor = encode_task_cursor(_task_sort_key(page[-1])) if len(page) == limit else None
+    return jsonify({'success': True, 'tasks': [with_thumbnail_urls(task, fields) for task in page],
+                    'next_cursor': next_cursor})
 
 @app.route('/events')
+@require_ready
 def events():
     """SSE事件流端点"""
-    print("客户端连接到SSE事件流")
+    logger.debug("客户端连接到SSE事件流")
+    
+    # 断线重连时浏览器发送Last-Event-ID，也支持通过查询参数指定
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+    try:
+        last_event_id = int(last_event_id) if last_event_id else None
+    except ValueError:
+        last_event_id = None
     
-    # 创建一个队列用于发送消息给客户端
-    client_queue = queue.Queue()
-    sse_clients.add(client_queue)
+    # 注册到广播中心，并取得需要补发的事件
+    subscriber, replay, current_version = sse_hub.subscribe(last_event_id)
     
     def event_stream():
-        # 发送初始连接确认消息
-        yield f"data: {json.dumps({'type': 'connected', 'message': 'Connected to SSE stream'})}\n\n"
-        
         try:
-            # 发送心跳包保持连接
-            last_heartbeat = time.time()
+            # 发送初始连接确认消息
+            yield format_sse({'type': 'connected', 'message': 'Connected to SSE stream', 'version': current_version})
+            
+            if replay is None:
+                # 错过的事件已不在缓冲区中，通知客户端通过 /tasks?since= 重新同步
+                yield format_sse({'type': 'resync', 'version': current_version})
+            elif replay:
+                yield ''.join(replay)
+            
             while True:
-                try:
-                    # 检查是否需要发送心跳包（每25秒发送一次）
-                    if time.time() - last_heartbeat >= 25:
-                        yield "data: {\"type\": \"heartbeat\"}\n\n"
-                        last_heartbeat = time.time()
-                        print("SSE心跳包发送")
-                    
-                    # 尝试获取消息，超时1秒
-                    message = client_queue.get(timeout=1)
-                    yield message
-                    # 注意：不重置心跳计时器，确保按固定间隔发送心跳包
-                except queue.Empty:
-                    # 超时继续循环
-                    continue
-                except GeneratorExit:
-                    # 客户端断开连接，这是正常情况
-                    print("SSE事件流生成器已关闭")
-                    raise
+                # 阻塞等待新消息，空闲时只在心跳间隔到达时唤醒
+                messages = subscriber.drain(SSE_HEARTBEAT_INTERVAL)
+                if messages is None:
+                    # 客户端消费过慢，积压的消息已被丢弃，合并为一条重新同步事件
+                    yield format_sse({'type': 'resync', 'version': sse_hub.last_seq})
+                elif messages:
+                    yield ''.join(messages)
+                else:
+                    yield format_sse({'type': 'heartbeat'})
         except GeneratorExit:
             # 客户端断开连接，这是正常情况
-            print("SSE事件流生成器已关闭")
             raise
         except Exception as e:
-            print(f"SSE客户端异常断开: {e}")
+            logger.info("SSE客户端异常断开: %s", e)
         finally:
-            # 从客户端集合中移除队列
-            sse_clients.discard(client_queue)
-            print("SSE客户端断开连接")
+            sse_hub.unsubscribe(subscriber)
+            logger.debug("SSE客户端断开连接")
     
-    return Response(event_stream(), mimetype="text/event-stream")
+    response = Response(event_stream(), mimetype="text/event-stream")
+    # 生成器未开始迭代就被关闭时finally不会执行，这里确保注销订阅者
+    response.call_on_close(lambda: sse_hub.unsubscribe(subscriber))
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'  # 禁止Nginx缓冲事件流
+    return response
 
 @app.route('/download/<task_id>')
 def download_video(task_id):
     """下载生成的视频"""
-    print(f"=== 下载功能调试信息 ===")
-    print(f"访问下载视频路由 '/download/{task_id}'")
-    
-    # 打印所有任务ID用于调试
-    with tasks_lock:  # 使用锁保护对tasks的访问
-        print(f"当前所有任务ID: {list(tasks.keys())}")
-    
-    with tasks_lock:  # 使用锁保护对tasks的访问
-        task = tasks.get(task_id)
+    task = find_task(task_id)
     if not task:
-        print(f"任务 {task_id} 不存在")
         return jsonify({'success': False, 'error': '任务不存在'}), 404
     
-    print(f"任务状态: {task['status']}")
     if task['status'] != 'SUCCEEDED':
-        print(f"任务状态不是SUCCEEDED，无法下载")
         return jsonify({'success': False, 'error': '视频尚未生成完成'}), 400
     
-    # 打印任务详细信息
-    print(f"任务详细信息: {task}")
-    
     # 首先检查本地是否已存在对应的视频文件（即使tasks.json中没有记录）
     possible_output_path = os.path.join(app.config['OUTPUT_FOLDER'], f"{task_id}.mp4")
-    print(f"检查可能的本地文件路径: {possible_output_path}")
-    print(f"文件是否存在: {os.path.exists(possible_output_path)}")
-    
     if os.path.exists(possible_output_path):
-        print(f"找到本地视频文件: {possible_output_path}")
+        output_lru.touch(possible_output_path)
         # 如果文件存在但任务记录中没有output_path或路径不匹配，更新任务记录
-        if not task.get('output_path') or task['output_path'] != possible_output_path:
-            task['output_path'] = possible_output_path
-            save_tasks()
-            print(f"已更新任务记录中的output_path字段")
+        # 预热完成前任务可能还未加载到内存，不更新记录，预热扫描已下载的视频后再请求时补上
+        if startup.ready and (not task.get('output_path') or task['output_path'] != possible_output_path):
+            update_task(task_id, output_path=possible_output_path)
         try:
-            print(f"准备发送文件: {possible_output_path}")
-            return send_file(possible_output_path, as_attachment=True)
+            return send_local_file(possible_output_path, mimetype='video/mp4', as_attachment=True, immutable=True)
         except FileNotFoundError:
-            print(f"文件未找到错误: {possible_output_path}")
+            logger.warning("文件未找到错误: %s", possible_output_path)
             return jsonify({'success': False, 'error': '视频文件不存在'}), 404
     
     # 使用任务记录中的本地已下载的视频文件
-    if task.get('output_path'):
-        print(f"任务记录中的output_path: {task['output_path']}")
-        print(f"文件是否存在: {os.path.exists(task['output_path'])}")
-    
     if task.get('output_path') and os.path.exists(task['output_path']):
-        print(f"使用任务记录中的视频文件路径: {task['output_path']}")
         try:
-            print(f"准备发送文件: {task['output_path']}")
-            return send_file(task['output_path'], as_attachment=True)
+            return send_local_file(task['output_path'], mimetype='video/mp4', as_attachment=True, immutable=True)
         except FileNotFoundError:
-            print(f"文件未找到错误: {task['output_path']}")
+            logger.warning("文件未找到错误: %s", task['output_path'])
             return jsonify({'success': False, 'error': '视频文件不存在'}), 404
     
-    # 如果视频未下载但有URL，尝试下载后再返回
+    # 视频已被清理且DashScope链接已过期时无法再获取
+    if task.get('video_url') and not video_url_valid(task):
+        return jsonify({'success': False, 'error': '视频已被清理且下载链接已过期'}), 410
+    
+    # 如果视频未下载但有URL，交给下载工作池下载后再返回
+    # 并发的下载请求共享同一个后台下载，视频文件不会被多个请求同时写入
     if task.get('video_url'):
-        print(f"尝试从URL下载视频: {task['video_url']}")
+        logger.info("等待从URL下载视频: %s", task['video_url'], extra={'task_id': task_id})
+        future = start_video_download(task_id, task['video_url'])
         try:
-            print(f"开始下载视频: {task['video_url']}")
-            video_response = requests.get(task['video_url'], stream=True, timeout=30)
-            print(f"视频下载响应状态码: {video_response.status_code}")
-            
-            if video_response.status_code == 200:
-                output_path = os.path.join(app.config['OUTPUT_FOLDER'], f"{task_id}.mp4")
-                print(f"保存视频到: {output_path}")
-                with open(output_path, 'wb') as f:
-                    for chunk in video_response.iter_content(chunk_size=8192):
-                        f.write(chunk)
-                
-                # 更新任务信息
-                task['output_path'] = output_path
-                # 确保保留video_url字段（如果任务中已有该字段，则保持不变）
-                if 'video_url' not in task:
-                    task['video_url'] = None
-                save_tasks()
-                
-                # 返回下载的文件
-                print(f"准备发送下载的文件: {output_path}")
-                return send_file(output_path, as_attachment=True)
-            else:
-                print(f"下载失败，HTTP状态码: {video_response.status_code}")
-                return jsonify({'success': False, 'error': f'视频下载失败，HTTP状态码: {video_response.status_code}'}), 404
-        except requests.exceptions.RequestException as e:
-            print(f"下载请求异常: {str(e)}")
-            return jsonify({'success': False, 'error': f'视频下载网络异常: {str(e)}'}), 500
+            future.result(timeout=DOWNLOAD_WAIT_TIMEOUT)
+        except FuturesTimeoutError:
+            logger.info("任务 %s 的视频仍在下载中", task_id, extra={'task_id': task_id})
+            response = jsonify({'success': False, 'error': '视频正在下载中，请稍后重试',
+                                'progress': video_downloader.progress(possible_output_path)})
+            response.headers['Retry-After'] = '5'
+            return response, 503
+        except Exception as e:
+            logger.warning("下载请求异常: %s", e, extra={'task_id': task_id})
+            return jsonify({'success': False, 'error': f'视频下载失败: {str(e)}'}), 502
+        
+        # 返回下载的文件
+        return send_local_file(possible_output_path, mimetype='video/mp4', as_attachment=True, immutable=True)
     
     # 如果既没有本地文件也没有URL
-    print(f"没有可用的视频文件")
     return jsonify({'success': False, 'error': '没有可用的视频文件'}), 404
 
+def send_local_file(path, mimetype=None, as_attachment=False, immutable=False):
+    """发送本地文件，支持Range、ETag和Last-Modified条件请求
+
+    SENDFILE_MODE为x-sendfile或x-accel时，只返回响应头，由前端服务器（Apache/Nginx）
+    直接发送文件内容；否则使用WSGI服务器的file_wrapper（Gunicorn下为sendfile）。
+    """
+    if SENDFILE_MODE == 'x-accel':
+        rel_path = os.path.relpath(os.path.abspath(path), os.path.abspath(X_ACCEL_ROOT))
+        response = Response(mimetype=mimetype or 'application/octet-stream')
+        response.headers['X-Accel-Redirect'] = X_ACCEL_PREFIX.rstrip('/') + '/' + quote(rel_path.replace(os.sep, '/'))
+        if as_attachment:
+            response.headers['Content-Disposition'] = f'attachment; filename="{os.path.basename(path)}"'
+    else:
+        # send_file会把相对路径解析到应用目录下，这里统一使用绝对路径
+        response = send_file(os.path.abspath(path), mimetype=mimetype, as_attachment=as_attachment,
+                             conditional=True, etag=True)
+    if immutable:
+        response.headers['Cache-Control'] = f'public, max-age={IMMUTABLE_MAX_AGE}, immutable'
+    return response
+
 @app.route('/preview/<task_id>/<file_type>')
 def preview_file(task_id, file_type):
     """预览任务的输入图片或生成的视频"""
-    print(f"访问预览文件路由 '/preview/{task_id}/{file_type}'")
-    task = tasks.get(task_id)
+    task = find_task(task_id)
     if not task:
-        print(f"任务 {task_id} 不存在")
         return jsonify({'success': False, 'error': '任务不存在'}), 404
     
     file_path = None
     if file_type == 'input' and task.get('input_file'):
         file_path = task['input_file']
-        print(f"输入文件路径: {file_path}")
     elif file_type == 'output':
         # 支持三种情况：
         # 1. 已下载到本地的视频文件
@@ -673,62 +1843,189 @@ def preview_file(task_id, file_type):
         # 3. 有video_url但未下载的视频（尝试下载到本地再返回）
         if task.get('output_path') and os.path.exists(task['output_path']):
             file_path = task['output_path']
-            print(f"输出文件路径: {file_path}")
-        elif task.get('video_url'):
+            output_lru.touch(file_path)
+        elif task.get('video_url') and video_url_valid(task):
             # 如果有视频URL但没有下载的文件，重定向到视频URL
-            print(f"重定向到视频URL: {task['video_url']}")
             return redirect(task['video_url'])
         else:
-            print(f"没有可用的输出文件或URL")
             return jsonify({'success': False, 'error': '没有可用的视频文件'}), 404
     else:
-        print(f"不支持的文件类型 {file_type} 或文件路径不存在")
         return jsonify({'success': False, 'error': '文件类型不支持或文件不存在'}), 404
     
     if not file_path:
-        print(f"文件路径为空")
         return jsonify({'success': False, 'error': '文件路径未指定'}), 404
     
-    print(f"检查文件是否存在: {file_path}")
     if not os.path.exists(file_path):
-        print(f"文件不存在: {file_path}")
         return jsonify({'success': False, 'error': '文件不存在'}), 404
     
-    print(f"文件存在，准备传输: {file_path}")
     try:
-        # 使用流式传输避免Content-Length不匹配问题
-        def generate():
-            try:
-                with open(file_path, 'rb') as f:
-                    while True:
-                        chunk = f.read(8192)
-                        if not chunk:
-                            break
-                        yield chunk
-            except GeneratorExit:
-                # 客户端断开连接，正常情况，不需要特殊处理
-                print(f"文件传输生成器已关闭: {file_path}")
-                raise
-            except Exception as e:
-                print(f"文件传输生成器错误: {str(e)}")
-                raise
-        
         # 根据文件类型设置MIME类型
         if file_type == 'input':
             mime_type = 'image/jpeg' if file_path.lower().endswith('.jpg') or file_path.lower().endswith('.jpeg') else 'image/png'
+            # 按内容哈希保存的输入图片路径内容不可变，可以长期缓存
+            immutable = upload_store.is_managed(file_path)
         else:  # output
             mime_type = 'video/mp4'
+            immutable = True
         
-        print(f"使用MIME类型传输文件: {mime_type}")
-        return Response(generate(), mimetype=mime_type)
+        return send_local_file(file_path, mimetype=mime_type, immutable=immutable)
+    except FileNotFoundError:
+        logger.warning("文件未找到错误: %s", file_path)
+        return jsonify({'success': False, 'error': '文件不存在'}), 404
     except Exception as e:
-        print(f"文件传输错误: {str(e)}")
+        logger.exception("文件传输错误: %s", e)
         return jsonify({'success': False, 'error': f'文件传输错误: {str(e)}'}), 500
 
+@app.route('/thumbnail/<task_id>/<kind>')
+def thumbnail(task_id, kind):
+    """输入图片缩略图(input)或视频封面帧(poster)"""
+    task = find_task(task_id)
+    if not task:
+        return jsonify({'success': False, 'error': '任务不存在'}), 404
+    input_file = task.get('input_file')
+    input_sha256 = task.get('input_sha256')
+    output_path = task.get('output_path')
+    
+    if kind == 'input':
+        if not input_file or not os.path.exists(input_file):
+            return jsonify({'success': False, 'error': '文件不存在'}), 404
+        # 按内容哈希保存的图片用哈希作为缓存键，相同图片共享缩略图
+        thumb_path = thumbnail_cache.image_thumbnail(input_file, input_sha256 or f'task-{task_id}')
+        if not thumb_path:
+            return redirect(f'/preview/{task_id}/input')
+    elif kind == 'poster':
+        if not output_path or not os.path.exists(output_path):
+            return jsonify({'success': False, 'error': '视频尚未下载到本地'}), 404
+        thumb_path = thumbnail_cache.video_poster(output_path, task_id)
+        if not thumb_path:
+            return jsonify({'success': False, 'error': '无法生成视频封面'}), 404
+    else:
+        return jsonify({'success': False, 'error': '不支持的缩略图类型'}), 404
+    
+    try:
+        return send_local_file(thumb_path, mimetype='image/jpeg', immutable=True)
+    except FileNotFoundError:
+        # 刚好被淘汰，下次请求时重新生成
+        return jsonify({'success': False, 'error': '缩略图不存在'}), 404
+
+@app.before_request
+def bind_request_id():
+    """为本次请求的日志加上request_id，优先使用反向代理传入的X-Request-ID"""
+    g.request_id = request.headers.get('X-Request-ID') or uuid.uuid4().hex
+    g.log_context_token = bind_log_context(request_id=g.request_id)
+
+@app.after_request
+def add_request_id_header(response):
+    request_id = g.get('request_id')
+    if request_id:
+        response.headers['X-Request-ID'] = request_id
+    return response
+
+@app.after_request
+def compress_response(response):
+    """按Accept-Encoding压缩JSON和页面响应，文件和SSE等流式响应不压缩"""
+    if RESPONSE_COMPRESSION:
+        response = response_compressor.process(request, response)
+    return response
+
+@app.teardown_request
+def unbind_request_id(exc):
+    token = g.pop('log_context_token', None)
+    if token is not None:
+        reset_log_context(token)
+
+@metrics.register_collector
+def collect_component_metrics():
+    """导出各组件stats()中的数量类指标，只在抓取时计算"""
+    with tasks_lock:  # 使用锁保护对tasks的访问
+        status_counts = {}
+        for task in tasks.values():
+            status = task.get('status')
+            status_counts[status] = status_counts.get(status, 0) + 1
+        version = tasks_version
+    poller = poll_scheduler.stats()
+    sse = sse_hub.stats()
+    http = http_client.stats.snapshot()
+    downloads = video_downloader.stats()
+    uploads = upload_store.stats()
+    cache = result_cache.stats()
+    outputs = output_lru.stats()
+    thumbs = thumbnail_cache.stats()
+    logs = log_stats()
+    submit_queue = admission.stats()
+    eta_stats = latency_model.stats()
+    waiters = status_waiters.stats()
+    compaction_stats = compaction.stats()
+    startup_stats = startup.snapshot()
+    compression_stats = response_compressor.stats()
+    families = [] if not MULTI_WORKER else [
+        ('cluster_sync_seq', 'gauge', '已同步的共享任务事件序号', [({}, cluster_sync.stats()['last_seq'])]),
+        ('cluster_leases_held', 'gauge', '本进程持有的租约数', [({}, leases.held())]),
+    ]
+    return families + [
+        ('tasks', 'gauge', '各状态的任务数量', [({'status': s}, n) for s, n in status_counts.items()]),
+        ('tasks_version', 'gauge', '全局任务版本号', [({}, version)]),
+        ('poller_threads_active', 'gauge', '正在执行状态检查的轮询线程数', [({}, poller['active'])]),
+        ('poller_threads', 'gauge', '轮询工作线程总数', [({}, poller['workers'])]),
+        ('poller_queue_depth', 'gauge', '轮询调度器中的任务数', [({'state': 'waiting'}, poller['waiting']),
+                                                          ({'state': 'ready'}, poller['ready'])]),
+        ('submit_queue_depth', 'gauge', '提交队列中排队的任务数',
+         [({'model': m}, n) for m, n in submit_queue['queued_by_model'].items()]),
+        ('submit_inflight', 'gauge', '已提交到DashScope且未完成的任务数',
+         [({'model': m}, n) for m, n in submit_queue['inflight_by_model'].items()]),
+        ('submit_throttled_total', 'counter', 'DashScope返回限流的次数', [({}, submit_queue['throttled'])]),
+        ('eta_samples', 'gauge', '用于估计完成时间的耗时样本数', [({}, eta_stats['samples'])]),
+        ('sse_clients', 'gauge', 'SSE客户端连接数', [({}, sse['clients'])]),
+        ('status_waiters', 'gauge', '等待任务变化的/status长轮询请求数', [({}, waiters['waiters'])]),
+        ('sse_pending_messages', 'gauge', 'SSE客户端积压的消息数', [({}, sse['pending'])]),
+        ('http_requests_total', 'counter', '发往DashScope和视频存储的HTTP请求数', [({}, http['requests'])]),
+        ('http_errors_total', 'counter', 'HTTP请求错误数', [({}, http['errors'])]),
+        ('http_retries_total', 'counter', 'HTTP请求重试次数', [({}, http['retries'])]),
+        ('http_connections_total', 'counter', '新建的HTTP连接数', [({}, http['connections'])]),
+        ('http_connect_seconds_total', 'counter', '建立HTTP连接的总耗时', [({}, http['connect_time'])]),
+        ('downloads_active', 'gauge', '正在进行的视频下载数', [({}, len(downloads['active']))]),
+        ('upload_files', 'gauge', '按内容哈希保存的上传文件数', [({}, uploads['files'])]),
+        ('upload_cache_bytes', 'gauge', '上传图片base64缓存大小', [({}, uploads['cache_bytes'])]),
+        ('result_cache_entries', 'gauge', '生成结果缓存条目数', [({}, cache['entries'])]),
+        ('result_cache_requests_total', 'counter', '生成结果缓存查询次数',
+         [({'result': 'hit'}, cache['hits']), ({'result': 'miss'}, cache['misses'])]),
+        ('disk_cache_bytes', 'gauge', '磁盘缓存占用字节数',
+         [({'cache': 'output'}, outputs['bytes']), ({'cache': 'thumbnail'}, thumbs['bytes'])]),
+        ('ready', 'gauge', '应用是否已完成预热（1为就绪）', [({}, int(startup_stats['ready']))]),
+        ('startup_phase_seconds', 'gauge', '启动预热各阶段的耗时',
+         [({'phase': name}, seconds) for name, seconds in startup_stats['phases'].items()]),
+        ('archived_tasks', 'gauge', '已归档的任务数（最近一轮清理时）', [({}, compaction_stats.get('archive_tasks', 0))]),
+        ('compaction_runs_total', 'counter', '归档和磁盘清理的执行次数',
+         [({'result': 'ok'}, compaction_stats['runs']), ({'result': 'error'}, compaction_stats['errors'])]),
+        ('response_bytes_total', 'counter', '压缩的响应在压缩前后的字节数',
+         [({'stage': 'raw'}, compression_stats['raw_bytes']),
+          ({'stage': 'compressed'}, compression_stats['compressed_bytes'])]),
+        ('compressed_responses_total', 'counter', '压缩的响应数',
+         [({'encoding': e}, n) for e, n in compression_stats['responses'].items()]),
+        ('log_queue_depth', 'gauge', '等待输出的日志数', [({}, logs['queue_size'])]),
+        ('log_dropped_total', 'counter', '因日志队列满而丢弃的日志数', [({}, logs['dropped'])]),
+    ]
+
+@app.route('/healthz')
+def healthz():
+    """存活检查：进程可以处理请求即返回200，同时报告预热进度"""
+    return jsonify({'status': 'ok', 'startup': startup.snapshot()})
+
+@app.route('/readyz')
+def readyz():
+    """就绪检查：任务加载和恢复完成前返回503，负载均衡器据此决定是否转发流量"""
+    snapshot = startup.snapshot()
+    return jsonify(snapshot), 200 if snapshot['ready'] else 503
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """Prometheus指标"""
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4; charset=utf-8')
+
 # 处理404错误的通用路由
 @app.errorhandler(404)
 def not_found(error):
-    print(f"404错误: {request.url}")
+    logger.debug("404错误: %s", request.url)
     return jsonify({'success': False, 'error': '请求的资源不存在', 'url': request.url}), 404
 
 # 应用初始化标记
@@ -750,5 +2047,5 @@ if __name__ == '__main__':
     port = int(os.environ.get('PORT', 5001))
     debug = os.environ.get('DEBUG', 'False').lower() == 'true'
     
-    print(f"启动应用: http://{host}:{port}")
+    logger.info("启动应用: http://%s:%s", host, port)
     app.run(host=host, port=port, debug=debug)
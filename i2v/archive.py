@@ -0,0 +1,190 @@
+import json
+import time
+import zlib
+import sqlite3
+import threading
+from collections import OrderedDict
+
+
+class TaskArchive:
+    """已结束任务的压缩归档（SQLite）
+
+    每次归档把一批任务写成一个段：整段任务JSON用zlib压缩后保存为一行，相同字段名
+    在段内共享，压缩率远高于逐条压缩。另有按任务ID和创建时间的索引表，
+    可以按ID查询单个归档任务，或按创建时间倒序分页列出，查询时只解压涉及的段。
+    最近读取的几个段解压后缓存在内存中。
+    索引表同时记录输入图片路径：归档任务仍然引用输入图片，图片被保留策略删除后
+    只在索引表中标记input_evicted，读取时合并到任务记录，不需要重写压缩段。
+    """
+
+    def __init__(self, db_path, segment_cache=4):
+        self.db_path = db_path
+        self.segment_cache = segment_cache
+        self._lock = threading.Lock()
+        self._segments = OrderedDict()  # 段ID -> {task_id: 任务}，最近读取的段
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS archive_segments ('
+            ' id INTEGER PRIMARY KEY AUTOINCREMENT,'
+            ' created REAL NOT NULL,'
+            ' count INTEGER NOT NULL,'
+            ' raw_bytes INTEGER NOT NULL,'
+            ' stored_bytes INTEGER NOT NULL,'
+            ' data BLOB NOT NULL)'
+        )
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS archived_tasks ('
+            ' id TEXT PRIMARY KEY,'
+            ' created_at TEXT,'
+            ' status TEXT,'
+            ' segment INTEGER NOT NULL,'
+            ' input_file TEXT,'
+            ' input_evicted INTEGER,'
+            ' removed_version INTEGER)'
+        )
+        self._conn.execute('CREATE INDEX IF NOT EXISTS idx_archived_created_at ON archived_tasks(created_at, id)')
+        self._migrate_input_columns()
+        columns = {row[1] for row in self._conn.execute('PRAGMA table_info(archived_tasks)')}
+        if 'removed_version' not in columns:
+            self._conn.execute('ALTER TABLE archived_tasks ADD COLUMN removed_version INTEGER')
+        self._conn.execute('CREATE INDEX IF NOT EXISTS idx_archived_input_file ON archived_tasks(input_file)')
+
+    def _migrate_input_columns(self):
+        """旧版本的归档索引表没有输入图片列，添加后从压缩段中回填"""
+        columns = {row[1] for row in self._conn.execute('PRAGMA table_info(archived_tasks)')}
+        if 'input_file' in columns:
+            return
+        self._conn.execute('ALTER TABLE archived_tasks ADD COLUMN input_file TEXT')
+        self._conn.execute('ALTER TABLE archived_tasks ADD COLUMN input_evicted INTEGER')
+        rows = []
+        for segment, data in self._conn.execute('SELECT id, data FROM archive_segments'):
+            rows.extend((task.get('input_file'), task['id'], segment)
+                        for task in json.loads(zlib.decompress(data)) if task.get('input_file'))
+        self._conn.executemany('UPDATE archived_tasks SET input_file = ? WHERE id = ? AND segment = ?', rows)
+
+    def add_segment(self, task_list):
+        """把一批任务写成一个压缩段，返回 (段ID, 原始字节数, 压缩后字节数)"""
+        raw = json.dumps(task_list, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+        data = zlib.compress(raw, 9)
+        rows = [(task['id'], task.get('created_at'), task.get('status'), task.get('input_file'),
+                 1 if task.get('input_evicted') else None) for task in task_list]
+        with self._lock:
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                cursor = self._conn.execute(
+                    'INSERT INTO archive_segments (created, count, raw_bytes, stored_bytes, data) VALUES (?, ?, ?, ?, ?)',
+                    (time.time(), len(task_list), len(raw), len(data), data)
+                )
+                segment = cursor.lastrowid
+                # 同一任务被再次归档时（例如归档后删除热数据前进程退出）以新段为准
+                self._conn.executemany(
+                    'INSERT OR REPLACE INTO archived_tasks (id, created_at, status, input_file, input_evicted, segment)'
+                    ' VALUES (?, ?, ?, ?, ?, ?)',
+                    [row + (segment,) for row in rows]
+                )
+                self._conn.execute('COMMIT')
+            except Exception:
+                self._conn.execute('ROLLBACK')
+                raise
+        return segment, len(raw), len(data)
+
+    def _load_segment_locked(self, segment):
+        cached = self._segments.get(segment)
+        if cached is not None:
+            self._segments.move_to_end(segment)
+            return cached
+        row = self._conn.execute('SELECT data FROM archive_segments WHERE id = ?', (segment,)).fetchone()
+        if row is None:
+            return {}
+        cached = {task['id']: task for task in json.loads(zlib.decompress(row[0]))}
+        self._segments[segment] = cached
+        while len(self._segments) > self.segment_cache:
+            self._segments.popitem(last=False)
+        return cached
+
+    @staticmethod
+    def _with_flags(task, input_evicted):
+        if task is not None and input_evicted and not task.get('input_evicted'):
+            return dict(task, input_evicted=True)
+        return task
+
+    def get(self, task_id):
+        """按ID读取归档任务，不存在时返回None"""
+        with self._lock:
+            row = self._conn.execute('SELECT segment, input_evicted FROM archived_tasks WHERE id = ?',
+                                     (task_id,)).fetchone()
+            if row is None:
+                return None
+            return self._with_flags(self._load_segment_locked(row[0]).get(task_id), row[1])
+
+    def list(self, limit, before=None):
+        """按 (created_at, id) 倒序列出归档任务，before为上一页最后一个任务的排序键"""
+        with self._lock:
+            if before:
+                rows = self._conn.execute(
+                    'SELECT id, segment, input_evicted FROM archived_tasks WHERE (created_at, id) < (?, ?)'
+                    ' ORDER BY created_at DESC, id DESC LIMIT ?', (before[0], before[1], limit)
+                ).fetchall()
+            else:
+                rows = self._conn.execute(
+                    'SELECT id, segment, input_evicted FROM archived_tasks ORDER BY created_at DESC, id DESC LIMIT ?',
+                    (limit,)
+                ).fetchall()
+            result = []
+            for task_id, segment, input_evicted in rows:
+                task = self._with_flags(self._load_segment_locked(segment).get(task_id), input_evicted)
+                if task:
+                    result.append(task)
+            return result
+
+    def mark_removed(self, versions):
+        """记录任务从热数据中移除时分配的版本号 {task_id: 版本号}，重启后任务版本号从中最大的继续递增"""
+        with self._lock:
+            self._conn.execute('BEGIN')
+            try:
+                self._conn.executemany('UPDATE archived_tasks SET removed_version = ? WHERE id = ?',
+                                       [(version, task_id) for task_id, version in versions.items()])
+                self._conn.execute('COMMIT')
+            except Exception:
+                self._conn.execute('ROLLBACK')
+                raise
+
+    def max_removed_version(self):
+        with self._lock:
+            return self._conn.execute('SELECT MAX(removed_version) FROM archived_tasks').fetchone()[0] or 0
+
+    def input_files(self):
+        """归档任务引用的、尚未被删除的输入图片路径（每个任务一项，用于重建引用计数）"""
+        with self._lock:
+            return [row[0] for row in self._conn.execute(
+                'SELECT input_file FROM archived_tasks WHERE input_file IS NOT NULL AND input_evicted IS NULL'
+            )]
+
+    def mark_input_evicted(self, paths):
+        """输入图片被保留策略删除后标记引用它们的归档任务，返回标记的任务数"""
+        rows = [(path,) for path in paths]
+        with self._lock:
+            self._conn.execute('BEGIN')
+            try:
+                cursor = self._conn.executemany(
+                    'UPDATE archived_tasks SET input_evicted = 1 WHERE input_file = ? AND input_evicted IS NULL', rows
+                )
+                self._conn.execute('COMMIT')
+            except Exception:
+                self._conn.execute('ROLLBACK')
+                raise
+        return cursor.rowcount
+
+    def stats(self):
+        with self._lock:
+            tasks = self._conn.execute('SELECT COUNT(*) FROM archived_tasks').fetchone()[0]
+            segments, raw_bytes, stored_bytes = self._conn.execute(
+                'SELECT COUNT(*), COALESCE(SUM(raw_bytes), 0), COALESCE(SUM(stored_bytes), 0) FROM archive_segments'
+            ).fetchone()
+        return {'tasks': tasks, 'segments': segments, 'raw_bytes': raw_bytes, 'stored_bytes': stored_bytes}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
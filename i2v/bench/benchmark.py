@@ -0,0 +1,500 @@
+"""离线压测：使用模拟的DashScope API驱动应用的各个接口
+
+默认会启动模拟DashScope服务器，并在临时目录中启动应用（可预先写入指定数量的历史任务），
+然后依次对 /generate、/status、/tasks、/download 施加并发负载，同时保持一组 /events
+SSE连接，最后输出每个接口的吞吐量、p50/p99延迟以及应用进程的内存(RSS)和线程数。
+
+用法:
+    python bench/benchmark.py --concurrency 16 --duration 10 --history 10000
+    python bench/benchmark.py --scenarios tasks,status --history 100000 --json result.json
+    python bench/benchmark.py --app-url http://127.0.0.1:5001   # 压测已运行的应用
+    python bench/benchmark.py --startup-only --history 100000 --history-pending 2000   # 只测启动耗时
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import random
+import shutil
+import socket
+import argparse
+import tempfile
+import threading
+import subprocess
+from datetime import datetime, timedelta
+
+import requests
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+APP_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BENCH_DIR)
+sys.path.insert(0, APP_DIR)
+
+from fake_dashscope import serve, add_arguments, fake_from_args  # noqa: E402
+
+ALL_SCENARIOS = ('generate', 'status', 'tasks', 'download', 'events')
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(p / 100 * (len(sorted_values) - 1)))))
+    return sorted_values[index]
+
+
+class Recorder:
+    """记录一个场景中每个请求的耗时和错误"""
+
+    def __init__(self, name):
+        self.name = name
+        self._lock = threading.Lock()
+        self.latencies = []
+        self.errors = 0
+        self.elapsed = 0.0
+        self.extra = {}
+
+    def record(self, latency, ok=True):
+        with self._lock:
+            self.latencies.append(latency)
+            if not ok:
+                self.errors += 1
+
+    def summary(self):
+        values = sorted(self.latencies)
+        result = {
+            'requests': len(values),
+            'errors': self.errors,
+            'throughput': len(values) / self.elapsed if self.elapsed else 0.0,
+            'p50_ms': percentile(values, 50) * 1000,
+            'p99_ms': percentile(values, 99) * 1000,
+            'max_ms': (values[-1] if values else 0.0) * 1000,
+        }
+        result.update(self.extra)
+        return result
+
+
+class ProcessSampler:
+    """定期读取进程的RSS和线程数（Linux /proc），记录峰值"""
+
+    def __init__(self, pid, interval=0.5):
+        self.pid = pid
+        self.interval = interval
+        self.samples = []
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def read(self):
+        try:
+            with open(f'/proc/{self.pid}/status', encoding='utf-8') as f:
+                fields = dict(line.split(':', 1) for line in f if ':' in line)
+            return {'rss_mb': int(fields['VmRSS'].split()[0]) / 1024, 'threads': int(fields['Threads'])}
+        except (OSError, KeyError, ValueError):
+            return None
+
+    def _run(self):
+        while not self._stop.is_set():
+            sample = self.read()
+            if sample:
+                self.samples.append(sample)
+            self._stop.wait(self.interval)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        if not self.samples:
+            return {}
+        return {
+            'rss_mb_start': self.samples[0]['rss_mb'],
+            'rss_mb_max': max(s['rss_mb'] for s in self.samples),
+            'rss_mb_end': self.samples[-1]['rss_mb'],
+            'threads_max': max(s['threads'] for s in self.samples),
+            'threads_end': self.samples[-1]['threads'],
+        }
+
+
+def seed_history(db_path, count, pending=0, json_path=None):
+    """向任务数据库写入历史任务，模拟长期运行后的任务规模
+
+    最后pending个任务为生成中的任务，用于测量重启后恢复状态检查的开销。
+    指定json_path时写入JSON任务文件（TASK_STORE=json）而不是SQLite数据库。
+    """
+    from storage import SqliteTaskStore
+    store = SqliteTaskStore(db_path) if not json_path else None
+    records = {}
+    start = datetime.now() - timedelta(days=30)
+    statuses = ['SUCCEEDED'] * 8 + ['FAILED']
+    batch = []
+    for i in range(count):
+        task_id = str(uuid.uuid4())
+        status = random.choice(statuses) if i < count - pending else 'RUNNING'
+        batch.append({
+            'id': task_id,
+            'async_task_id': str(uuid.uuid4()),
+            'status': status,
+            'prompt': f'历史任务 {i}',
+            'negative_prompt': '',
+            'prompt_extend': True,
+            'model': 'wanx2.1-i2v-turbo',
+            'resolution': '720P',
+            'created_at': (start + timedelta(seconds=i)).isoformat(),
+            'completed_at': (start + timedelta(seconds=i + 60)).isoformat() if status != 'RUNNING' else None,
+            'input_file': None,
+            'error': '模拟的失败' if status == 'FAILED' else None,
+            'error_code': 'InternalError' if status == 'FAILED' else None,
+            'output_path': None,
+            'message': '',
+            'video_url': None,
+            'version': i + 1,
+        })
+        if len(batch) >= 5000 or i == count - 1:
+            if store:
+                store.put_many(batch)
+            else:
+                records.update((task['id'], task) for task in batch)
+            batch = []
+    if store:
+        store.close()
+    else:
+        with open(json_path, 'w', encoding='utf-8') as f:
+            json.dump(records, f, ensure_ascii=False)
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def start_app(workdir, api_url, extra_env, startup_timeout=120):
+    """在临时目录中启动应用，开始响应HTTP请求后返回 (进程, 应用URL)"""
+    port = free_port()
+    env = dict(os.environ)
+    env.update({
+        'HOST': '127.0.0.1',
+        'PORT': str(port),
+        'DEBUG': 'False',
+        'DASHSCOPE_API_KEY': 'bench',
+        'DASHSCOPE_BASE_URL': api_url,
+        'TASK_DB': os.path.join(workdir, 'tasks.db'),
+        'TASKS_FILE': os.path.join(workdir, 'tasks.json'),
+        'UPLOAD_FOLDER': os.path.join(workdir, 'uploads'),
+        'OUTPUT_FOLDER': os.path.join(workdir, 'downloads'),
+        'THUMBNAIL_FOLDER': os.path.join(workdir, 'thumbnails'),
+        'LOG_LEVEL': 'WARNING',
+        'POLL_INTERVAL': '1',
+    })
+    env.update(extra_env)
+    log_file = open(os.path.join(workdir, 'app.log'), 'wb')
+    process = subprocess.Popen([sys.executable, os.path.join(APP_DIR, 'app.py')], cwd=workdir, env=env,
+                               stdout=log_file, stderr=subprocess.STDOUT)
+    app_url = f'http://127.0.0.1:{port}'
+    deadline = time.time() + startup_timeout
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f'应用启动失败，日志: {log_file.name}')
+        try:
+            requests.get(f'{app_url}/healthz', timeout=1)
+            return process, app_url
+        except requests.exceptions.RequestException:
+            time.sleep(0.05)
+    process.terminate()
+    raise RuntimeError('等待应用启动超时')
+
+
+def wait_ready(app_url, timeout=300):
+    """等待 /readyz 返回200（任务加载和恢复完成），返回预热进度"""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            response = requests.get(f'{app_url}/readyz', timeout=1)
+            if response.status_code == 200:
+                return response.json()
+        except requests.exceptions.RequestException:
+            pass
+        time.sleep(0.05)
+    raise RuntimeError('等待应用就绪超时')
+
+
+def run_workers(recorder, concurrency, duration, request_func):
+    """用concurrency个线程在duration秒内循环调用request_func(session)"""
+    deadline = time.perf_counter() + duration
+
+    def worker():
+        session = requests.Session()
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            try:
+                ok = request_func(session)
+            except (requests.exceptions.RequestException, ValueError):
+                ok = False
+            recorder.record(time.perf_counter() - start, ok)
+
+    threads = [threading.Thread(target=worker, daemon=True) for _ in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    recorder.elapsed = time.perf_counter() - start
+    return recorder
+
+
+class Benchmark:
+    def __init__(self, app_url, args):
+        self.app_url = app_url
+        self.args = args
+        self.created = []  # /generate创建的任务ID（包括进入提交队列的任务）
+        self.queued = 0  # 其中未能立即提交、返回202进入提交队列的任务数
+        self.succeeded = []  # 已生成并下载到本地的任务ID
+        self.known_ids = []  # /status随机查询的任务ID
+        self._lock = threading.Lock()
+        self._image = os.urandom(args.image_size)
+
+    def load_known_ids(self):
+        response = requests.get(f'{self.app_url}/tasks', params={'limit': 500}, timeout=30)
+        self.known_ids = [task['id'] for task in response.json().get('tasks', [])]
+
+    def generate(self, session):
+        # 默认每次上传不同的内容，避免命中上传去重和结果缓存；--reuse-image 用于测试缓存路径
+        image = self._image if self.args.reuse_image else os.urandom(self.args.image_size)
+        response = session.post(f'{self.app_url}/generate', files={'image': ('bench.jpg', image, 'image/jpeg')},
+                                data={'prompt': 'benchmark', 'model': 'wanx2.1-i2v-turbo', 'resolution': '720P'},
+                                timeout=60)
+        data = response.json()
+        # 超出提交限速或模型并发上限时返回202，任务在提交队列中排队，同样算作创建成功
+        if response.status_code in (200, 202) and data.get('task_id'):
+            with self._lock:
+                self.created.append(data['task_id'])
+                if response.status_code == 202:
+                    self.queued += 1
+            return True
+        return False
+
+    def status(self, session):
+        ids = self.known_ids or self.created
+        if not ids:
+            return False
+        response = session.get(f'{self.app_url}/status/{random.choice(ids)}', timeout=30)
+        return response.status_code == 200
+
+    def tasks(self, session):
+        response = session.get(f'{self.app_url}/tasks', params={'limit': 50}, timeout=30)
+        if response.status_code != 200:
+            return False
+        cursor = response.json().get('next_cursor')
+        if cursor:
+            response = session.get(f'{self.app_url}/tasks', params={'limit': 50, 'cursor': cursor}, timeout=30)
+        return response.status_code == 200
+
+    def download(self, session):
+        with self._lock:
+            ids = list(self.succeeded)
+        if not ids:
+            return False
+        response = session.get(f'{self.app_url}/download/{random.choice(ids)}', stream=True, timeout=120)
+        for _ in response.iter_content(chunk_size=256 * 1024):
+            pass
+        return response.status_code == 200
+
+    def wait_for_videos(self, timeout):
+        """等待/generate创建的任务完成，返回已成功且视频已下载到本地的任务"""
+        self.succeeded = []
+        pending = list(self.created[:max(self.args.concurrency * 4, 20)])
+        deadline = time.time() + timeout
+        session = requests.Session()
+        while pending and time.time() < deadline:
+            still_pending = []
+            for task_id in pending:
+                task = session.get(f'{self.app_url}/status/{task_id}', timeout=30).json().get('task', {})
+                if task.get('status') == 'SUCCEEDED' and task.get('download_status') == 'DONE':
+                    self.succeeded.append(task_id)
+                elif task.get('status') != 'FAILED':
+                    still_pending.append(task_id)
+            pending = still_pending
+            if pending:
+                time.sleep(0.5)
+        return self.succeeded
+
+    def start_event_clients(self, count, stop_event):
+        """保持count个SSE连接直到stop_event，记录连接耗时和收到的事件数"""
+        recorder = Recorder('events')
+        received = [0] * count
+        threads = []
+
+        def client(index):
+            start = time.perf_counter()
+            try:
+                with requests.get(f'{self.app_url}/events', stream=True, timeout=(10, 60)) as response:
+                    connected = False
+                    for line in response.iter_lines(chunk_size=1):
+                        if stop_event.is_set():
+                            break
+                        if not line.startswith(b'data:'):
+                            continue
+                        if not connected:
+                            recorder.record(time.perf_counter() - start, response.status_code == 200)
+                            connected = True
+                        else:
+                            received[index] += 1
+            except requests.exceptions.RequestException:
+                if not stop_event.is_set():
+                    recorder.record(time.perf_counter() - start, ok=False)
+
+        began = time.perf_counter()
+        for i in range(count):
+            thread = threading.Thread(target=client, args=(i,), daemon=True)
+            thread.start()
+            threads.append(thread)
+
+        def finish():
+            recorder.elapsed = time.perf_counter() - began
+            recorder.extra = {'clients': count, 'events_received': sum(received)}
+            return recorder
+
+        return finish
+
+
+def print_report(results, process_stats):
+    print()
+    print(f'{"场景":<10}{"请求数":>10}{"错误":>8}{"吞吐(req/s)":>14}{"p50(ms)":>10}{"p99(ms)":>10}{"max(ms)":>10}')
+    for name, summary in results.items():
+        print(f'{name:<10}{summary["requests"]:>10}{summary["errors"]:>8}{summary["throughput"]:>14.1f}'
+              f'{summary["p50_ms"]:>10.1f}{summary["p99_ms"]:>10.1f}{summary["max_ms"]:>10.1f}')
+        if name == 'events':
+            print(f'{"":<10}SSE连接数 {summary["clients"]}，共收到事件 {summary["events_received"]}（p50/p99为建立连接的耗时）')
+    if process_stats:
+        print()
+        print(f'应用进程: RSS {process_stats["rss_mb_start"]:.1f}MB -> 峰值 {process_stats["rss_mb_max"]:.1f}MB，'
+              f'线程数峰值 {process_stats["threads_max"]}，结束时 {process_stats["threads_end"]}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='使用模拟DashScope API压测应用')
+    parser.add_argument('--app-url', help='压测已运行的应用（不启动模拟API和应用）')
+    parser.add_argument('--pid', type=int, help='与--app-url一起使用，采样该进程的RSS和线程数')
+    parser.add_argument('--scenarios', default=','.join(ALL_SCENARIOS),
+                        help=f'逗号分隔的场景列表（默认: {",".join(ALL_SCENARIOS)}）')
+    parser.add_argument('--concurrency', type=int, default=8, help='每个场景的并发请求数')
+    parser.add_argument('--duration', type=float, default=10, help='每个场景的持续时间(秒)')
+    parser.add_argument('--history', type=int, default=0, help='启动前写入的历史任务数')
+    parser.add_argument('--history-pending', type=int, default=0, help='历史任务中生成中（RUNNING）的任务数')
+    parser.add_argument('--history-store', choices=['sqlite', 'json'], default='sqlite',
+                        help='历史任务写入SQLite数据库或JSON任务文件（TASK_STORE=json）')
+    parser.add_argument('--startup-only', action='store_true',
+                        help='只测量启动耗时（开始响应HTTP和就绪的时间、各预热阶段耗时）')
+    parser.add_argument('--sse-clients', type=int, default=50, help='events场景保持的SSE连接数')
+    parser.add_argument('--image-size', type=int, default=64 * 1024, help='上传图片的大小(字节)')
+    parser.add_argument('--reuse-image', action='store_true', help='所有/generate请求上传同一张图片')
+    parser.add_argument('--wait-videos', type=float, default=60, help='download场景前等待视频生成的最长时间(秒)')
+    parser.add_argument('--app-env', action='append', default=[], metavar='KEY=VALUE',
+                        help='传给应用的环境变量，可重复指定')
+    parser.add_argument('--keep-workdir', action='store_true', help='保留应用的临时目录')
+    parser.add_argument('--json', help='将结果写入JSON文件，便于比较不同版本')
+    parser.add_argument('--fake-port', type=int, default=0, help='模拟API的端口（默认随机）')
+    add_arguments(parser)
+    parser.set_defaults(run_time=2.0, pending_time=0.5, video_size=4 * 1024 * 1024)
+    args = parser.parse_args()
+
+    scenarios = [s.strip() for s in args.scenarios.split(',') if s.strip()]
+    unknown = set(scenarios) - set(ALL_SCENARIOS)
+    if unknown:
+        parser.error(f'未知的场景: {", ".join(sorted(unknown))}')
+
+    process = None
+    workdir = None
+    fake_server = None
+    try:
+        if args.app_url:
+            app_url = args.app_url.rstrip('/')
+            pid = args.pid
+        else:
+            fake = fake_from_args(args)
+            fake_server, api_url = serve(fake, port=args.fake_port)
+            workdir = tempfile.mkdtemp(prefix='i2v-bench-')
+            extra_env = {}
+            if args.history:
+                print(f'写入 {args.history} 个历史任务...')
+                json_path = os.path.join(workdir, 'tasks.json') if args.history_store == 'json' else None
+                seed_history(os.path.join(workdir, 'tasks.db'), args.history, args.history_pending, json_path)
+                if json_path:
+                    extra_env['TASK_STORE'] = 'json'
+            extra_env.update(item.split('=', 1) for item in args.app_env)
+            started = time.perf_counter()
+            process, app_url = start_app(workdir, api_url, extra_env)
+            serving = time.perf_counter() - started
+            print(f'应用已启动: {app_url}（开始响应HTTP耗时 {serving:.2f} 秒，工作目录 {workdir}）')
+            startup = wait_ready(app_url)
+            ready = time.perf_counter() - started
+            print(f'应用已就绪: 耗时 {ready:.2f} 秒，预热各阶段耗时 {startup["phases"]}')
+            pid = process.pid
+            if args.startup_only:
+                status_before = fake.stats()['status']
+                time.sleep(5)
+                print(f'就绪后5秒内的状态查询数: {fake.stats()["status"] - status_before}')
+                if args.json:
+                    with open(args.json, 'w', encoding='utf-8') as f:
+                        json.dump({'args': vars(args), 'serving_seconds': serving, 'ready_seconds': ready,
+                                   'startup': startup}, f, ensure_ascii=False, indent=2)
+                return
+
+        sampler = ProcessSampler(pid) if pid else None
+        if sampler:
+            sampler.start()
+
+        bench = Benchmark(app_url, args)
+        results = {}
+        stop_events = threading.Event()
+        finish_events = None
+        if 'events' in scenarios:
+            finish_events = bench.start_event_clients(args.sse_clients, stop_events)
+
+        for name in scenarios:
+            if name == 'events':
+                continue
+            if name == 'status':
+                bench.load_known_ids()
+            if name == 'download':
+                if not bench.created:
+                    print('download场景需要先运行generate场景，已跳过')
+                    continue
+                if bench.queued:
+                    print(f'generate场景创建的 {len(bench.created)} 个任务中有 {bench.queued} 个进入提交队列')
+                print(f'等待视频生成完成（最长 {args.wait_videos:.0f} 秒）...')
+                if not bench.wait_for_videos(args.wait_videos):
+                    print('没有生成成功的视频，已跳过download场景')
+                    continue
+            print(f'运行场景 {name}: 并发 {args.concurrency}，持续 {args.duration:.0f} 秒')
+            recorder = run_workers(Recorder(name), args.concurrency, args.duration, getattr(bench, name))
+            results[name] = recorder.summary()
+
+        if finish_events:
+            stop_events.set()
+            results['events'] = finish_events().summary()
+
+        process_stats = sampler.stop() if sampler else {}
+        print_report(results, process_stats)
+        if not args.app_url:
+            print(f'模拟API统计: {fake.stats()}')
+        if args.json:
+            with open(args.json, 'w', encoding='utf-8') as f:
+                json.dump({'args': vars(args), 'results': results, 'process': process_stats}, f,
+                          ensure_ascii=False, indent=2)
+    finally:
+        if process:
+            process.terminate()
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        if fake_server:
+            fake_server.shutdown()
+        if workdir and not args.keep_workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
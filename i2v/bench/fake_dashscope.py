@@ -0,0 +1,244 @@
+"""本地模拟的DashScope视频生成API，用于压测和离线开发
+
+实现了提交任务、查询任务状态和下载视频三个接口：
+- POST <前缀>/services/aigc/video-generation/video-synthesis
+- GET  <前缀>/tasks/<task_id>
+- GET  /videos/<task_id>.mp4（支持Range）
+
+任务提交后先处于PENDING，再变为RUNNING，到达生成时长后变为SUCCEEDED或FAILED。
+接口延迟、生成时长、任务失败率和HTTP错误率都可以通过命令行参数配置。
+
+用法:
+    python bench/fake_dashscope.py --port 8600 --run-time 10 --fail-rate 0.05
+    DASHSCOPE_BASE_URL=http://127.0.0.1:8600/api/v1 DASHSCOPE_API_KEY=test python app.py
+"""
+import re
+import json
+import time
+import uuid
+import random
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+SUBMIT_PATH = re.compile(r'^(/.*)?/services/aigc/video-generation/video-synthesis$')
+STATUS_PATH = re.compile(r'^(/.*)?/tasks/([\w-]+)$')
+VIDEO_PATH = re.compile(r'^/videos/([\w-]+)\.mp4$')
+RANGE_HEADER = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+class FakeDashScope:
+    """模拟任务的状态和统计，与HTTP处理分离，便于在测试中直接使用"""
+
+    def __init__(self, submit_latency=0.05, poll_latency=0.02, pending_time=1.0, run_time=5.0,
+                 run_jitter=0.2, fail_rate=0.0, error_rate=0.0, video_size=2 * 1024 * 1024):
+        self.submit_latency = submit_latency
+        self.poll_latency = poll_latency
+        self.pending_time = pending_time
+        self.run_time = run_time
+        self.run_jitter = run_jitter
+        self.fail_rate = fail_rate
+        self.error_rate = error_rate
+        self.video_size = video_size
+        self.base_url = None  # 生成视频URL时使用，由serve()设置
+        self._lock = threading.Lock()
+        self._tasks = {}
+        self.counters = {'submit': 0, 'status': 0, 'video': 0, 'video_bytes': 0, 'errors': 0}
+        # 视频内容是重复的固定数据块，不需要为每个任务分配内存
+        self._block = bytes(range(256)) * 256
+
+    def count(self, name, amount=1):
+        with self._lock:
+            self.counters[name] += amount
+
+    def should_fail_request(self):
+        if self.error_rate and random.random() < self.error_rate:
+            self.count('errors')
+            return True
+        return False
+
+    def submit(self, payload):
+        task_id = str(uuid.uuid4())
+        run_time = self.run_time * random.uniform(1 - self.run_jitter, 1 + self.run_jitter)
+        with self._lock:
+            self._tasks[task_id] = {
+                'submitted_at': time.time(),
+                'run_time': run_time,
+                'fail': random.random() < self.fail_rate,
+                'model': payload.get('model'),
+            }
+            self.counters['submit'] += 1
+        return task_id
+
+    def status(self, task_id):
+        """返回任务的output字段，任务不存在时返回None"""
+        with self._lock:
+            task = self._tasks.get(task_id)
+            self.counters['status'] += 1
+        if task is None:
+            return None
+        elapsed = time.time() - task['submitted_at']
+        output = {'task_id': task_id}
+        if elapsed < self.pending_time:
+            output['task_status'] = 'PENDING'
+        elif elapsed < self.pending_time + task['run_time']:
+            output['task_status'] = 'RUNNING'
+        elif task['fail']:
+            output.update(task_status='FAILED', code='InternalError.Timeout', message='模拟的任务失败')
+        else:
+            output.update(task_status='SUCCEEDED', video_url=f'{self.base_url}/videos/{task_id}.mp4')
+        return output
+
+    def has_task(self, task_id):
+        with self._lock:
+            return task_id in self._tasks
+
+    def video_bytes(self, start, end):
+        """生成视频内容中 [start, end] 的数据"""
+        block_size = len(self._block)
+        offset = start
+        while offset <= end:
+            block_offset = offset % block_size
+            length = min(block_size - block_offset, end - offset + 1)
+            yield self._block[block_offset:block_offset + length]
+            offset += length
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counters, tasks=len(self._tasks))
+
+
+class FakeDashScopeHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # 支持keep-alive，与真实API一致
+    server_version = 'FakeDashScope/1.0'
+
+    @property
+    def fake(self):
+        return self.server.fake
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def send_json(self, status, data):
+        body = json.dumps(data, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+        if not SUBMIT_PATH.match(self.path):
+            return self.send_json(404, {'code': 'NotFound', 'message': 'not found'})
+        time.sleep(self.fake.submit_latency)
+        if self.fake.should_fail_request():
+            return self.send_json(500, {'code': 'InternalError', 'message': '模拟的服务器错误'})
+        try:
+            payload = json.loads(body)
+        except ValueError:
+            return self.send_json(400, {'code': 'InvalidParameter', 'message': '请求体不是有效的JSON'})
+        if not str(payload.get('input', {}).get('img_url', '')).startswith('data:'):
+            return self.send_json(400, {'code': 'InvalidParameter', 'message': '缺少img_url'})
+        task_id = self.fake.submit(payload)
+        self.send_json(200, {'request_id': str(uuid.uuid4()),
+                             'output': {'task_id': task_id, 'task_status': 'PENDING'}})
+
+    def do_GET(self):
+        if self.path == '/stats':
+            return self.send_json(200, self.fake.stats())
+        match = STATUS_PATH.match(self.path)
+        if match:
+            time.sleep(self.fake.poll_latency)
+            if self.fake.should_fail_request():
+                return self.send_json(503, {'code': 'Throttling', 'message': '模拟的限流错误'})
+            output = self.fake.status(match.group(2))
+            if output is None:
+                return self.send_json(404, {'code': 'NotFound', 'message': '任务不存在'})
+            return self.send_json(200, {'request_id': str(uuid.uuid4()), 'output': output})
+        match = VIDEO_PATH.match(self.path)
+        if match and self.fake.has_task(match.group(1)):
+            return self.send_video()
+        self.send_json(404, {'code': 'NotFound', 'message': 'not found'})
+
+    def send_video(self):
+        size = self.fake.video_size
+        start, end = 0, size - 1
+        status = 200
+        range_match = RANGE_HEADER.match(self.headers.get('Range', ''))
+        if range_match and (range_match.group(1) or range_match.group(2)):
+            if range_match.group(1):
+                start = int(range_match.group(1))
+                end = min(int(range_match.group(2)), size - 1) if range_match.group(2) else size - 1
+            else:
+                start = max(0, size - int(range_match.group(2)))
+            if start > end:
+                self.send_response(416)
+                self.send_header('Content-Range', f'bytes */{size}')
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            status = 206
+        self.send_response(status)
+        self.send_header('Content-Type', 'video/mp4')
+        self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('Content-Length', str(end - start + 1))
+        if status == 206:
+            self.send_header('Content-Range', f'bytes {start}-{end}/{size}')
+        self.end_headers()
+        for chunk in self.fake.video_bytes(start, end):
+            self.wfile.write(chunk)
+        self.fake.count('video')
+        self.fake.count('video_bytes', end - start + 1)
+
+
+def serve(fake, host='127.0.0.1', port=0, verbose=False):
+    """在后台线程中启动模拟服务器，返回 (server, API基础URL)"""
+    server = ThreadingHTTPServer((host, port), FakeDashScopeHandler)
+    server.daemon_threads = True
+    server.fake = fake
+    server.verbose = verbose
+    fake.base_url = f'http://{host}:{server.server_port}'
+    threading.Thread(target=server.serve_forever, name='fake-dashscope', daemon=True).start()
+    return server, f'{fake.base_url}/api/v1'
+
+
+def add_arguments(parser):
+    parser.add_argument('--submit-latency', type=float, default=0.05, help='提交接口延迟(秒)')
+    parser.add_argument('--poll-latency', type=float, default=0.02, help='状态查询接口延迟(秒)')
+    parser.add_argument('--pending-time', type=float, default=1.0, help='任务处于PENDING的时间(秒)')
+    parser.add_argument('--run-time', type=float, default=5.0, help='任务处于RUNNING的时间(秒)')
+    parser.add_argument('--run-jitter', type=float, default=0.2, help='生成时长的随机浮动比例')
+    parser.add_argument('--fail-rate', type=float, default=0.0, help='任务最终失败的比例')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='接口返回HTTP 5xx错误的比例')
+    parser.add_argument('--video-size', type=int, default=2 * 1024 * 1024, help='生成视频的大小(字节)')
+
+
+def fake_from_args(args):
+    return FakeDashScope(submit_latency=args.submit_latency, poll_latency=args.poll_latency,
+                         pending_time=args.pending_time, run_time=args.run_time,
+                         run_jitter=args.run_jitter, fail_rate=args.fail_rate,
+                         error_rate=args.error_rate, video_size=args.video_size)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='本地模拟的DashScope视频生成API')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8600)
+    parser.add_argument('--verbose', action='store_true', help='输出每个请求的访问日志')
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    server, api_url = serve(fake_from_args(args), args.host, args.port, args.verbose)
+    print(f'模拟DashScope API已启动: DASHSCOPE_BASE_URL={api_url}')
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,185 @@
+import os
+import time
+import socket
+import uuid
+import logging
+import threading
+from concurrent.futures import Future
+
+logger = logging.getLogger(__name__)
+
+
+def make_worker_id():
+    """当前进程的唯一标识（主机名-进程号-随机后缀），进程重启后不同"""
+    return f'{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}'
+
+
+class LeaseManager:
+    """基于共享SQLite存储的租约
+
+    同一名称的租约同时只有一个进程持有，持有者崩溃后租约过期，由其他进程接管。
+    本进程持有的租约记录在内存中，剩余时间超过一半时直接返回，不访问数据库，
+    因此每个任务的每次轮询不会都产生一次写事务。
+    """
+
+    def __init__(self, store, owner, ttl=30.0):
+        self.store = store
+        self.owner = owner
+        self.ttl = ttl
+        self._held = {}  # 名称 -> (过期时间, 租期)
+        self._lock = threading.Lock()
+
+    def acquire(self, name, ttl=None):
+        """获取或续期租约，其他进程持有且未过期时返回False"""
+        ttl = ttl or self.ttl
+        now = time.time()
+        with self._lock:
+            held = self._held.get(name)
+            if held and now < held[0] - held[1] / 2:
+                return True
+        try:
+            acquired = self.store.acquire_lease(name, self.owner, ttl)
+        except Exception:
+            logger.exception("获取租约 %s 失败", name)
+            return False
+        with self._lock:
+            if acquired:
+                self._held[name] = (now + ttl, ttl)
+            else:
+                self._held.pop(name, None)
+        return acquired
+
+    def release(self, name):
+        """释放本进程持有的租约，未持有时不访问数据库"""
+        with self._lock:
+            if self._held.pop(name, None) is None:
+                return
+        try:
+            self.store.release_lease(name, self.owner)
+        except Exception:
+            logger.exception("释放租约 %s 失败", name)
+
+    def held(self):
+        with self._lock:
+            return len(self._held)
+
+
+class SharedAdmissionLimits:
+    """多进程共享的提交限速和模型并发上限
+
+    令牌桶和每个模型已占用的并发名额保存在共享SQLite中，所有进程合计不超过SUBMIT_QPS和
+    MODEL_MAX_INFLIGHT，而不是每个进程各自计算。AdmissionController在提交前调用try_acquire()。
+    名额被其他进程占满时不会收到本进程的释放通知，调用方每隔retry_interval秒重新检查。
+    每个名额记录占用它的进程（owner），release()只释放本进程占用的名额：
+    其他进程重新排队了同一个任务时，它的提交被跳过后不会释放正在提交的进程的名额。
+    """
+
+    def __init__(self, store, qps, burst, owner, retry_interval=0.5):
+        self.store = store
+        self.qps = qps
+        self.burst = burst
+        self.owner = owner
+        self.retry_interval = retry_interval
+
+    def try_acquire(self, task_id, model, limit):
+        """返回 (是否成功, 等待秒数)，并发名额已满时等待秒数为None"""
+        try:
+            return self.store.acquire_submit_slot(task_id, model, limit, self.qps, self.burst, self.owner)
+        except Exception:
+            logger.exception("获取提交名额失败")
+            return False, self.retry_interval
+
+    def reserve(self, task_id, model):
+        try:
+            self.store.reserve_submit_slot(task_id, model, self.owner)
+        except Exception:
+            logger.exception("记录提交名额失败")
+
+    def release(self, task_id):
+        try:
+            self.store.release_submit_slot(task_id, self.owner)
+        except Exception:
+            logger.exception("释放提交名额失败")
+
+
+class ClusterSync:
+    """多进程之间的任务变化同步
+
+    每个进程写入任务时都会在共享SQLite中追加一条事件（序号全局递增）。
+    后台线程按序号读取新事件，交给apply_func合并到本进程内存并发布给本进程的SSE客户端，
+    因此任何一个进程上的客户端都能收到所有进程产生的任务变化，且事件ID在各进程间一致。
+    """
+
+    def __init__(self, store, apply_func, interval=0.2, batch_size=500, event_max_age=600.0):
+        self.store = store
+        self.apply_func = apply_func  # apply_func(事件列表)，事件为 (序号, task_id, 来源, 任务数据JSON或None)
+        self.interval = interval
+        self.batch_size = batch_size
+        self.event_max_age = event_max_age
+        self.last_seq = 0
+        self.applied = 0
+        self.errors = 0
+        self._thread = None
+        self._last_prune = time.monotonic()
+
+    def start(self, last_seq):
+        """从last_seq之后的事件开始同步"""
+        self.last_seq = last_seq
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='cluster-sync', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                count = self.poll_once()
+            except Exception:
+                self.errors += 1
+                logger.exception("同步任务变化事件失败")
+                count = 0
+            self._maybe_prune()
+            # 一批没有读完时立即读取下一批
+            if count < self.batch_size:
+                time.sleep(self.interval)
+
+    def poll_once(self):
+        events = self.store.events_since(self.last_seq, self.batch_size)
+        if events:
+            self.apply_func(events)
+            self.last_seq = events[-1][0]
+            self.applied += len(events)
+        return len(events)
+
+    def _maybe_prune(self):
+        # 事件只用于进程间传递，保留一段时间后删除
+        now = time.monotonic()
+        if now - self._last_prune < 60:
+            return
+        self._last_prune = now
+        try:
+            self.store.prune_events(self.event_max_age)
+        except Exception:
+            logger.exception("清理任务变化事件失败")
+
+    def stats(self):
+        return {'last_seq': self.last_seq, 'applied': self.applied, 'errors': self.errors}
+
+
+def wait_for_path(path, timeout, interval=0.5):
+    """返回一个Future，文件出现后完成，超时后以TimeoutError结束
+
+    用于等待其他进程正在进行的下载。
+    """
+    future = Future()
+
+    def run():
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if os.path.exists(path):
+                future.set_result({'path': path})
+                return
+            time.sleep(interval)
+        future.set_exception(TimeoutError(f'等待其他进程下载 {os.path.basename(path)} 超时'))
+
+    threading.Thread(target=run, name='wait-for-path', daemon=True).start()
+    return future
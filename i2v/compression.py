@@ -0,0 +1,86 @@
+import gzip
+import threading
+
+# brotli是可选依赖，缺少时只使用gzip
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSIBLE_MIMETYPES = {'application/json', 'text/html', 'text/plain', 'text/css', 'application/javascript'}
+
+
+def available_encodings():
+    """服务端支持的压缩编码，按优先级排列"""
+    return ['br', 'gzip'] if brotli is not None else ['gzip']
+
+
+def choose_encoding(accept_encodings):
+    """根据请求的Accept-Encoding选择压缩编码，客户端不接受压缩时返回None
+
+    accept_encodings为Werkzeug解析后的request.accept_encodings，
+    客户端对多个编码的权重相同时优先使用br。
+    """
+    return accept_encodings.best_match(available_encodings())
+
+
+def compress(data, encoding, gzip_level=3, brotli_quality=4):
+    """压缩响应体
+
+    响应在每次请求时实时压缩，默认使用较低的压缩级别：任务列表这类重复度高的JSON
+    压缩率与最高级别相差不大，耗时只有最高级别的几分之一。
+    """
+    if encoding == 'br':
+        return brotli.compress(data, quality=brotli_quality, mode=brotli.MODE_TEXT)
+    # mtime固定为0，相同内容压缩后的字节相同
+    return gzip.compress(data, compresslevel=gzip_level, mtime=0)
+
+
+class ResponseCompressor:
+    """按Accept-Encoding压缩Flask响应
+
+    只压缩状态码为200、类型为文本或JSON且不小于min_size字节的非流式响应；
+    send_file发送的文件和SSE等流式响应保持原样。压缩后的响应ETag改为弱ETag。
+    """
+
+    def __init__(self, min_size=1024, gzip_level=3, brotli_quality=4):
+        self.min_size = min_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+        self._lock = threading.Lock()
+        self.raw_bytes = 0
+        self.compressed_bytes = 0
+        self.responses = {}  # 编码 -> 压缩的响应数
+
+    def process(self, request, response):
+        if (response.status_code != 200 or response.direct_passthrough or response.is_streamed
+                or response.mimetype not in COMPRESSIBLE_MIMETYPES
+                or 'Content-Encoding' in response.headers):
+            return response
+        # 响应内容随Accept-Encoding变化，缓存需要区分
+        response.vary.add('Accept-Encoding')
+        encoding = choose_encoding(request.accept_encodings)
+        if encoding is None:
+            return response
+        data = response.get_data()
+        if len(data) < self.min_size:
+            return response
+        compressed = compress(data, encoding, self.gzip_level, self.brotli_quality)
+        response.set_data(compressed)
+        response.headers['Content-Encoding'] = encoding
+        etag, weak = response.get_etag()
+        if etag and not weak:
+            response.set_etag(etag, weak=True)
+        with self._lock:
+            self.raw_bytes += len(data)
+            self.compressed_bytes += len(compressed)
+            self.responses[encoding] = self.responses.get(encoding, 0) + 1
+        return response
+
+    def stats(self):
+        with self._lock:
+            return {
+                'raw_bytes': self.raw_bytes,
+                'compressed_bytes': self.compressed_bytes,
+                'responses': dict(self.responses),
+            }
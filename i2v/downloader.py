@@ -0,0 +1,248 @@
+import os
+import json
+import time
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+
+class DownloadError(Exception):
+    """视频下载失败"""
+
+
+class VideoDownloader:
+    """独立的视频下载工作池
+
+    下载先写入 <目标>.part，完成并校验大小后原子重命名为目标文件，
+    因此目标文件一旦存在就是完整的。服务器支持Range时，大文件按分段并行下载，
+    已完成的分段在数据落盘（fsync）后记录在 <目标>.part.json 中，中断后可以从已完成的分段继续。
+    同一个目标文件同时只会有一个下载在进行，重复提交返回同一个Future。
+    """
+
+    def __init__(self, http_client, workers=2, segment_size=8 * 1024 * 1024,
+                 segment_workers=4, chunk_size=1024 * 1024):
+        self.http_client = http_client
+        self.segment_size = segment_size
+        self.chunk_size = chunk_size
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='download')
+        self._segment_executor = ThreadPoolExecutor(max_workers=workers * segment_workers,
+                                                    thread_name_prefix='download-segment')
+        self._lock = threading.Lock()
+        self._inflight = {}  # 目标路径 -> Future
+        self._progress = {}  # 目标路径 -> 进度信息
+        self._recent = deque(maxlen=100)  # 最近完成的下载统计
+        self.completed = 0
+        self.failed = 0
+        self.total_bytes = 0
+        self.total_time = 0.0
+
+    def submit(self, url, dest_path):
+        """提交下载任务，返回 (Future, 是否新建)，Future的结果为下载统计信息
+
+        目标文件已有下载在进行时不会重复下载，而是返回同一个Future。
+        """
+        with self._lock:
+            future = self._inflight.get(dest_path)
+            if future is not None:
+                return future, False
+            self._progress[dest_path] = {'bytes': 0, 'total': None, 'started_at': time.time()}
+            future = self._executor.submit(self._run, url, dest_path)
+            self._inflight[dest_path] = future
+        return future, True
+
+    def get_inflight(self, dest_path):
+        """返回正在进行的下载的Future，没有时返回None"""
+        with self._lock:
+            return self._inflight.get(dest_path)
+
+    def progress(self, dest_path):
+        with self._lock:
+            progress = self._progress.get(dest_path)
+            return dict(progress) if progress else None
+
+    def _run(self, url, dest_path):
+        start = time.perf_counter()
+        try:
+            result = self._download(url, dest_path)
+        except Exception:
+            with self._lock:
+                self.failed += 1
+            raise
+        else:
+            elapsed = time.perf_counter() - start
+            result['elapsed'] = elapsed
+            result['throughput'] = result['downloaded'] / elapsed if elapsed > 0 else 0.0
+            with self._lock:
+                self.completed += 1
+                self.total_bytes += result['downloaded']
+                self.total_time += elapsed
+                self._recent.append(dict(result, path=dest_path))
+            return result
+        finally:
+            with self._lock:
+                self._inflight.pop(dest_path, None)
+                self._progress.pop(dest_path, None)
+
+    def _add_progress(self, dest_path, nbytes, total=None):
+        with self._lock:
+            progress = self._progress.get(dest_path)
+            if progress is not None:
+                progress['bytes'] += nbytes
+                if total is not None:
+                    progress['total'] = total
+
+    def _download(self, url, dest_path):
+        part_path = dest_path + '.part'
+        meta_path = part_path + '.json'
+
+        # 先请求第一个分段，同时探测服务器是否支持Range以及文件总大小
+        response = self.http_client.get(url, stream=True,
+                                         headers={'Range': f'bytes=0-{self.segment_size - 1}'})
+        try:
+            if response.status_code == 200:
+                return self._download_whole(response, dest_path, part_path, meta_path)
+            if response.status_code != 206:
+                raise DownloadError(f'视频下载失败，HTTP状态码: {response.status_code}')
+            total = self._parse_total(response.headers.get('Content-Range'))
+            if total is None:
+                raise DownloadError('无法解析Content-Range')
+
+            segments = [(start, min(start + self.segment_size, total) - 1)
+                        for start in range(0, total, self.segment_size)]
+            done = self._load_meta(meta_path, part_path, total)
+            resumed = sum(end - start + 1 for i, (start, end) in enumerate(segments) if i in done)
+            if resumed:
+                self._add_progress(dest_path, resumed)
+
+            fd = os.open(part_path, os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                os.ftruncate(fd, total)
+                meta_lock = threading.Lock()
+
+                def mark_done(index):
+                    # 分段的数据落盘后才记录为已完成，否则崩溃后恢复时会信任没有写入磁盘的分段
+                    os.fsync(fd)
+                    with meta_lock:
+                        done.add(index)
+                        self._save_meta(meta_path, total, done)
+
+                # 第一个分段直接使用探测请求的响应
+                downloaded = 0
+                if 0 not in done:
+                    downloaded += self._write_segment(response, fd, segments[0], dest_path, total)
+                    mark_done(0)
+                else:
+                    response.close()
+
+                futures = [
+                    self._segment_executor.submit(self._fetch_segment, url, fd, segments[i], dest_path, total)
+                    for i in range(1, len(segments)) if i not in done
+                ]
+                indexes = [i for i in range(1, len(segments)) if i not in done]
+                errors = []
+                for index, future in zip(indexes, futures):
+                    try:
+                        downloaded += future.result()
+                        mark_done(index)
+                    except Exception as e:
+                        errors.append(e)
+                if errors:
+                    raise DownloadError(f'分段下载失败: {errors[0]}')
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+
+            if os.path.getsize(part_path) != total:
+                raise DownloadError('下载的文件大小与服务器不一致')
+            os.replace(part_path, dest_path)
+            self._remove(meta_path)
+            return {'size': total, 'downloaded': downloaded, 'resumed': resumed, 'segments': len(segments)}
+        finally:
+            response.close()
+
+    def _download_whole(self, response, dest_path, part_path, meta_path):
+        """服务器不支持Range时顺序下载整个文件"""
+        expected = response.headers.get('Content-Length')
+        expected = int(expected) if expected and expected.isdigit() else None
+        self._add_progress(dest_path, 0, total=expected)
+        size = 0
+        with open(part_path, 'wb', buffering=self.chunk_size) as f:
+            for chunk in response.iter_content(chunk_size=self.chunk_size):
+                f.write(chunk)
+                size += len(chunk)
+                self._add_progress(dest_path, len(chunk))
+            f.flush()
+            os.fsync(f.fileno())
+        if expected is not None and size != expected:
+            raise DownloadError(f'下载的文件不完整: {size}/{expected} 字节')
+        os.replace(part_path, dest_path)
+        self._remove(meta_path)
+        return {'size': size, 'downloaded': size, 'resumed': 0, 'segments': 1}
+
+    def _fetch_segment(self, url, fd, segment, dest_path, total):
+        start, end = segment
+        response = self.http_client.get(url, stream=True, headers={'Range': f'bytes={start}-{end}'})
+        try:
+            if response.status_code != 206:
+                raise DownloadError(f'分段请求返回HTTP状态码: {response.status_code}')
+            return self._write_segment(response, fd, segment, dest_path, total)
+        finally:
+            response.close()
+
+    def _write_segment(self, response, fd, segment, dest_path, total):
+        start, end = segment
+        offset = start
+        for chunk in response.iter_content(chunk_size=self.chunk_size):
+            os.pwrite(fd, chunk, offset)
+            offset += len(chunk)
+            self._add_progress(dest_path, len(chunk), total=total)
+        if offset != end + 1:
+            raise DownloadError(f'分段 {start}-{end} 不完整，只收到 {offset - start} 字节')
+        return offset - start
+
+    @staticmethod
+    def _parse_total(content_range):
+        # 格式: bytes 0-1023/4096
+        if not content_range or '/' not in content_range:
+            return None
+        total = content_range.rsplit('/', 1)[1].strip()
+        return int(total) if total.isdigit() else None
+
+    def _load_meta(self, meta_path, part_path, total):
+        """读取已完成的分段，文件大小或分段大小变化时重新开始"""
+        try:
+            with open(meta_path, 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+            if (meta.get('total') == total and meta.get('segment_size') == self.segment_size
+                    and os.path.exists(part_path)):
+                return set(meta.get('done', []))
+        except (FileNotFoundError, ValueError):
+            pass
+        return set()
+
+    def _save_meta(self, meta_path, total, done):
+        tmp_path = meta_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'total': total, 'segment_size': self.segment_size, 'done': sorted(done)}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, meta_path)
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def stats(self):
+        """返回下载统计，包括进行中的下载进度和最近完成的下载吞吐量"""
+        with self._lock:
+            return {
+                'active': {path: dict(p) for path, p in self._progress.items()},
+                'completed': self.completed,
+                'failed': self.failed,
+                'total_bytes': self.total_bytes,
+                'avg_throughput': self.total_bytes / self.total_time if self.total_time else 0.0,
+                'recent': list(self._recent)[-10:],
+            }
@@ -0,0 +1,129 @@
+import time
+import threading
+from collections import defaultdict, deque
+from datetime import datetime
+
+
+def _parse_time(value):
+    try:
+        return datetime.fromisoformat(value).timestamp()
+    except (TypeError, ValueError):
+        return None
+
+
+def generation_started_at(task):
+    """任务开始在DashScope上生成的时间戳（排队过的任务以提交时间为准）"""
+    return _parse_time(task.get('submitted_at')) or _parse_time(task.get('created_at'))
+
+
+def _percentile(sorted_values, q):
+    return sorted_values[min(len(sorted_values) - 1, int(round(q * (len(sorted_values) - 1))))]
+
+
+class LatencyModel:
+    """根据已完成任务的生成耗时估计进行中任务的完成时间，并据此安排状态轮询
+
+    按 (模型, 分辨率) 保存最近的耗时样本（开始生成到DashScope返回成功），
+    样本不足时退回到同一模型所有分辨率的样本，仍不足时不做估计。
+    有估计值 (p50, p90) 时：
+    - 离预计完成还早时稀疏轮询，每次等待到密集区间开始前剩余时间的一半
+    - 在预计完成前后（p50减去p90与p50的差，到p90）密集轮询，间隔为两者之差的1/10，不小于最小间隔
+    - 超过p90后等待超出时间的一半，轮询间隔按约1.5倍增长，直到最大间隔
+    """
+
+    def __init__(self, history=200, min_samples=3, min_interval=2.0, max_interval=60.0):
+        self.history = history
+        self.min_samples = min_samples
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self._samples = defaultdict(lambda: deque(maxlen=self.history))  # 键 -> [(task_id, 秒)]
+        self._observed = set()  # 按 (模型, 分辨率) 保存的样本中的task_id，用于去重
+        self._estimates = {}  # 键 -> (p50, p90, 样本数)，样本变化时失效
+        self._lock = threading.Lock()
+
+    def observe(self, task):
+        """记录成功任务的生成耗时，同一任务只记录一次，返回是否记录"""
+        if task.get('status') != 'SUCCEEDED':
+            return False
+        start = generation_started_at(task)
+        end = _parse_time(task.get('completed_at'))
+        if start is None or end is None or end < start:
+            return False
+        keys = ((task.get('model'), task.get('resolution')), (task.get('model'), None))
+        with self._lock:
+            if task['id'] in self._observed:
+                return False
+            primary = self._samples[keys[0]]
+            if len(primary) == self.history:
+                self._observed.discard(primary[0][0])
+            self._observed.add(task['id'])
+            for key in keys:
+                self._samples[key].append((task['id'], end - start))
+                self._estimates.pop(key, None)
+        return True
+
+    def rebuild(self, task_list):
+        """根据任务记录重建样本，按完成时间顺序保留最近的样本"""
+        with self._lock:
+            self._samples.clear()
+            self._estimates.clear()
+            self._observed.clear()
+        for task in sorted(task_list, key=lambda t: t.get('completed_at') or ''):
+            self.observe(task)
+
+    def estimate(self, model, resolution):
+        """返回 (p50, p90, 样本数)，样本不足时返回None"""
+        with self._lock:
+            for key in ((model, resolution), (model, None)):
+                estimate = self._estimates.get(key)
+                if estimate:
+                    return estimate
+                samples = self._samples.get(key)
+                if samples and len(samples) >= self.min_samples:
+                    durations = sorted(duration for _, duration in samples)
+                    estimate = (_percentile(durations, 0.5), _percentile(durations, 0.9), len(durations))
+                    self._estimates[key] = estimate
+                    return estimate
+        return None
+
+    def next_delay(self, task, default, now=None):
+        """返回下一次查询任务状态前等待的秒数，没有估计值时返回default"""
+        estimate = self.estimate(task.get('model'), task.get('resolution'))
+        start = generation_started_at(task)
+        if estimate is None or start is None:
+            return default
+        p50, p90, _ = estimate
+        elapsed = (now or time.time()) - start
+        spread = max(p90 - p50, p50 * 0.1)
+        dense_start = p50 - spread
+        if elapsed < dense_start:
+            delay = (dense_start - elapsed) / 2
+        elif elapsed <= p90:
+            delay = spread / 10
+        else:
+            delay = (elapsed - p90) / 2
+        return min(self.max_interval, max(self.min_interval, delay))
+
+    def eta(self, task, now=None):
+        """估计任务剩余的生成时间，返回 {'eta_seconds', 'expected_at'}；无法估计或已超过p90时返回None"""
+        estimate = self.estimate(task.get('model'), task.get('resolution'))
+        start = generation_started_at(task)
+        if estimate is None or start is None:
+            return None
+        p50, p90, _ = estimate
+        now = now or time.time()
+        elapsed = now - start
+        if elapsed > p90:
+            return None
+        expected = start + (p50 if elapsed < p50 else p90)
+        return {
+            'eta_seconds': int(round(expected - now)),
+            'expected_at': datetime.fromtimestamp(expected).isoformat(timespec='seconds'),
+        }
+
+    def stats(self):
+        with self._lock:
+            return {
+                'keys': sum(1 for key in self._samples if key[1] is not None),
+                'samples': sum(len(samples) for key, samples in self._samples.items() if key[1] is not None),
+            }
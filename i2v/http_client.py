@@ -0,0 +1,196 @@
+import os
+import copy
+import json
+import uuid
+import time
+import base64
+import random
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+# 幂等请求遇到这些状态码时重试
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+IDEMPOTENT_METHODS = {'GET', 'HEAD', 'OPTIONS'}
+
+
+class HttpClientStats:
+    """HTTP客户端统计：区分建立连接(TCP+TLS握手)耗时和请求耗时"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+        self.retries = 0
+        self.connections = 0
+        self.connect_time = 0.0
+        self.request_time = 0.0
+
+    def record_connect(self, elapsed):
+        with self._lock:
+            self.connections += 1
+            self.connect_time += elapsed
+
+    def record_request(self, elapsed, error=False):
+        with self._lock:
+            self.requests += 1
+            self.request_time += elapsed
+            if error:
+                self.errors += 1
+
+    def record_retry(self):
+        with self._lock:
+            self.retries += 1
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'requests': self.requests,
+                'errors': self.errors,
+                'retries': self.retries,
+                'connections': self.connections,
+                'connect_time': self.connect_time,
+                'request_time': self.request_time,
+                'avg_connect_ms': self.connect_time / self.connections * 1000 if self.connections else 0.0,
+                'avg_request_ms': self.request_time / self.requests * 1000 if self.requests else 0.0,
+            }
+
+
+def _timed_connection_class(base, stats):
+    """创建在connect()时记录握手耗时的连接类"""
+
+    def connect(self):
+        start = time.perf_counter()
+        base.connect(self)
+        stats.record_connect(time.perf_counter() - start)
+
+    return type(f'Timed{base.__name__}', (base,), {'connect': connect})
+
+
+class PooledAdapter(HTTPAdapter):
+    """统计新建连接耗时的连接池适配器"""
+
+    def __init__(self, stats, **kwargs):
+        self.stats = stats
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        http_conn = _timed_connection_class(HTTPConnection, self.stats)
+        https_conn = _timed_connection_class(HTTPSConnection, self.stats)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': type('TimedHTTPConnectionPool', (HTTPConnectionPool,), {'ConnectionCls': http_conn}),
+            'https': type('TimedHTTPSConnectionPool', (HTTPSConnectionPool,), {'ConnectionCls': https_conn}),
+        }
+
+
+class HttpClient:
+    """共享的HTTP客户端
+
+    基于带连接池的requests.Session，复用keep-alive连接，避免每次请求都重新
+    进行TCP和TLS握手。所有请求都有连接和读取超时，幂等请求在网络错误或
+    可重试状态码时按带抖动的指数退避重试。
+    """
+
+    def __init__(self, pool_connections=4, pool_maxsize=20, connect_timeout=5.0,
+                 read_timeout=30.0, max_retries=3, backoff=0.5, max_backoff=10.0):
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.stats = HttpClientStats()
+
+        self.session = requests.Session()
+        adapter = PooledAdapter(self.stats, pool_connections=pool_connections,
+                                pool_maxsize=pool_maxsize, pool_block=False)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def request(self, method, url, retry=None, timeout=None, **kwargs):
+        """发送请求，retry为None时只对幂等方法重试"""
+        if retry is None:
+            retry = method.upper() in IDEMPOTENT_METHODS
+        if timeout is None:
+            timeout = (self.connect_timeout, self.read_timeout)
+        attempts = self.max_retries + 1 if retry else 1
+
+        for attempt in range(attempts):
+            last_attempt = attempt == attempts - 1
+            start = time.perf_counter()
+            try:
+                response = self.session.request(method, url, timeout=timeout, **kwargs)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+                self.stats.record_request(time.perf_counter() - start, error=True)
+                if last_attempt:
+                    raise
+            else:
+                self.stats.record_request(time.perf_counter() - start,
+                                          error=response.status_code >= 500)
+                if last_attempt or response.status_code not in RETRY_STATUS_CODES:
+                    return response
+                response.close()
+            self.stats.record_retry()
+            time.sleep(self._backoff_delay(attempt))
+
+    def _backoff_delay(self, attempt):
+        # 带完全抖动的指数退避
+        return random.uniform(0, min(self.max_backoff, self.backoff * (2 ** attempt)))
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+
+class Base64JsonBody:
+    """流式生成的JSON请求体，其中一个字段是文件内容的base64 data URL
+
+    按块读取文件并编码，不在内存中生成完整的base64字符串或JSON字符串。
+    请求体长度可以预先算出，因此requests会发送Content-Length而不是分块编码，
+    并且每次迭代都会重新读取文件，可以安全地重复发送。
+    如果提供了已编码的base64内容（例如来自缓存），则直接发送而不读取文件。
+    """
+
+    CHUNK_SIZE = 3 * 16 * 1024  # 3的倍数，保证分块编码结果可以直接拼接
+
+    def __init__(self, payload, field_path, mime_type, file_path=None, encoded=None):
+        """field_path为data URL字段在payload中的路径，例如 ('input', 'img_url')"""
+        # 用随机占位符生成JSON，再在占位符处切分出前后两段
+        placeholder = f'__base64_{uuid.uuid4().hex}__'
+        payload = copy.deepcopy(payload)
+        target = payload
+        for key in field_path[:-1]:
+            target = target[key]
+        target[field_path[-1]] = placeholder
+        text = json.dumps(payload, ensure_ascii=False)
+        prefix, suffix = text.split(json.dumps(placeholder), 1)
+        self.prefix = f'{prefix}"data:{mime_type};base64,'.encode('utf-8')
+        self.suffix = f'"{suffix}'.encode('utf-8')
+        self.file_path = file_path
+        self.encoded = encoded
+        if encoded is not None:
+            encoded_size = len(encoded)
+        else:
+            encoded_size = 4 * ((os.path.getsize(file_path) + 2) // 3)
+        self.length = len(self.prefix) + encoded_size + len(self.suffix)
+
+    def __len__(self):
+        return self.length
+
+    def __iter__(self):
+        yield self.prefix
+        if self.encoded is not None:
+            yield self.encoded
+            yield self.suffix
+            return
+        with open(self.file_path, 'rb') as f:
+            while True:
+                chunk = f.read(self.CHUNK_SIZE)
+                if not chunk:
+                    break
+                yield base64.b64encode(chunk)
+        yield self.suffix
@@ -0,0 +1,46 @@
+from flask.json.provider import DefaultJSONProvider
+
+# orjson是可选依赖，缺少时使用标准库json
+try:
+    import orjson
+    # 日期时间等非JSON类型交给Flask的default处理，与标准库json的输出保持一致
+    ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+except ImportError:
+    orjson = None
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """更快、更紧凑的JSON序列化
+
+    不排序键，中文直接输出为UTF-8而不是\\uXXXX转义；安装了orjson时用orjson序列化，
+    任务列表等大响应的序列化耗时只有标准库的几分之一。
+    orjson无法处理的数据（例如超过64位的整数）回退到标准库json。
+    """
+
+    sort_keys = False
+    ensure_ascii = False
+
+    def _orjson_dumps(self, obj):
+        if orjson is None:
+            return None
+        try:
+            return orjson.dumps(obj, default=self.default, option=ORJSON_OPTIONS)
+        except TypeError:
+            return None
+
+    def dumps(self, obj, **kwargs):
+        # 需要缩进等格式参数时使用标准库json
+        if not kwargs:
+            data = self._orjson_dumps(obj)
+            if data is not None:
+                return data.decode('utf-8')
+        return super().dumps(obj, **kwargs)
+
+    def response(self, *args, **kwargs):
+        if self.compact is False or (self.compact is None and self._app.debug):
+            return super().response(*args, **kwargs)
+        obj = self._prepare_response_obj(args, kwargs)
+        data = self._orjson_dumps(obj)
+        if data is None:
+            data = super().dumps(obj, separators=(',', ':')).encode('utf-8')
+        return self._app.response_class(data + b'\n', mimetype=self.mimetype)
@@ -0,0 +1,150 @@
+import sys
+import json
+import time
+import queue
+import random
+import atexit
+import logging
+import threading
+import contextvars
+from contextlib import contextmanager
+from logging.handlers import QueueHandler, QueueListener
+
+# 当前上下文的关联字段（request_id、task_id等），每个线程/请求独立
+_log_context = contextvars.ContextVar('log_context', default={})
+
+# LogRecord自带的属性，不作为额外字段输出
+_RECORD_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', None, None))) | {'message', 'asctime', 'sample'}
+
+
+@contextmanager
+def log_context(**fields):
+    """在代码块内为所有日志加上关联字段，例如 with log_context(task_id=task_id): ..."""
+    token = _log_context.set({**_log_context.get(), **fields})
+    try:
+        yield
+    finally:
+        _log_context.reset(token)
+
+
+def bind_log_context(**fields):
+    """为当前上下文加上关联字段，返回用于恢复的token（Flask请求钩子中使用）"""
+    return _log_context.set({**_log_context.get(), **fields})
+
+
+def reset_log_context(token):
+    _log_context.reset(token)
+
+
+class ContextFilter(logging.Filter):
+    """把当前上下文的关联字段复制到日志记录上（在调用线程中执行）"""
+
+    def filter(self, record):
+        for key, value in _log_context.get().items():
+            if not hasattr(record, key):
+                setattr(record, key, value)
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """对标记了 extra={'sample': True} 的高频日志按比例采样，其他日志不受影响"""
+
+    def __init__(self, rate):
+        super().__init__()
+        self.rate = rate
+        self.dropped = 0
+
+    def filter(self, record):
+        if getattr(record, 'sample', False) and random.random() >= self.rate:
+            self.dropped += 1
+            return False
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """每条日志输出为一行JSON，额外字段和关联字段作为顶层键"""
+
+    def format(self, record):
+        entry = {
+            'ts': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(record.created)) + f'.{int(record.msecs):03d}',
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRS and not key.startswith('_'):
+                entry[key] = value
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry['exc'] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class AsyncQueueHandler(QueueHandler):
+    """非阻塞的队列日志处理器
+
+    调用线程只负责合并消息参数并放入有界队列，格式化和写stdout都在后台线程中完成。
+    队列满时丢弃日志并计数，不阻塞业务线程。
+    """
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # 参数可能在之后被修改，这里先合并消息；异常堆栈保留给后台线程格式化
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+_queue_handler = None
+_sampling_filter = None
+_listener = None
+_setup_lock = threading.Lock()
+
+
+def setup_logging(level='INFO', fmt='json', sample_rate=0.1, queue_size=10000):
+    """配置根日志：后台线程输出到stdout，fmt为json或text
+
+    重复调用时不会重复添加处理器。
+    """
+    global _queue_handler, _sampling_filter, _listener
+    with _setup_lock:
+        root = logging.getLogger()
+        root.setLevel(level.upper() if isinstance(level, str) else level)
+        if _queue_handler is not None:
+            return
+
+        stream_handler = logging.StreamHandler(sys.stdout)
+        if fmt == 'text':
+            stream_handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(name)s: %(message)s'))
+        else:
+            stream_handler.setFormatter(JsonFormatter())
+
+        log_queue = queue.Queue(maxsize=queue_size)
+        _queue_handler = AsyncQueueHandler(log_queue)
+        _sampling_filter = SamplingFilter(sample_rate)
+        _queue_handler.addFilter(_sampling_filter)
+        _queue_handler.addFilter(ContextFilter())
+        root.addHandler(_queue_handler)
+
+        _listener = QueueListener(log_queue, stream_handler, respect_handler_level=True)
+        _listener.start()
+        atexit.register(_listener.stop)
+
+
+def log_stats():
+    """返回因队列满和采样而丢弃的日志数量"""
+    return {
+        'queue_size': _queue_handler.queue.qsize() if _queue_handler else 0,
+        'dropped': _queue_handler.dropped if _queue_handler else 0,
+        'sampled_out': _sampling_filter.dropped if _sampling_filter else 0,
+    }
@@ -0,0 +1,278 @@
+import math
+import time
+import threading
+
+# 默认的耗时分桶(秒)，覆盖从毫秒级的锁等待到分钟级的视频生成
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0, 1800.0)
+
+
+def _escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape_label(value)}"' for name, value in pairs) + '}'
+
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer() and abs(value) < 1e15:
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    """带标签的指标，每组标签值对应一个子指标
+
+    子指标按线程分片记录：每个线程只修改自己的分片，记录时不需要加锁，
+    只有首次创建子指标或分片时才加锁，导出时再把所有分片相加。
+    """
+
+    type_name = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._lock = threading.Lock()
+
+    def labels(self, *values):
+        key = tuple(str(v) for v in values)
+        child = self._children.get(key)
+        if child is None:
+            if len(key) != len(self.labelnames):
+                raise ValueError(f'指标 {self.name} 需要标签 {self.labelnames}')
+            with self._lock:
+                child = self._children.setdefault(key, self._new_child())
+        return child
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def collect(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.type_name}']
+        for key, child in list(self._children.items()):
+            lines.extend(child.samples(self.name, self.labelnames, key))
+        return lines
+
+
+class _Shards:
+    """按线程分片的计数数组
+
+    已退出的线程的分片合并到基础计数中后丢弃：每个请求一个线程的服务器或线程池替换线程时，
+    分片数量只与存活的线程数有关，不会无限增长。
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self._local = threading.local()
+        self._shards = []  # [(线程, 分片)]
+        self._base = [0] * size  # 已退出的线程的计数
+        self._prune_at = 64  # 分片数达到该值时在注册新分片时合并已退出的线程
+        self._lock = threading.Lock()
+
+    def local(self):
+        shard = getattr(self._local, 'shard', None)
+        if shard is None:
+            shard = self._local.shard = [0] * self.size
+            with self._lock:
+                self._shards.append((threading.current_thread(), shard))
+                if len(self._shards) >= self._prune_at:
+                    self._fold_dead_locked()
+                    self._prune_at = max(64, 2 * len(self._shards))
+        return shard
+
+    def _fold_dead_locked(self):
+        # 线程退出后不会再写入它的分片，可以安全地合并
+        alive = []
+        for thread, shard in self._shards:
+            if thread.is_alive():
+                alive.append((thread, shard))
+            else:
+                for i, value in enumerate(shard):
+                    self._base[i] += value
+        self._shards = alive
+
+    def total(self):
+        with self._lock:
+            self._fold_dead_locked()
+            totals = list(self._base)
+            shards = [shard for _, shard in self._shards]
+        for shard in shards:
+            for i, value in enumerate(shard):
+                totals[i] += value
+        return totals
+
+
+class _CounterChild:
+    def __init__(self):
+        self._shards = _Shards(1)
+
+    def inc(self, amount=1):
+        self._shards.local()[0] += amount
+
+    def value(self):
+        return self._shards.total()[0]
+
+    def samples(self, name, labelnames, key):
+        return [f'{name}{_format_labels(labelnames, key)} {_format_value(self.value())}']
+
+
+class _HistogramChild:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        # 每个分片: [各分桶计数..., 总数, 总和]
+        self._shards = _Shards(len(buckets) + 2)
+
+    def observe(self, value):
+        shard = self._shards.local()
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                shard[i] += 1
+                break
+        shard[-2] += 1
+        shard[-1] += value
+
+    def time(self):
+        return _Timer(self.observe)
+
+    def samples(self, name, labelnames, key):
+        totals = self._shards.total()
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets, totals):
+            cumulative += count
+            lines.append(f'{name}_bucket{_format_labels(labelnames, key, ("le", _format_value(float(bound))))} {cumulative}')
+        lines.append(f'{name}_bucket{_format_labels(labelnames, key, ("le", "+Inf"))} {totals[-2]}')
+        lines.append(f'{name}_count{_format_labels(labelnames, key)} {totals[-2]}')
+        lines.append(f'{name}_sum{_format_labels(labelnames, key)} {_format_value(float(totals[-1]))}')
+        return lines
+
+
+class _Timer:
+    def __init__(self, observe):
+        self._observe = observe
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self._observe(time.perf_counter() - self._start)
+
+
+class Counter(_Metric):
+    type_name = 'counter'
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+
+class Histogram(_Metric):
+    type_name = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value):
+        self.labels().observe(value)
+
+    def time(self):
+        return self.labels().time()
+
+
+class MetricsRegistry:
+    """指标注册表，输出Prometheus文本格式
+
+    除了Counter和Histogram，还可以注册在导出时调用的收集函数，
+    用于导出各组件stats()中的数量类指标，这些指标平时不需要额外记录。
+    """
+
+    def __init__(self, prefix=''):
+        self.prefix = prefix
+        self._metrics = []
+        self._collectors = []
+
+    def counter(self, name, documentation, labelnames=()):
+        metric = Counter(self.prefix + name, documentation, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        metric = Histogram(self.prefix + name, documentation, labelnames, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def register_collector(self, func):
+        """func返回 [(名称, 类型, 说明, [(标签dict, 数值), ...]), ...]"""
+        self._collectors.append(func)
+        return func
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.collect())
+        for func in self._collectors:
+            try:
+                families = func()
+            except Exception as e:
+                lines.append(f'# 收集函数 {getattr(func, "__name__", func)} 出错: {e}')
+                continue
+            for name, type_name, documentation, samples in families:
+                name = self.prefix + name
+                lines.append(f'# HELP {name} {documentation}')
+                lines.append(f'# TYPE {name} {type_name}')
+                for labels, value in samples:
+                    label_text = _format_labels(tuple(labels), tuple(labels.values()))
+                    lines.append(f'{name}{label_text} {_format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+class TimedLock:
+    """记录等待时间的锁包装
+
+    无竞争时直接获得锁，只记录一次零等待；发生竞争时才计时，
+    因此对未竞争的加锁几乎没有额外开销。
+    """
+
+    def __init__(self, lock, histogram):
+        self._lock = lock
+        self._wait = histogram.labels()
+
+    def acquire(self, blocking=True, timeout=-1):
+        if self._lock.acquire(False):
+            self._wait.observe(0.0)
+            return True
+        if not blocking:
+            return False
+        start = time.perf_counter()
+        acquired = self._lock.acquire(True, timeout)
+        self._wait.observe(time.perf_counter() - start)
+        return acquired
+
+    def release(self):
+        self._lock.release()
+
+    def locked(self):
+        return self._lock.locked()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
@@ -0,0 +1,22 @@
+class TaskRecord(dict):
+    """不可变的任务记录
+
+    继承dict，可以像以前一样按键读取，并直接序列化为JSON；所有修改方法都会抛出TypeError。
+    更新任务时用 record.replace(字段=新值) 生成新记录，再在tasks_lock内替换整条记录，
+    因此读取方拿到的记录就是一致的快照，不需要持锁读取或复制。
+    """
+
+    __slots__ = ()
+
+    def _readonly(self, *args, **kwargs):
+        raise TypeError('任务记录不可修改，请使用update_task()生成新记录')
+
+    __setitem__ = __delitem__ = __ior__ = _readonly
+    clear = pop = popitem = setdefault = update = _readonly
+
+    def replace(self, **changes):
+        """返回应用了changes的新记录，值为None的字段保留为None"""
+        return TaskRecord(self, **changes)
+
+    def __reduce__(self):
+        return (TaskRecord, (dict(self),))
@@ -0,0 +1,176 @@
+import os
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+
+# 仍在生成中的任务状态，相同请求可以直接复用
+IN_FLIGHT_STATUSES = ('QUEUED', 'PENDING', 'RUNNING')
+
+
+def generation_cache_key(image_sha256, prompt, negative_prompt, model, resolution, prompt_extend):
+    """根据图片哈希和生成参数计算缓存键"""
+    params = [image_sha256, prompt, negative_prompt or '', model, resolution, bool(prompt_extend)]
+    return hashlib.sha256(json.dumps(params, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+
+class ResultCache:
+    """视频生成结果缓存
+
+    记录每个缓存键对应的已成功或仍在生成中的任务，相同的请求直接返回该任务。
+    并发的相同请求只有第一个会真正提交，其余请求等待它完成后复用同一个任务。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._index = {}  # 缓存键 -> task_id
+        self._inflight = {}  # 缓存键 -> threading.Event，正在提交中的请求
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def is_reusable(task):
+        """任务结果是否可以被相同请求复用"""
+        status = task.get('status')
+        if status in IN_FLIGHT_STATUSES:
+            return True
+        return status == 'SUCCEEDED' and not task.get('output_evicted')
+
+    def observe(self, task):
+        """任务变化时更新索引"""
+        key = task.get('cache_key')
+        if not key:
+            return
+        with self._lock:
+            if self.is_reusable(task):
+                self._index[key] = task['id']
+            elif self._index.get(key) == task['id']:
+                del self._index[key]
+
+    def rebuild(self, task_list):
+        index = {}
+        for task in task_list:
+            if task.get('cache_key') and self.is_reusable(task):
+                index[task['cache_key']] = task['id']
+        with self._lock:
+            self._index = index
+
+    def acquire(self, key, timeout):
+        """查找缓存，返回 (task_id, 是否为提交者)
+
+        命中时返回已有的task_id；未命中且没有相同请求在提交时，调用方成为提交者，
+        提交结束后必须调用release()；否则等待正在进行的提交完成后再查找一次。
+        """
+        with self._lock:
+            task_id = self._index.get(key)
+            if task_id:
+                self.hits += 1
+                return task_id, False
+            event = self._inflight.get(key)
+            if event is None:
+                self._inflight[key] = threading.Event()
+                self.misses += 1
+                return None, True
+        event.wait(timeout)
+        with self._lock:
+            task_id = self._index.get(key)
+            if task_id:
+                self.hits += 1
+            else:
+                self.misses += 1
+            return task_id, False
+
+    def release(self, key, task_id=None):
+        """提交者完成提交，唤醒等待相同结果的请求"""
+        with self._lock:
+            if task_id:
+                self._index[key] = task_id
+            event = self._inflight.pop(key, None)
+        if event:
+            event.set()
+
+    def invalidate(self, key, task_id):
+        """缓存的任务不可用时移除索引"""
+        with self._lock:
+            if self._index.get(key) == task_id:
+                del self._index[key]
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._index),
+                'inflight': len(self._inflight),
+                'hits': self.hits,
+                'misses': self.misses,
+            }
+
+
+class DiskLRU:
+    """按磁盘占用限制文件总大小的LRU
+
+    max_bytes为0表示不限制。add()和touch()更新访问顺序，超出上限时返回需要
+    删除的最久未访问的文件路径，由调用方删除文件并更新任务记录。
+    """
+
+    def __init__(self, max_bytes=0):
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # 路径 -> 文件大小
+        self._total = 0
+
+    def scan(self, folder, suffix):
+        """按最后访问时间加载目录中已有的文件"""
+        files = []
+        for name in os.listdir(folder):
+            if not name.endswith(suffix):
+                continue
+            path = os.path.join(folder, name)
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                continue
+            files.append((max(st.st_atime, st.st_mtime), path, st.st_size))
+        files.sort()
+        with self._lock:
+            self._entries.clear()
+            self._total = 0
+            for _, path, size in files:
+                self._entries[path] = size
+                self._total += size
+            return self._collect_evictions_locked(keep=None)
+
+    def add(self, path):
+        try:
+            size = os.path.getsize(path)
+        except FileNotFoundError:
+            return []
+        with self._lock:
+            self._total -= self._entries.pop(path, 0)
+            self._entries[path] = size
+            self._total += size
+            return self._collect_evictions_locked(keep=path)
+
+    def touch(self, path):
+        with self._lock:
+            if path in self._entries:
+                self._entries.move_to_end(path)
+
+    def remove(self, path):
+        with self._lock:
+            self._total -= self._entries.pop(path, 0)
+
+    def _collect_evictions_locked(self, keep):
+        evicted = []
+        if not self.max_bytes:
+            return evicted
+        while self._total > self.max_bytes and self._entries:
+            path = next(iter(self._entries))
+            if path == keep:
+                break
+            self._total -= self._entries.pop(path)
+            evicted.append(path)
+        return evicted
+
+    def stats(self):
+        with self._lock:
+            return {'files': len(self._entries), 'bytes': self._total, 'max_bytes': self.max_bytes}
@@ -0,0 +1,92 @@
+import os
+import time
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+def list_files(folder, suffix=None, skip_hidden=True):
+    """递归列出目录中的文件，返回按修改时间升序的 [(修改时间, 路径, 大小)]"""
+    files = []
+    for dirpath, dirnames, filenames in os.walk(folder):
+        if skip_hidden:
+            dirnames[:] = [name for name in dirnames if not name.startswith('.')]
+        for name in filenames:
+            if (suffix and not name.endswith(suffix)) or (skip_hidden and name.startswith('.')):
+                continue
+            path = os.path.join(dirpath, name)
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                continue
+            files.append((st.st_mtime, path, st.st_size))
+    files.sort()
+    return files
+
+
+def select_evictions(files, max_age=0, max_bytes=0, protected=(), now=None):
+    """选出需要淘汰的文件路径
+
+    files为按修改时间升序的 [(修改时间, 路径, 大小)]。先淘汰超过max_age秒的文件，
+    总大小仍超过max_bytes时继续从最旧的文件开始淘汰；protected中的文件不淘汰。
+    max_age和max_bytes为0表示不按该条件淘汰。
+    """
+    now = now or time.time()
+    total = sum(size for _, _, size in files)
+    evicted = []
+    for mtime, path, size in files:
+        if path in protected:
+            continue
+        expired = max_age and now - mtime > max_age
+        over_quota = max_bytes and total > max_bytes
+        if not expired and not over_quota:
+            break  # 之后的文件更新，总大小也不会再超出上限
+        evicted.append(path)
+        total -= size
+    return evicted
+
+
+class CompactionService:
+    """定期执行归档和磁盘清理的后台线程
+
+    compact_func()执行一轮清理并返回统计信息字典，统计信息写入日志，
+    最近一轮的结果通过stats()导出到指标。
+    """
+
+    def __init__(self, compact_func, interval=600.0):
+        self.compact_func = compact_func
+        self.interval = interval
+        self.runs = 0
+        self.errors = 0
+        self.last_stats = {}
+        self._thread = None
+
+    def start(self):
+        if self.interval > 0 and self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='compaction', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            self.run_once()
+            time.sleep(self.interval)
+
+    def run_once(self):
+        start = time.perf_counter()
+        try:
+            stats = self.compact_func()
+        except Exception:
+            self.errors += 1
+            logger.exception("归档和磁盘清理失败")
+            return None
+        if stats is None:
+            return None  # 本轮由其他进程执行
+        stats['elapsed'] = round(time.perf_counter() - start, 3)
+        self.runs += 1
+        self.last_stats = stats
+        logger.info("归档和磁盘清理完成: %s", stats)
+        return stats
+
+    def stats(self):
+        return {'runs': self.runs, 'errors': self.errors, **self.last_stats}
@@ -0,0 +1,117 @@
+import heapq
+import queue
+import random
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class PollScheduler:
+    """集中式任务状态轮询调度器
+
+    所有待检查的任务按下一次检查时间放入最小堆，由一个调度线程在到期时
+    交给固定数量的工作线程执行。这样上万个进行中的任务也只占用少量线程，
+    并且每个任务的检查时间带有随机抖动，避免同一时刻集中请求API。
+    """
+
+    def __init__(self, check_func, workers=4, interval=5.0, jitter=1.0):
+        # check_func(task_id) 返回下一次检查的延迟秒数，返回None表示停止检查
+        self.check_func = check_func
+        self.workers = workers
+        self.interval = interval
+        self.jitter = jitter
+
+        self._heap = []  # (到期时间, 序号, task_id)
+        self._scheduled = set()  # 已在堆中或正在执行的任务ID，避免重复调度
+        self._counter = 0
+        self._cond = threading.Condition()
+        self._work_queue = queue.Queue()
+        self._active = 0
+        self._threads = []
+        self._started = False
+
+    def start(self):
+        """启动调度线程和工作线程"""
+        with self._cond:
+            if self._started:
+                return
+            self._started = True
+
+        dispatcher = threading.Thread(target=self._dispatch_loop, name='poll-dispatcher')
+        dispatcher.daemon = True
+        dispatcher.start()
+        self._threads.append(dispatcher)
+
+        for i in range(self.workers):
+            worker = threading.Thread(target=self._worker_loop, name=f'poll-worker-{i}')
+            worker.daemon = True
+            worker.start()
+            self._threads.append(worker)
+
+    def schedule(self, task_id, delay=None):
+        """将任务加入调度，delay为空时使用默认间隔加抖动"""
+        with self._cond:
+            if task_id in self._scheduled:
+                return False
+            self._push(task_id, delay)
+            self._cond.notify()
+        return True
+
+    def _push(self, task_id, delay):
+        if delay is None:
+            delay = self.interval
+        delay += random.uniform(0, self.jitter)
+        self._counter += 1
+        heapq.heappush(self._heap, (time.monotonic() + delay, self._counter, task_id))
+        self._scheduled.add(task_id)
+
+    def _dispatch_loop(self):
+        """等待堆顶任务到期后交给工作线程"""
+        while True:
+            with self._cond:
+                while not self._heap:
+                    self._cond.wait()
+                due_at, _, task_id = self._heap[0]
+                wait_time = due_at - time.monotonic()
+                if wait_time > 0:
+                    self._cond.wait(wait_time)
+                    continue
+                heapq.heappop(self._heap)
+            self._work_queue.put(task_id)
+
+    def _worker_loop(self):
+        while True:
+            task_id = self._work_queue.get()
+            with self._cond:
+                self._active += 1
+            next_delay = None
+            try:
+                next_delay = self.check_func(task_id)
+            except Exception as e:
+                logger.exception("轮询任务 %s 时出错: %s", task_id, e, extra={'task_id': task_id})
+            finally:
+                with self._cond:
+                    self._active -= 1
+                    if next_delay is None:
+                        self._scheduled.discard(task_id)
+                    else:
+                        self._push(task_id, next_delay)
+                        self._cond.notify()
+
+    def queue_depth(self):
+        """等待检查的任务数量（包括已到期但尚未被工作线程取走的任务）"""
+        with self._cond:
+            return len(self._heap) + self._work_queue.qsize()
+
+    def stats(self):
+        """返回调度器运行状态"""
+        with self._cond:
+            return {
+                'scheduled': len(self._scheduled),
+                'waiting': len(self._heap),
+                'ready': self._work_queue.qsize(),
+                'active': self._active,
+                'workers': self.workers,
+            }
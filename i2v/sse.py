@@ -0,0 +1,126 @@
+import json
+import threading
+from collections import deque
+
+
+class SSESubscriber:
+    """单个SSE客户端的有界消息缓冲区
+
+    客户端消费过慢导致缓冲区写满时，丢弃缓冲的消息并标记为溢出，
+    下次读取时只返回一条resync事件，由客户端通过增量接口重新同步。
+    """
+
+    def __init__(self, max_buffer):
+        self.max_buffer = max_buffer
+        self.dropped = 0
+        self._buffer = deque()
+        self._overflowed = False
+        self._cond = threading.Condition(threading.Lock())
+
+    def push(self, message):
+        with self._cond:
+            if self._overflowed:
+                self.dropped += 1
+                return
+            if len(self._buffer) >= self.max_buffer:
+                self.dropped += len(self._buffer) + 1
+                self._buffer.clear()
+                self._overflowed = True
+            else:
+                self._buffer.append(message)
+            self._cond.notify()
+
+    def drain(self, timeout):
+        """阻塞等待消息，返回缓冲区中的全部消息
+
+        超时返回空列表；发生过溢出时返回None。
+        """
+        with self._cond:
+            if not self._buffer and not self._overflowed:
+                self._cond.wait(timeout)
+            if self._overflowed:
+                self._overflowed = False
+                return None
+            messages = list(self._buffer)
+            self._buffer.clear()
+            return messages
+
+    def pending(self):
+        with self._cond:
+            return len(self._buffer)
+
+
+class SSEHub:
+    """SSE事件广播中心
+
+    维护线程安全的订阅者集合和最近事件的重放缓冲区。每个订阅者使用
+    条件变量等待消息，空闲连接在心跳间隔内不会被唤醒。
+    """
+
+    def __init__(self, replay_size=1000, client_buffer=256):
+        self.client_buffer = client_buffer
+        self.last_seq = 0
+        self._lock = threading.Lock()
+        self._subscribers = set()
+        self._replay = deque(maxlen=replay_size)
+
+    def reset(self, seq):
+        """重新加载任务后设置当前序号，并清空无法再对应的重放缓冲区"""
+        with self._lock:
+            self._replay.clear()
+            self.last_seq = seq
+
+    def publish(self, seq, message):
+        """发布一条带序号的事件到所有订阅者"""
+        with self._lock:
+            self._replay.append((seq, message))
+            self.last_seq = seq
+            for subscriber in self._subscribers:
+                subscriber.push(message)
+
+    def subscribe(self, last_event_id=None):
+        """注册订阅者，返回 (订阅者, 需要补发的消息列表, 当前序号)
+
+        last_event_id之后的事件已不在重放缓冲区中时，补发列表为None。
+        """
+        subscriber = SSESubscriber(self.client_buffer)
+        with self._lock:
+            self._subscribers.add(subscriber)
+            replay = [] if last_event_id is None else self._replay_since(last_event_id)
+            return subscriber, replay, self.last_seq
+
+    def _replay_since(self, last_event_id):
+        if last_event_id >= self.last_seq:
+            return []
+        if not self._replay or self._replay[0][0] > last_event_id + 1:
+            return None
+        return [message for seq, message in self._replay if seq > last_event_id]
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            self._subscribers.discard(subscriber)
+
+    def client_count(self):
+        with self._lock:
+            return len(self._subscribers)
+
+    def stats(self):
+        """返回订阅者数量、缓冲区积压和丢弃的消息数"""
+        with self._lock:
+            subscribers = list(self._subscribers)
+            replay_size = len(self._replay)
+        return {
+            'clients': len(subscribers),
+            'pending': sum(s.pending() for s in subscribers),
+            'dropped': sum(s.dropped for s in subscribers),
+            'replay_size': replay_size,
+            'last_seq': self.last_seq,
+        }
+
+
+def format_sse(data, event_id=None):
+    """将数据格式化为SSE消息"""
+    message = f"data: {json.dumps(data, ensure_ascii=False)}\n\n"
+    if event_id is not None:
+        message = f"id: {event_id}\n" + message
+    return message
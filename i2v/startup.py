@@ -0,0 +1,70 @@
+import time
+import threading
+from contextlib import contextmanager
+
+
+class StartupProgress:
+    """启动预热进度
+
+    应用导入后立即可以处理HTTP请求，任务加载和恢复等预热步骤在后台线程中按阶段执行。
+    /healthz 和 /readyz 通过snapshot()报告当前阶段、各阶段耗时以及是否已就绪。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._started = time.monotonic()
+        self.phase = 'starting'
+        self.phases = {}  # 阶段名 -> 耗时(秒)，按完成顺序
+        self.detail = {}  # 当前阶段的进度信息
+        self.ready = False
+        self.ready_after = None  # 从应用启动到就绪的秒数
+        self.error = None
+
+    @contextmanager
+    def step(self, name):
+        """执行一个预热阶段并记录耗时"""
+        start = time.monotonic()
+        with self._lock:
+            self.phase = name
+            self.detail = {}
+        try:
+            yield self
+        finally:
+            with self._lock:
+                self.phases[name] = round(time.monotonic() - start, 3)
+
+    def update(self, **detail):
+        """更新当前阶段的进度信息，例如已加载的任务数"""
+        with self._lock:
+            self.detail.update(detail)
+
+    def finish(self):
+        with self._lock:
+            self.phase = 'ready'
+            self.detail = {}
+            self.ready = True
+            self.ready_after = round(time.monotonic() - self._started, 3)
+
+    def fail(self, error):
+        with self._lock:
+            self.phase = 'failed'
+            self.error = str(error)
+
+    def uptime(self):
+        return time.monotonic() - self._started
+
+    def snapshot(self):
+        with self._lock:
+            result = {
+                'ready': self.ready,
+                'phase': self.phase,
+                'phases': dict(self.phases),
+                'uptime': round(time.monotonic() - self._started, 3),
+            }
+            if self.detail:
+                result['progress'] = dict(self.detail)
+            if self.ready_after is not None:
+                result['ready_after'] = self.ready_after
+            if self.error:
+                result['error'] = self.error
+            return result
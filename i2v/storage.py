@@ -0,0 +1,397 @@
+import os
+import json
+import time
+import sqlite3
+import logging
+import tempfile
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class TaskStore:
+    """任务存储后端接口
+
+    每次任务状态变化只写入对应的那一条记录，而不是整体重写所有任务。
+    """
+
+    def load_all(self):
+        """加载所有任务，返回 {task_id: task} 字典"""
+        raise NotImplementedError
+
+    def get(self, task_id):
+        """按ID读取单个任务，不存在时返回None"""
+        raise NotImplementedError
+
+    def put(self, task):
+        """写入（新增或更新）单个任务
+
+        存储中已有版本号更高的记录时不覆盖：任务在锁外写入存储，
+        同一任务的两次并发更新可能以相反的顺序到达。
+        已删除（归档）的任务不再写入：删除之前开始的更新可能在删除之后才到达。
+        """
+        raise NotImplementedError
+
+    def delete(self, task_id):
+        """删除单个任务，之后对该任务的写入被忽略"""
+        raise NotImplementedError
+
+    def delete_many(self, task_ids):
+        """批量删除任务（归档时使用），之后对这些任务的写入被忽略"""
+        for task_id in task_ids:
+            self.delete(task_id)
+
+    def close(self):
+        pass
+
+
+class SqliteTaskStore(TaskStore):
+    """基于SQLite（WAL模式）的任务存储
+
+    每个任务一行，写入在事务中完成，进程崩溃不会损坏已提交的数据。
+    首次加载时如果数据库为空，会自动导入旧的 tasks.json（在load_all()中进行，不拖慢应用导入）。
+    """
+
+    def __init__(self, db_path, legacy_json=None):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS tasks ('
+            ' id TEXT PRIMARY KEY,'
+            ' created_at TEXT,'
+            ' status TEXT,'
+            ' data TEXT NOT NULL)'
+        )
+        self._conn.execute('CREATE INDEX IF NOT EXISTS idx_tasks_created_at ON tasks(created_at)')
+        # 已删除（归档）的任务ID，删除前开始的更新在删除后到达时不会重新写入任务
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS removed_tasks ('
+            ' id TEXT PRIMARY KEY,'
+            ' removed REAL NOT NULL)'
+        )
+        # 多进程模式下使用：任务变化事件日志（序号即全局任务版本号）和租约
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS task_events ('
+            ' seq INTEGER PRIMARY KEY AUTOINCREMENT,'
+            ' task_id TEXT NOT NULL,'
+            ' origin TEXT,'
+            ' created REAL NOT NULL)'
+        )
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS leases ('
+            ' name TEXT PRIMARY KEY,'
+            ' owner TEXT NOT NULL,'
+            ' expires REAL NOT NULL)'
+        )
+        # 多进程模式下的提交准入：已占用并发名额的任务（owner为占用名额的进程）和共享令牌桶
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS submit_slots ('
+            ' task_id TEXT PRIMARY KEY,'
+            ' model TEXT NOT NULL,'
+            ' created REAL NOT NULL,'
+            ' owner TEXT)'
+        )
+        columns = {row[1] for row in self._conn.execute('PRAGMA table_info(submit_slots)')}
+        if 'owner' not in columns:
+            self._conn.execute('ALTER TABLE submit_slots ADD COLUMN owner TEXT')
+        self._conn.execute('CREATE INDEX IF NOT EXISTS idx_submit_slots_model ON submit_slots(model)')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS submit_bucket ('
+            ' name TEXT PRIMARY KEY,'
+            ' tokens REAL NOT NULL,'
+            ' updated REAL NOT NULL)'
+        )
+        self._legacy_json = legacy_json
+
+    def _import_legacy_json(self, path):
+        """数据库为空时从旧的JSON文件导入任务"""
+        with self._lock:
+            count = self._conn.execute('SELECT COUNT(*) FROM tasks').fetchone()[0]
+        if count or not os.path.exists(path):
+            return
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                legacy_tasks = json.load(f)
+        except Exception as e:
+            logger.warning("读取旧任务文件失败: %s", e)
+            return
+        if not legacy_tasks:
+            return
+        logger.info("从 %s 导入 %d 个任务到 %s", path, len(legacy_tasks), self.db_path)
+        self.put_many(legacy_tasks.values())
+
+    @staticmethod
+    def _row(task):
+        return (
+            task['id'],
+            task.get('created_at'),
+            task.get('status'),
+            json.dumps(task, ensure_ascii=False, separators=(',', ':')),
+        )
+
+    def load_all(self):
+        if self._legacy_json:
+            legacy_json, self._legacy_json = self._legacy_json, None
+            self._import_legacy_json(legacy_json)
+        with self._lock:
+            rows = self._conn.execute('SELECT id, data FROM tasks').fetchall()
+        return {task_id: json.loads(data) for task_id, data in rows}
+
+    def get(self, task_id):
+        with self._lock:
+            row = self._conn.execute('SELECT data FROM tasks WHERE id = ?', (task_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def put(self, task):
+        row = self._row(task)
+        with self._lock:
+            self._conn.execute(
+                'INSERT INTO tasks (id, created_at, status, data) SELECT ?, ?, ?, ?'
+                ' WHERE NOT EXISTS (SELECT 1 FROM removed_tasks WHERE id = ?)'
+                ' ON CONFLICT(id) DO UPDATE SET'
+                ' created_at = excluded.created_at, status = excluded.status, data = excluded.data'
+                " WHERE COALESCE(json_extract(excluded.data, '$.version'), 0)"
+                " >= COALESCE(json_extract(tasks.data, '$.version'), 0)", row + (task['id'],)
+            )
+
+    def put_many(self, task_list):
+        """在一个事务中批量写入多个任务"""
+        rows = [self._row(task) for task in task_list]
+        with self._lock:
+            self._conn.execute('BEGIN')
+            try:
+                self._conn.executemany(
+                    'INSERT OR REPLACE INTO tasks (id, created_at, status, data) VALUES (?, ?, ?, ?)', rows
+                )
+                self._conn.execute('COMMIT')
+            except Exception:
+                self._conn.execute('ROLLBACK')
+                raise
+
+    def delete(self, task_id):
+        self.delete_many([task_id])
+
+    def delete_many(self, task_ids):
+        """在一个事务中批量删除多个任务，并记录删除标记"""
+        now = time.time()
+        with self._lock:
+            self._conn.execute('BEGIN')
+            try:
+                self._delete_locked(self._conn, task_ids, now)
+                self._conn.execute('COMMIT')
+            except Exception:
+                self._conn.execute('ROLLBACK')
+                raise
+
+    @staticmethod
+    def _delete_locked(conn, task_ids, now):
+        conn.executemany('INSERT OR REPLACE INTO removed_tasks (id, removed) VALUES (?, ?)',
+                         [(task_id, now) for task_id in task_ids])
+        conn.executemany('DELETE FROM tasks WHERE id = ?', [(task_id,) for task_id in task_ids])
+
+    def _write_transaction(self, func):
+        """在BEGIN IMMEDIATE事务中执行func(conn)，多个进程的写入按顺序进行"""
+        with self._lock:
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                result = func(self._conn)
+                self._conn.execute('COMMIT')
+                return result
+            except Exception:
+                self._conn.execute('ROLLBACK')
+                raise
+
+    def put_versioned(self, task, origin):
+        """写入任务并追加一条变化事件，返回事件序号（同时写入任务的version字段）
+
+        事件序号在所有进程间全局递增，作为任务版本号和SSE事件ID。
+        任务已被删除（归档）时不写入，返回None。
+        """
+        def write(conn):
+            if conn.execute('SELECT 1 FROM removed_tasks WHERE id = ?', (task['id'],)).fetchone():
+                return None
+            cursor = conn.execute('INSERT INTO task_events (task_id, origin, created) VALUES (?, ?, ?)',
+                                  (task['id'], origin, time.time()))
+            seq = cursor.lastrowid
+            conn.execute('INSERT OR REPLACE INTO tasks (id, created_at, status, data) VALUES (?, ?, ?, ?)',
+                         self._row(dict(task, version=seq)))
+            return seq
+        return self._write_transaction(write)
+
+    def delete_many_versioned(self, task_ids, origin):
+        """在一个事务中删除多个任务，每个任务追加一条变化事件"""
+        def write(conn):
+            now = time.time()
+            conn.executemany('INSERT INTO task_events (task_id, origin, created) VALUES (?, ?, ?)',
+                             [(task_id, origin, now) for task_id in task_ids])
+            self._delete_locked(conn, task_ids, now)
+        return self._write_transaction(write)
+
+    def events_since(self, seq, limit=1000):
+        """返回序号大于seq的事件 [(序号, task_id, 来源, 任务当前数据或None)]
+
+        同一任务在这批事件中出现多次时，都返回任务的最新数据。
+        """
+        with self._lock:
+            return self._conn.execute(
+                'SELECT e.seq, e.task_id, e.origin, t.data FROM task_events e'
+                ' LEFT JOIN tasks t ON t.id = e.task_id'
+                ' WHERE e.seq > ? ORDER BY e.seq LIMIT ?', (seq, limit)
+            ).fetchall()
+
+    def last_event_seq(self):
+        with self._lock:
+            row = self._conn.execute('SELECT MAX(seq) FROM task_events').fetchone()
+        return row[0] or 0
+
+    def prune_events(self, max_age):
+        """删除超过max_age秒的事件，保留最新的一条以维持序号递增"""
+        with self._lock:
+            self._conn.execute(
+                'DELETE FROM task_events WHERE created < ? AND seq < (SELECT MAX(seq) FROM task_events)',
+                (time.time() - max_age,)
+            )
+
+    def acquire_lease(self, name, owner, ttl):
+        """获取或续期租约，租约由其他进程持有且未过期时返回False"""
+        def write(conn):
+            now = time.time()
+            row = conn.execute('SELECT owner, expires FROM leases WHERE name = ?', (name,)).fetchone()
+            if row and row[0] != owner and row[1] > now:
+                return False
+            conn.execute('INSERT OR REPLACE INTO leases (name, owner, expires) VALUES (?, ?, ?)',
+                         (name, owner, now + ttl))
+            return True
+        return self._write_transaction(write)
+
+    def release_lease(self, name, owner):
+        with self._lock:
+            self._conn.execute('DELETE FROM leases WHERE name = ? AND owner = ?', (name, owner))
+
+    def acquire_submit_slot(self, task_id, model, limit, rate, burst, owner):
+        """多进程共享的提交准入，在一个写事务中检查模型并发上限和令牌桶
+
+        返回 (是否成功, 等待秒数)：成功时为task_id占用该模型的一个并发名额（记录owner）并消耗一个令牌；
+        并发名额已满时等待秒数为None，令牌不足时为下一个令牌可用的秒数。
+        task_id已占用名额时（例如其他进程正在提交同一个任务）直接返回成功，不改变名额的owner。
+        limit或rate为0表示不限制。已结束或已不存在的任务占用的名额（例如持有进程崩溃）先被清除。
+        """
+        def write(conn):
+            if conn.execute('SELECT 1 FROM submit_slots WHERE task_id = ?', (task_id,)).fetchone():
+                return True, 0.0
+            conn.execute(
+                "DELETE FROM submit_slots WHERE NOT EXISTS (SELECT 1 FROM tasks t WHERE t.id = submit_slots.task_id"
+                " AND t.status IN ('QUEUED', 'PENDING', 'RUNNING'))"
+            )
+            if limit:
+                count = conn.execute('SELECT COUNT(*) FROM submit_slots WHERE model = ?', (model,)).fetchone()[0]
+                if count >= limit:
+                    return False, None
+            now = time.time()
+            if rate:
+                row = conn.execute("SELECT tokens, updated FROM submit_bucket WHERE name = 'submit'").fetchone()
+                capacity = max(1.0, burst)
+                tokens = capacity if row is None else min(capacity, row[0] + (now - row[1]) * rate)
+                if tokens < 1:
+                    return False, (1 - tokens) / rate
+                conn.execute("INSERT OR REPLACE INTO submit_bucket (name, tokens, updated) VALUES ('submit', ?, ?)",
+                             (tokens - 1, now))
+            conn.execute('INSERT INTO submit_slots (task_id, model, created, owner) VALUES (?, ?, ?, ?)',
+                         (task_id, model, now, owner))
+            return True, 0.0
+        return self._write_transaction(write)
+
+    def reserve_submit_slot(self, task_id, model, owner):
+        """记录已在DashScope上处理中的任务占用的名额（接管或重启后恢复），不检查上限
+
+        调用方持有该任务的轮询租约，名额的owner改为调用方，任务结束时由它释放。
+        """
+        with self._lock:
+            self._conn.execute(
+                'INSERT INTO submit_slots (task_id, model, created, owner) VALUES (?, ?, ?, ?)'
+                ' ON CONFLICT(task_id) DO UPDATE SET owner = excluded.owner',
+                (task_id, model, time.time(), owner)
+            )
+
+    def release_submit_slot(self, task_id, owner):
+        """释放owner占用的名额，名额由其他进程占用时不做任何修改"""
+        with self._lock:
+            self._conn.execute('DELETE FROM submit_slots WHERE task_id = ? AND owner = ?', (task_id, owner))
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class JsonTaskStore(TaskStore):
+    """兼容旧版的JSON文件存储，只用于开发和少量任务
+
+    每次写入都整体重写文件（耗时随任务数线性增长），先写临时文件再原子替换，崩溃时不会留下损坏的文件。
+    生产环境使用SqliteTaskStore；多进程模式（MULTI_WORKER）不支持此存储。
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._records = {}
+        self._removed = set()  # 本进程删除的任务ID，删除前开始的更新不会重新写入
+
+    def load_all(self):
+        records = {}
+        if os.path.exists(self.path):
+            with open(self.path, 'r', encoding='utf-8') as f:
+                records = json.load(f)
+        with self._lock:
+            self._records = dict(records)
+        return records
+
+    def get(self, task_id):
+        with self._lock:
+            task = self._records.get(task_id)
+        return dict(task) if task else None
+
+    def put(self, task):
+        with self._lock:
+            if task['id'] in self._removed:
+                return
+            current = self._records.get(task['id'])
+            if current and (current.get('version') or 0) > (task.get('version') or 0):
+                return
+            self._records[task['id']] = task
+            self._write()
+
+    def delete(self, task_id):
+        self.delete_many([task_id])
+
+    def delete_many(self, task_ids):
+        with self._lock:
+            self._removed.update(task_ids)
+            removed = [self._records.pop(task_id, None) for task_id in task_ids]
+            if any(task is not None for task in removed):
+                self._write()
+
+    def _write(self):
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp_path = tempfile.mkstemp(prefix='.tasks-', suffix='.tmp', dir=directory)
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(self._records, f, ensure_ascii=False, indent=2)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+
+def create_task_store(backend, db_path, json_path):
+    """根据配置创建任务存储后端"""
+    if backend == 'json':
+        return JsonTaskStore(json_path)
+    if backend == 'sqlite':
+        return SqliteTaskStore(db_path, legacy_json=json_path)
+    raise ValueError(f'不支持的任务存储后端: {backend}')
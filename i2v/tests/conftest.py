@@ -0,0 +1,70 @@
+import os
+import sys
+import time
+import uuid
+from datetime import datetime
+
+import pytest
+
+I2V_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, I2V_DIR)
+sys.path.insert(0, os.path.join(I2V_DIR, 'bench'))
+
+
+@pytest.fixture(scope='session')
+def app_module(tmp_path_factory):
+    """在临时目录中导入应用，DashScope接口由本地模拟服务器提供
+
+    app模块在导入时读取配置并开始预热，整个测试会话只导入一次。
+    """
+    from fake_dashscope import FakeDashScope, serve
+
+    workdir = tmp_path_factory.mktemp('i2v')
+    # 显式设置的环境变量不会被i2v/.env覆盖
+    os.environ.update({
+        'DASHSCOPE_API_KEY': 'test',
+        'TASKS_FILE': str(workdir / 'tasks.json'),
+        'UPLOAD_FOLDER': str(workdir / 'uploads'),
+        'OUTPUT_FOLDER': str(workdir / 'downloads'),
+        'COMPACTION_INTERVAL': '0',
+        'RESULT_CACHE_ENABLED': 'false',
+        'LOG_LEVEL': 'WARNING',
+        'LOG_FORMAT': 'text',
+    })
+    os.chdir(workdir)
+    fake = FakeDashScope(submit_latency=0, poll_latency=0, pending_time=0.1, run_time=0.2)
+    server, url = serve(fake)
+
+    import app
+    app.DASHSCOPE_BASE_URL = url
+    deadline = time.monotonic() + 10
+    while not app.startup.ready:
+        assert time.monotonic() < deadline, '应用预热超时'
+        time.sleep(0.01)
+    yield app
+    server.shutdown()
+
+
+@pytest.fixture
+def add_task(app_module):
+    """把一个任务加入内存和任务存储，返回任务记录"""
+    def add(**fields):
+        task = {
+            'id': str(uuid.uuid4()),
+            'status': 'RUNNING',
+            'prompt': 'test',
+            'model': 'wanx2.1-i2v-turbo',
+            'resolution': '720P',
+            'created_at': datetime.now().isoformat(),
+            'async_task_id': str(uuid.uuid4()),
+            'input_file': None,
+            'output_path': None,
+            'video_url': None,
+            'error': None,
+            'message': '',
+        }
+        task.update(fields)
+        with app_module.tasks_lock:
+            app_module.add_task_locked(task)
+        return app_module.save_task(task['id'])
+    return add
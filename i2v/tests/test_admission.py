@@ -0,0 +1,175 @@
+import threading
+import time
+
+import pytest
+
+from admission import AdmissionController, SUBMIT_OK, SUBMIT_THROTTLED, SUBMIT_FAILED, SUBMIT_SKIPPED
+from cluster import SharedAdmissionLimits
+from storage import SqliteTaskStore
+
+
+def wait_until(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, '等待超时'
+        time.sleep(0.01)
+
+
+def make_controller(submit_func, **kwargs):
+    kwargs.setdefault('qps', 0)
+    controller = AdmissionController(submit_func, **kwargs)
+    controller.start()
+    return controller
+
+
+def inflight(controller, model='m'):
+    return controller.stats()['inflight_by_model'].get(model, 0)
+
+
+def raise_error(task_id):
+    raise RuntimeError('boom')
+
+
+@pytest.mark.parametrize('submit_func', [
+    lambda task_id: SUBMIT_FAILED,
+    lambda task_id: SUBMIT_SKIPPED,
+    raise_error,
+], ids=['failed', 'skipped', 'exception'])
+def test_submit_errors_release_slot(submit_func):
+    calls = []
+
+    def submit(task_id):
+        calls.append(task_id)
+        return submit_func(task_id)
+
+    controller = make_controller(submit, default_limit=1)
+    controller.enqueue('t1', 'm')
+    controller.enqueue('t2', 'm')
+    # 第一个任务释放名额后第二个任务才能提交
+    wait_until(lambda: len(calls) == 2)
+    wait_until(lambda: inflight(controller) == 0)
+
+
+def test_submit_ok_holds_slot_until_release():
+    calls = []
+
+    def submit(task_id):
+        calls.append(task_id)
+        return SUBMIT_OK
+
+    controller = make_controller(submit, default_limit=1)
+    controller.enqueue('t1', 'm')
+    controller.enqueue('t2', 'm')
+    wait_until(lambda: calls == ['t1'])
+    time.sleep(0.1)
+    assert calls == ['t1'] and controller.position('t2') == 1
+    controller.release('t1')
+    wait_until(lambda: calls == ['t1', 't2'])
+
+
+def test_throttled_submit_requeues_in_place():
+    results = iter([SUBMIT_THROTTLED, SUBMIT_OK])
+    calls = []
+
+    def submit(task_id):
+        calls.append(task_id)
+        return next(results)
+
+    controller = make_controller(submit, default_limit=1, throttle_pause=0.05)
+    controller.enqueue('t1', 'm')
+    wait_until(lambda: calls == ['t1', 't1'])
+    assert inflight(controller) == 1
+
+
+class BlockingShared:
+    """try_acquire阻塞到测试放行，模拟共享存储的磁盘IO"""
+    retry_interval = 0.05
+
+    def __init__(self):
+        self.entered = threading.Event()
+        self.proceed = threading.Event()
+        self.released = []
+
+    def try_acquire(self, task_id, model, limit):
+        self.entered.set()
+        self.proceed.wait(5)
+        return True, 0.0
+
+    def reserve(self, task_id, model):
+        pass
+
+    def release(self, task_id):
+        self.released.append(task_id)
+
+
+def test_shared_acquire_does_not_hold_condition_lock():
+    shared = BlockingShared()
+    calls = []
+    controller = make_controller(lambda task_id: calls.append(task_id) or SUBMIT_OK, shared=shared)
+    controller.mark_inflight('running', 'm')
+    controller.enqueue('t1', 'm')
+    assert shared.entered.wait(5)
+
+    # 获取共享名额期间查询排队位置和释放名额都不需要等待
+    started = time.monotonic()
+    assert controller.position('t1') == 1
+    controller.release('running')
+    assert controller.stats()['queued'] == 1
+    assert time.monotonic() - started < 1
+
+    shared.proceed.set()
+    wait_until(lambda: calls == ['t1'])
+    assert shared.released == ['running']
+
+
+def test_task_cancelled_while_acquiring_releases_shared_slot():
+    shared = BlockingShared()
+    calls = []
+    controller = make_controller(lambda task_id: calls.append(task_id) or SUBMIT_OK, shared=shared)
+    controller.enqueue('t1', 'm')
+    assert shared.entered.wait(5)
+    assert controller.cancel('t1')
+    shared.proceed.set()
+    wait_until(lambda: shared.released == ['t1'])
+    assert calls == [] and inflight(controller) == 0
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = SqliteTaskStore(str(tmp_path / 'tasks.db'))
+    yield store
+    store.close()
+
+
+def slot_owners(store):
+    with store._lock:
+        return dict(store._conn.execute('SELECT task_id, owner FROM submit_slots').fetchall())
+
+
+def test_shared_slot_is_only_released_by_its_owner(store):
+    store.put({'id': 't1', 'status': 'QUEUED', 'created_at': '2026-01-01T00:00:00', 'version': 1})
+    worker_a = SharedAdmissionLimits(store, 0, 5, 'worker-a')
+    worker_b = SharedAdmissionLimits(store, 0, 5, 'worker-b')
+
+    assert worker_a.try_acquire('t1', 'm', 1) == (True, 0.0)
+    # 另一个进程重新排队了同一个任务：不占用新名额，它跳过提交后的释放也不影响正在提交的进程
+    assert worker_b.try_acquire('t1', 'm', 1) == (True, 0.0)
+    worker_b.release('t1')
+    assert slot_owners(store) == {'t1': 'worker-a'}
+
+    worker_a.release('t1')
+    assert slot_owners(store) == {}
+
+
+def test_reserve_transfers_slot_to_the_poller(store):
+    store.put({'id': 't1', 'status': 'RUNNING', 'created_at': '2026-01-01T00:00:00', 'version': 1})
+    worker_a = SharedAdmissionLimits(store, 0, 5, 'worker-a')
+    worker_b = SharedAdmissionLimits(store, 0, 5, 'worker-b')
+    assert worker_a.try_acquire('t1', 'm', 1)[0]
+
+    # 持有轮询租约的进程接管任务后由它释放名额
+    worker_b.reserve('t1', 'm')
+    assert slot_owners(store) == {'t1': 'worker-b'}
+    assert worker_a.try_acquire('t2', 'm', 1) == (False, None)
+    worker_b.release('t1')
+    assert worker_a.try_acquire('t2', 'm', 1) == (True, 0.0)
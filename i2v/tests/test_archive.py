@@ -0,0 +1,40 @@
+def finished_task(add_task, **fields):
+    return add_task(status='SUCCEEDED', completed_at='2026-01-01T00:00:00', **fields)
+
+
+def test_update_racing_archival_does_not_resurrect_task(app_module, add_task, monkeypatch):
+    app = app_module
+    task = finished_task(add_task)
+    put = app.task_store.put
+
+    def put_after_archival(record):
+        # 更新已替换内存中的记录、尚未写入存储时，归档删除了该任务
+        if record['id'] == task['id']:
+            app.remove_archived_tasks([app.tasks[task['id']]])
+        put(record)
+
+    monkeypatch.setattr(app.task_store, 'put', put_after_archival)
+    app.update_task(task['id'], message='late update')
+    assert task['id'] not in app.tasks
+    assert app.task_store.get(task['id']) is None
+    assert task['id'] not in app.task_store.load_all()
+
+
+def test_archival_bumps_version_and_reports_removal(app_module, add_task):
+    app = app_module
+    task = finished_task(add_task)
+    client = app.app.test_client()
+    listing = client.get('/tasks')
+    etag, version = listing.headers['ETag'], listing.json['version']
+    subscriber, _, _ = app.sse_hub.subscribe()
+    try:
+        assert app.remove_archived_tasks([app.tasks[task['id']]])
+        messages = subscriber.drain(0.1) or []
+    finally:
+        app.sse_hub.unsubscribe(subscriber)
+
+    assert client.get('/tasks', headers={'If-None-Match': etag}).status_code == 200
+    delta = client.get(f'/tasks?since={version}').json
+    assert delta['removed'] == [task['id']]
+    assert delta['version'] > version
+    assert any('"task_removed"' in message and task['id'] in message for message in messages)
@@ -0,0 +1,56 @@
+import io
+
+from PIL import Image
+
+
+def png_bytes(color):
+    buffer = io.BytesIO()
+    Image.new('RGB', (32, 32), color).save(buffer, 'PNG')
+    return buffer.getvalue()
+
+
+def post_batch(client, image, **fields):
+    data = {'image': (io.BytesIO(image), 'in.png'), 'prompt': ['a', 'b'], **fields}
+    return client.post('/generate/batch', data=data)
+
+
+def test_repeated_batch_reuses_tasks(app_module, monkeypatch):
+    monkeypatch.setattr(app_module, 'RESULT_CACHE_ENABLED', True)
+    client = app_module.app.test_client()
+    image = png_bytes((1, 2, 3))
+
+    first = post_batch(client, image)
+    assert first.status_code == 202
+    assert first.json['reused'] == 0
+    first_ids = [task['task_id'] for task in first.json['tasks']]
+
+    second = post_batch(client, image)
+    assert second.status_code == 200
+    assert second.json['batch_id'] is None
+    assert second.json['reused'] == 2
+    assert [task['task_id'] for task in second.json['tasks']] == first_ids
+    assert all(task['cached'] for task in second.json['tasks'])
+    assert not app_module.result_cache.stats()['inflight']
+
+
+def test_batch_force_and_duplicates_in_one_batch(app_module, monkeypatch):
+    monkeypatch.setattr(app_module, 'RESULT_CACHE_ENABLED', True)
+    client = app_module.app.test_client()
+    image = png_bytes((4, 5, 6))
+    first = post_batch(client, image)
+
+    forced = post_batch(client, image, force='true')
+    assert forced.status_code == 202
+    assert forced.json['reused'] == 0
+    assert not {t['task_id'] for t in forced.json['tasks']} & {t['task_id'] for t in first.json['tasks']}
+
+    # 同一批次中重复的组合只创建一个任务
+    duplicate = client.post('/generate/batch', data={
+        'image': [(io.BytesIO(png_bytes((7, 8, 9))), 'a.png'), (io.BytesIO(png_bytes((7, 8, 9))), 'b.png')],
+        'prompt': 'same',
+    })
+    assert duplicate.status_code == 202
+    ids = [task['task_id'] for task in duplicate.json['tasks']]
+    assert len(ids) == 2 and ids[0] == ids[1]
+    assert app_module.batch_summary(duplicate.json['batch_id'])['total'] == 1
+    assert not app_module.result_cache.stats()['inflight']
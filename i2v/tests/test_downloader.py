@@ -0,0 +1,52 @@
+import os
+
+import pytest
+
+import downloader
+from downloader import VideoDownloader
+from fake_dashscope import FakeDashScope, serve
+from http_client import HttpClient
+
+
+@pytest.fixture(scope='module')
+def video_url():
+    fake = FakeDashScope(submit_latency=0, poll_latency=0, video_size=5 * 64 * 1024)
+    server, _ = serve(fake)
+    task_id = fake.submit({'model': 'test'})
+    yield f'{fake.base_url}/videos/{task_id}.mp4', fake
+    server.shutdown()
+
+
+def test_segment_is_synced_before_it_is_recorded_done(video_url, tmp_path, monkeypatch):
+    url, fake = video_url
+    events = []
+    in_meta = []
+    fsync = os.fsync
+    save_meta = VideoDownloader._save_meta
+
+    def record_fsync(fd):
+        if not in_meta:
+            events.append('fsync')
+        fsync(fd)
+
+    def record_save_meta(self, meta_path, total, done):
+        events.append('meta')
+        in_meta.append(True)
+        try:
+            save_meta(self, meta_path, total, done)
+        finally:
+            in_meta.pop()
+
+    monkeypatch.setattr(downloader.os, 'fsync', record_fsync)
+    monkeypatch.setattr(VideoDownloader, '_save_meta', record_save_meta)
+    video_downloader = VideoDownloader(HttpClient(), segment_size=64 * 1024)
+    dest = str(tmp_path / 'video.mp4')
+    future, _ = video_downloader.submit(url, dest)
+    result = future.result(timeout=10)
+
+    assert result['segments'] == 5
+    assert os.path.getsize(dest) == fake.video_size
+    assert not os.path.exists(dest + '.part.json')
+    # 每次记录分段完成之前都先把数据落盘
+    assert events.count('meta') == 5
+    assert all(events[i - 1] == 'fsync' for i, event in enumerate(events) if event == 'meta')
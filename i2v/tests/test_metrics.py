@@ -0,0 +1,31 @@
+import threading
+
+from metrics import Counter, Histogram
+
+
+def run_threads(count, func):
+    for _ in range(count):
+        thread = threading.Thread(target=func)
+        thread.start()
+        thread.join()
+
+
+def test_shards_of_exited_threads_are_folded():
+    counter = Counter('requests_total', 'test')
+    histogram = Histogram('latency_seconds', 'test', buckets=(0.1, 1.0))
+    child = counter.labels()
+
+    def work():
+        counter.inc()
+        histogram.observe(0.5)
+
+    # 每个请求一个线程：分片数量不随线程总数增长
+    run_threads(200, work)
+    assert len(child._shards._shards) < 64
+    assert child.value() == 200
+    assert len(child._shards._shards) == 0
+
+    counter.inc(2)
+    assert child.value() == 202
+    totals = histogram.labels()._shards.total()
+    assert totals == [0, 200, 200, 100.0]
@@ -0,0 +1,46 @@
+import json
+
+SERVER_ONLY_FIELDS = {'input_file', 'output_path', 'video_url', 'async_task_id', 'cache_key', 'input_sha256'}
+
+
+def task_events(subscriber, task_id):
+    events = []
+    for message in subscriber.drain(0.1) or []:
+        data = json.loads(message.split('data: ', 1)[1])
+        if data.get('task_id') == task_id:
+            events.append(data)
+    return events
+
+
+def test_task_list_projection_has_no_server_paths(app_module, add_task):
+    app = app_module
+    task = add_task(input_file='/srv/uploads/a.png', input_sha256='abc', cache_key='key',
+                    video_url='https://example.com/a.mp4', output_path='/srv/downloads/a.mp4')
+    client = app.app.test_client()
+    fields = ','.join(app.TASK_LIST_FIELDS)
+    listed = [t for t in client.get(f'/tasks?limit=500&fields={fields}').json['tasks'] if t['id'] == task['id']]
+    assert listed
+    assert not SERVER_ONLY_FIELDS & set(listed[0])
+    assert listed[0]['has_input'] and listed[0]['has_output']
+    assert listed[0]['thumbnail_url'] == f"/thumbnail/{task['id']}/input"
+    # 页面请求的字段与服务端的定义一致
+    assert f"const TASK_LIST_FIELDS = '{fields}'" in client.get('/').get_data(as_text=True)
+
+
+def test_sse_events_use_list_projection(app_module, add_task):
+    app = app_module
+    subscriber, _, _ = app.sse_hub.subscribe()
+    try:
+        task = add_task(input_file='/srv/uploads/b.png', input_sha256='def', cache_key='key',
+                        async_task_id='dashscope-id')
+        first = task_events(subscriber, task['id'])[-1]
+        assert first['changes']['id'] == task['id']
+        assert first['changes']['has_input'] is True and first['changes']['has_output'] is False
+        assert not SERVER_ONLY_FIELDS & set(first['changes'])
+        assert set(first['changes']) <= app.TASK_LIST_PROJECTION
+
+        app.update_task(task['id'], output_path='/srv/downloads/b.mp4', video_url='https://example.com/b.mp4')
+        second = task_events(subscriber, task['id'])[-1]
+        assert second['changes'] == {'has_output': True, 'version': second['seq']}
+    finally:
+        app.sse_hub.unsubscribe(subscriber)
@@ -0,0 +1,70 @@
+import io
+import time
+
+from PIL import Image
+
+
+class MalformedResponse:
+    """DashScope返回200但缺少output字段的响应"""
+    status_code = 200
+    text = '{}'
+
+    def json(self):
+        return {'request_id': 'malformed'}
+
+
+def inflight(app, model):
+    return app.admission.stats()['inflight_by_model'].get(model, 0)
+
+
+def test_unexpected_poll_error_retries_then_fails_and_releases_slot(app_module, add_task, monkeypatch):
+    app = app_module
+    monkeypatch.setattr(app, 'POLL_MAX_ERRORS', 3)
+    monkeypatch.setattr(app.http_client, 'get', lambda *args, **kwargs: MalformedResponse())
+    task = add_task(model='test-poll-error')
+    app.admission.mark_inflight(task['id'], task['model'])
+
+    # 出错次数未到上限时继续检查，任务仍占用名额
+    assert app._check_task_status(task['id']) == app.POLL_INTERVAL
+    assert app._check_task_status(task['id']) == app.POLL_INTERVAL
+    assert app.tasks[task['id']]['status'] == 'RUNNING'
+    assert inflight(app, task['model']) == 1
+
+    # 达到上限后任务失败，名额释放
+    assert app._check_task_status(task['id']) is None
+    assert app.tasks[task['id']]['status'] == 'FAILED'
+    assert app.tasks[task['id']]['error_code'] == 'POLL_ERROR'
+    assert inflight(app, task['model']) == 0
+    assert task['id'] not in app.poll_errors
+
+
+def test_poll_error_count_resets_after_successful_poll(app_module, add_task, monkeypatch):
+    app = app_module
+    monkeypatch.setattr(app, 'POLL_MAX_ERRORS', 2)
+    task = add_task(model='test-poll-reset')
+    app.admission.mark_inflight(task['id'], task['model'])
+
+    with monkeypatch.context() as patch:
+        patch.setattr(app.http_client, 'get', lambda *args, **kwargs: MalformedResponse())
+        assert app._check_task_status(task['id']) == app.POLL_INTERVAL
+    # 模拟服务器上不存在该任务，返回404后任务正常结束
+    assert app._check_task_status(task['id']) is None
+    assert task['id'] not in app.poll_errors
+    assert app.tasks[task['id']]['error_code'] == 'TASK_NOT_FOUND'
+    assert inflight(app, task['model']) == 0
+
+
+def test_finished_generation_releases_slot(app_module):
+    app = app_module
+    buffer = io.BytesIO()
+    Image.new('RGB', (32, 32), (200, 100, 0)).save(buffer, 'PNG')
+    client = app.app.test_client()
+    response = client.post('/generate', data={'image': (io.BytesIO(buffer.getvalue()), 'in.png'),
+                                              'prompt': 'release', 'model': 'wanx2.1-i2v-plus'})
+    assert response.status_code in (200, 202)
+    task_id = response.json['task_id']
+    deadline = time.monotonic() + 10
+    while app.tasks[task_id]['status'] != 'SUCCEEDED':
+        assert time.monotonic() < deadline, '任务未完成'
+        time.sleep(0.05)
+    assert inflight(app, 'wanx2.1-i2v-plus') == 0
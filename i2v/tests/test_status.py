@@ -0,0 +1,40 @@
+import os
+import uuid
+
+import pytest
+
+
+def stored_only_task(app, **fields):
+    """只在任务存储中、不在内存中的任务（预热中或其他进程刚创建）"""
+    task = {'id': str(uuid.uuid4()), 'status': 'SUCCEEDED', 'model': 'wanx2.1-i2v-turbo',
+            'created_at': '2026-01-01T00:00:00', 'version': 1, 'input_file': None, **fields}
+    app.task_store.put(task)
+    return task
+
+
+@pytest.mark.parametrize('ready, multi_worker', [(False, False), (True, True)], ids=['warmup', 'multi-worker'])
+def test_status_serves_stored_task_read_only(app_module, monkeypatch, ready, multi_worker):
+    app = app_module
+    monkeypatch.setattr(app.startup, 'ready', ready)
+    monkeypatch.setattr(app, 'MULTI_WORKER', multi_worker)
+    task = stored_only_task(app)
+
+    response = app.app.test_client().get(f"/status/{task['id']}?wait=0.1&version=1")
+    assert response.status_code == 200
+    assert response.json['task']['status'] == 'SUCCEEDED'
+    assert task['id'] not in app.tasks
+
+
+def test_download_during_warmup_leaves_stored_task_untouched(app_module, monkeypatch):
+    app = app_module
+    monkeypatch.setattr(app.startup, 'ready', False)
+    task = stored_only_task(app)
+    path = os.path.join(app.app.config['OUTPUT_FOLDER'], f"{task['id']}.mp4")
+    with open(path, 'wb') as f:
+        f.write(b'\0' * 1024)
+
+    response = app.app.test_client().get(f"/download/{task['id']}")
+    assert response.status_code == 200
+    response.close()
+    assert task['id'] not in app.tasks
+    assert app.task_store.get(task['id']) == task
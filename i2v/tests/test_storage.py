@@ -0,0 +1,47 @@
+import pytest
+
+from storage import SqliteTaskStore, JsonTaskStore
+
+
+def make_task(task_id, version, status='RUNNING'):
+    return {'id': task_id, 'status': status, 'created_at': '2026-01-01T00:00:00', 'version': version}
+
+
+@pytest.fixture(params=['sqlite', 'json'])
+def store(request, tmp_path):
+    if request.param == 'sqlite':
+        store = SqliteTaskStore(str(tmp_path / 'tasks.db'))
+    else:
+        store = JsonTaskStore(str(tmp_path / 'tasks.json'))
+    store.load_all()
+    yield store
+    store.close()
+
+
+def test_older_version_does_not_overwrite_newer(store):
+    store.put(make_task('t1', 2, 'SUCCEEDED'))
+    store.put(make_task('t1', 1, 'RUNNING'))
+    assert store.get('t1')['status'] == 'SUCCEEDED'
+    store.put(make_task('t1', 3, 'FAILED'))
+    assert store.get('t1')['status'] == 'FAILED'
+
+
+def test_put_after_delete_is_ignored(store):
+    store.put(make_task('t1', 1))
+    store.put(make_task('t2', 1))
+    store.delete_many(['t1'])
+    # 删除前开始的更新在删除之后到达
+    store.put(make_task('t1', 2))
+    assert store.get('t1') is None
+    assert set(store.load_all()) == {'t2'}
+
+
+def test_put_versioned_after_delete_is_ignored(tmp_path):
+    store = SqliteTaskStore(str(tmp_path / 'tasks.db'))
+    seq = store.put_versioned(make_task('t1', 0), 'worker-a')
+    store.delete_many_versioned(['t1'], 'worker-a')
+    assert store.put_versioned(make_task('t1', seq), 'worker-b') is None
+    assert store.get('t1') is None
+    # 没有为被忽略的写入追加事件
+    assert [(task_id, data) for _, task_id, _, data in store.events_since(0)] == [('t1', None), ('t1', None)]
+    store.close()
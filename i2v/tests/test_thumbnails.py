@@ -0,0 +1,33 @@
+import os
+import time
+
+from PIL import Image
+
+from thumbnails import ThumbnailCache, STALE_TMP_AGE
+
+
+def touch(path, age=0, size=100):
+    with open(path, 'wb') as f:
+        f.write(b'\0' * size)
+    mtime = time.time() - age
+    os.utime(path, (mtime, mtime))
+
+
+def test_temp_files_are_not_cached_and_stale_ones_are_removed(tmp_path):
+    root = tmp_path / 'thumbnails'
+    (root / '.tmp').mkdir(parents=True)
+    touch(root / '.tmp-legacy.jpg', age=STALE_TMP_AGE + 10)
+    touch(root / '.tmp' / 'thumb-stale.jpg', age=STALE_TMP_AGE + 10)
+    touch(root / '.tmp' / 'thumb-inflight.jpg')
+
+    cache = ThumbnailCache(str(root), size=32)
+    assert sorted(os.listdir(root / '.tmp')) == ['thumb-inflight.jpg']
+    assert not (root / '.tmp-legacy.jpg').exists()
+    assert cache.stats()['files'] == 0
+
+    src = tmp_path / 'src.png'
+    Image.new('RGB', (64, 64), (10, 20, 30)).save(src)
+    path = cache.image_thumbnail(str(src), 'key')
+    assert path == os.path.join(str(root), 'key.jpg')
+    assert cache.stats()['files'] == 1
+    assert sorted(os.listdir(root / '.tmp')) == ['thumb-inflight.jpg']
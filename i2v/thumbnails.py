@@ -0,0 +1,128 @@
+import os
+import time
+import shutil
+import tempfile
+import logging
+import threading
+import subprocess
+from result_cache import DiskLRU
+
+logger = logging.getLogger(__name__)
+
+# Pillow和ffmpeg都是可选依赖，缺少时对应的缩略图不可用，由调用方回退到原文件
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+FFMPEG = shutil.which('ffmpeg')
+
+# 生成中的缩略图临时文件超过该时间（秒）仍未完成时视为中断后遗留的文件（生成超时为30秒）
+STALE_TMP_AGE = 600
+
+
+class ThumbnailCache:
+    """输入图片缩略图和视频封面帧的磁盘缓存
+
+    缩略图只生成一次并保存为JPEG，总大小超过上限时按最久未访问淘汰，
+    被淘汰的缩略图在下次访问时重新生成。同一个缩略图并发请求时只生成一次。
+    生成中的临时文件放在 <root>/.tmp 中，不计入缓存大小，启动时清理中断后遗留的临时文件。
+    """
+
+    def __init__(self, root, size=400, max_bytes=256 * 1024 * 1024):
+        self.root = root
+        self.size = size
+        self.tmp_dir = os.path.join(root, '.tmp')
+        os.makedirs(self.tmp_dir, exist_ok=True)
+        self._remove_stale_tmp()
+        self._lru = DiskLRU(max_bytes)
+        self._lru.scan(root, '.jpg')
+        self._lock = threading.Lock()
+        self._key_locks = {}
+
+    @property
+    def images_supported(self):
+        return Image is not None
+
+    @property
+    def posters_supported(self):
+        return FFMPEG is not None
+
+    def image_thumbnail(self, src_path, key):
+        """返回图片缩略图路径，无法生成时返回None"""
+        if not self.images_supported:
+            return None
+        return self._get_or_create(f'{key}.jpg', lambda dest: self._make_image_thumbnail(src_path, dest))
+
+    def video_poster(self, src_path, key):
+        """返回视频封面帧路径，无法生成时返回None"""
+        if not self.posters_supported:
+            return None
+        return self._get_or_create(f'{key}.poster.jpg', lambda dest: self._make_video_poster(src_path, dest))
+
+    def _get_or_create(self, name, make):
+        path = os.path.join(self.root, name)
+        if os.path.exists(path):
+            self._lru.touch(path)
+            return path
+        with self._lock:
+            key_lock = self._key_locks.setdefault(name, threading.Lock())
+        try:
+            with key_lock:
+                if os.path.exists(path):
+                    return path
+                fd, tmp_path = tempfile.mkstemp(suffix='.jpg', dir=self.tmp_dir, prefix='thumb-')
+                os.close(fd)
+                try:
+                    make(tmp_path)
+                    os.replace(tmp_path, path)
+                except Exception as e:
+                    logger.warning("生成缩略图 %s 失败: %s", name, e)
+                    return None
+                finally:
+                    if os.path.exists(tmp_path):
+                        os.remove(tmp_path)
+        finally:
+            with self._lock:
+                self._key_locks.pop(name, None)
+        for evicted in self._lru.add(path):
+            try:
+                os.remove(evicted)
+            except FileNotFoundError:
+                pass
+        return path
+
+    def _remove_stale_tmp(self):
+        """删除中断后遗留的临时文件（包括旧版本直接放在缓存目录中的 .tmp-*.jpg）
+
+        多进程部署时其他进程可能正在生成缩略图，只删除超过STALE_TMP_AGE的文件。
+        """
+        cutoff = time.time() - STALE_TMP_AGE
+        candidates = [os.path.join(self.tmp_dir, name) for name in os.listdir(self.tmp_dir)]
+        candidates += [os.path.join(self.root, name) for name in os.listdir(self.root) if name.startswith('.tmp-')]
+        for path in candidates:
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                logger.warning("删除缩略图临时文件 %s 失败: %s", path, e)
+
+    def _make_image_thumbnail(self, src_path, dest_path):
+        with Image.open(src_path) as img:
+            img.thumbnail((self.size, self.size))
+            img.convert('RGB').save(dest_path, 'JPEG', quality=80, optimize=True)
+
+    def _make_video_poster(self, src_path, dest_path):
+        # 取第1秒附近的一帧，缩放到缩略图大小
+        subprocess.run(
+            [FFMPEG, '-y', '-loglevel', 'error', '-ss', '1', '-i', src_path, '-frames:v', '1',
+             '-vf', f"scale='min({self.size},iw)':-2", '-f', 'image2', dest_path],
+            check=True, timeout=30, capture_output=True,
+        )
+        if os.path.getsize(dest_path) == 0:
+            raise RuntimeError('ffmpeg未输出封面帧')
+
+    def stats(self):
+        return self._lru.stats()
@@ -0,0 +1,162 @@
+import os
+import base64
+import hashlib
+import tempfile
+import threading
+from collections import Counter, OrderedDict
+
+
+class FileTooLargeError(ValueError):
+    """上传文件超过大小限制"""
+
+
+class UploadStore:
+    """按内容哈希存储上传文件
+
+    文件保存为 <root>/<哈希前2位>/<哈希3-4位>/<sha256>.<扩展名>，相同内容只保存一份，
+    路径内容不可变。引用计数来自任务记录中的input_file，计数归零的文件会被删除。
+    重复上传的热点图片会把base64编码结果放入有大小上限的LRU缓存，
+    再次提交时不需要读取磁盘和重新编码。
+    """
+
+    COPY_CHUNK_SIZE = 64 * 1024
+
+    def __init__(self, root, max_size=None, cache_bytes=64 * 1024 * 1024):
+        self.root = root
+        self.max_size = max_size
+        self.cache_bytes = cache_bytes
+        self._lock = threading.Lock()
+        self._refs = Counter()
+        self._cache = OrderedDict()  # sha256 -> base64编码后的bytes
+        self._cache_size = 0
+        self._tmp_dir = os.path.join(root, '.tmp')
+        os.makedirs(self._tmp_dir, exist_ok=True)
+
+    def path_for(self, digest, ext):
+        return os.path.join(self.root, digest[:2], digest[2:4], f'{digest}.{ext}')
+
+    def is_managed(self, path):
+        """判断路径是否由本存储管理（旧版按文件名保存的上传文件不参与引用计数）"""
+        if not path:
+            return False
+        rel = os.path.relpath(os.path.abspath(path), os.path.abspath(self.root))
+        parts = rel.split(os.sep)
+        return len(parts) == 3 and parts[0] != '..' and not parts[0].startswith('.')
+
+    def save(self, stream, ext):
+        """流式保存上传内容并计算哈希，返回 (sha256, 路径, 是否已存在)
+
+        返回时已为调用方持有一个引用，不再使用时需调用release()。
+        """
+        hasher = hashlib.sha256()
+        size = 0
+        fd, tmp_path = tempfile.mkstemp(dir=self._tmp_dir)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                while True:
+                    chunk = stream.read(self.COPY_CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    size += len(chunk)
+                    if self.max_size and size > self.max_size:
+                        raise FileTooLargeError(f'文件大小超过限制 ({self.max_size} 字节)')
+                    hasher.update(chunk)
+                    f.write(chunk)
+            digest = hasher.hexdigest()
+            path = self.path_for(digest, ext)
+            with self._lock:
+                existed = os.path.exists(path)
+                if existed:
+                    os.remove(tmp_path)
+                    # 更新修改时间，按时间淘汰输入图片时最近重复上传的图片最后淘汰
+                    os.utime(path)
+                else:
+                    os.makedirs(os.path.dirname(path), exist_ok=True)
+                    os.replace(tmp_path, path)
+                self._refs[path] += 1
+            return digest, path, existed
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def add_ref(self, path):
+        if not self.is_managed(path):
+            return
+        with self._lock:
+            self._refs[path] += 1
+
+    def release(self, path):
+        """释放一个引用，计数归零时删除文件"""
+        if not self.is_managed(path):
+            return
+        with self._lock:
+            self._refs[path] -= 1
+            if self._refs[path] > 0:
+                return
+            del self._refs[path]
+            digest = os.path.splitext(os.path.basename(path))[0]
+            self._evict_cache_locked(digest)
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def evict(self, path):
+        """按保留策略删除文件，引用计数保持不变（相同内容再次上传时重新保存）"""
+        if not self.is_managed(path):
+            return False
+        with self._lock:
+            digest = os.path.splitext(os.path.basename(path))[0]
+            self._evict_cache_locked(digest)
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                return False
+        return True
+
+    def reset_refs(self, paths):
+        """根据任务记录中的文件路径重建引用计数"""
+        refs = Counter(path for path in paths if self.is_managed(path))
+        with self._lock:
+            self._refs = refs
+
+    def ref_count(self, path):
+        with self._lock:
+            return self._refs.get(path, 0)
+
+    def get_base64(self, digest):
+        """从缓存获取base64编码结果，未缓存时返回None"""
+        with self._lock:
+            encoded = self._cache.get(digest)
+            if encoded is not None:
+                self._cache.move_to_end(digest)
+            return encoded
+
+    def load_base64(self, digest, path):
+        """读取文件并编码后放入缓存；文件过大无法缓存时返回None"""
+        if os.path.getsize(path) * 4 // 3 > self.cache_bytes // 4:
+            return None
+        with open(path, 'rb') as f:
+            encoded = base64.b64encode(f.read())
+        with self._lock:
+            if digest not in self._cache:
+                self._cache[digest] = encoded
+                self._cache_size += len(encoded)
+                while self._cache_size > self.cache_bytes:
+                    self._evict_cache_locked(next(iter(self._cache)))
+        return encoded
+
+    def _evict_cache_locked(self, digest):
+        encoded = self._cache.pop(digest, None)
+        if encoded is not None:
+            self._cache_size -= len(encoded)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'files': len(self._refs),
+                'refs': sum(self._refs.values()),
+                'cache_entries': len(self._cache),
+                'cache_bytes': self._cache_size,
+            }
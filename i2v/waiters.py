@@ -0,0 +1,46 @@
+import threading
+
+
+class VersionWaiters:
+    """按任务等待变化的长轮询通知
+
+    等待同一任务的请求共享一个Event，任务变化时只唤醒这些请求，并移除该Event，
+    之后的等待者会注册新的Event。没有等待者的任务不占用任何资源。
+    调用方应在持有保护版本号的锁时注册，再在锁外等待，这样不会错过注册后发生的变化。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._events = {}  # 键 -> [Event, 等待者数量]
+
+    def register(self, key):
+        """注册一个等待者，返回之后传给wait()的Event"""
+        with self._lock:
+            entry = self._events.get(key)
+            if entry is None:
+                entry = self._events[key] = [threading.Event(), 0]
+            entry[1] += 1
+            return entry[0]
+
+    def wait(self, key, event, timeout):
+        """等待变化通知，返回是否在超时前收到通知"""
+        try:
+            return event.wait(timeout)
+        finally:
+            with self._lock:
+                entry = self._events.get(key)
+                if entry is not None and entry[0] is event:
+                    entry[1] -= 1
+                    if entry[1] <= 0:
+                        del self._events[key]
+
+    def notify(self, key):
+        """唤醒等待该键的所有请求"""
+        with self._lock:
+            entry = self._events.pop(key, None)
+        if entry is not None:
+            entry[0].set()
+
+    def stats(self):
+        with self._lock:
+            return {'keys': len(self._events), 'waiters': sum(entry[1] for entry in self._events.values())}